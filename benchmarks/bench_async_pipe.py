@@ -0,0 +1,155 @@
+"""Load test: concurrent part-number lookups through the async pipeline.
+
+Ollama and DuckDuckGo are replaced by fakes with configurable latency so the
+numbers reflect the pipeline itself: how many lookups one process can keep in
+flight, time to first byte, and how many threads that costs. Both entry points
+are measured: ``pipe`` driven from a thread per request (what the pipelines
+server does) and ``apipe`` consumed directly on an event loop.
+
+Needs the pipelines runtime (schemas, selector, aiohttp, duckduckgo_search).
+
+    python benchmarks/bench_async_pipe.py
+    python benchmarks/bench_async_pipe.py --users 1 8 32 128 --tokens 200 --token-rate 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pn
+from pipeline_utils.search import ConcurrentSearcher
+
+CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "catalog.json")
+PARAMS_TEXT = (
+    'DDR3L 1.35V 4Gb x16 800MHz 0°C to 95°C\n<get_filtered_products>\nget_filtered_products(\n'
+    '    type_of_ddr="DDR3 SDRAM or DDR3(L) SDRAM",\n    Operation_Voltage="T",\n    Density="4Gb",\n)\n'
+    '</get_filtered_products>'
+)
+
+
+class FakeOllama:
+    """Streams ``tokens`` SSE chunks after ``ttft`` seconds at ``token_rate`` tokens/s."""
+
+    def __init__(self, tokens, ttft, token_rate):
+        self.tokens = tokens
+        self.ttft = ttft
+        self.token_rate = token_rate
+
+    async def stream_chat(self, base_url, payload, headers=None, native=False):
+        words = (PARAMS_TEXT.split(" ") * (self.tokens // 10 + 1))[:self.tokens - 1] + [PARAMS_TEXT]
+        await asyncio.sleep(self.ttft)
+        for word in words:
+            await asyncio.sleep(1 / self.token_rate)
+            yield b"data: " + json.dumps({"choices": [{"delta": {"content": word + " "}}]}).encode()
+        yield b"data: [DONE]"
+
+    async def list_models(self, base_url, headers=None):
+        return None
+
+    async def close(self):
+        pass
+
+
+class FakeSearcher(ConcurrentSearcher):
+    search_latency = 0.5
+
+    def _fetch(self, query):
+        time.sleep(self.search_latency)
+        return [{"title": query, "href": f"https://example.com/{query}",
+                 "body": f"{query}: DDR3L 1.35V 4Gb x16 800MHz 0°C to 95°C"}]
+
+
+def make_pipeline(args):
+    pipeline = pn.Pipeline()
+    pipeline.valves.SEARCH_CACHE_ENABLED = False
+    pipeline.valves.STAGE_CACHE_ENABLED = False
+    pipeline.valves.PART_INDEX_ENABLED = False
+    pipeline.valves.SUMMARY_MODE = "llm"
+    pipeline.valves.CATALOG_PATH = CATALOG
+    pipeline.valves.OLLAMA_MAX_INFLIGHT = args.max_inflight
+    pipeline.valves.SEARCH_CONCURRENCY = 5
+    pipeline.ollama = FakeOllama(args.tokens, args.ttft, args.token_rate)
+    FakeSearcher.search_latency = args.search_latency
+
+    def make_searcher(max_results=None, region=None, max_retries=None):
+        return FakeSearcher(max_workers=pipeline.valves.SEARCH_CONCURRENCY, jitter=0,
+                            executor=pipeline.get_search_executor())
+    pipeline.make_searcher = make_searcher
+    asyncio.run(pipeline.on_startup())
+    return pipeline
+
+
+def run_threads(pipeline, users):
+    """One thread per request iterating pipe(), like the pipelines server."""
+    results = [None] * users
+    peak_threads = threading.active_count()
+
+    def worker(i):
+        start = time.perf_counter()
+        ttfb = None
+        for chunk in pipeline.pipe(f"MT41K256M16TW-{i:03d}", "pn", [], {}):
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+        results[i] = (ttfb, time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    peak_threads = max(peak_threads, threading.active_count())
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, results, peak_threads
+
+
+async def run_async(pipeline, users):
+    """All requests consumed from a single event loop through apipe()."""
+    async def one(i):
+        start = time.perf_counter()
+        ttfb = None
+        async for chunk in pipeline.apipe(f"MT41K256M16TW-{i:03d}", "pn", [], {}):
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+        return ttfb, time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(users)))
+    return time.perf_counter() - start, results, threading.active_count()
+
+
+def report(mode, users, wall, results, threads):
+    ttfb = [r[0] for r in results]
+    latency = sorted(r[1] for r in results)
+    p95 = latency[min(len(latency) - 1, int(len(latency) * 0.95))]
+    print(f"{mode:>7} {users:>6} {wall:>9.2f} {users / wall:>10.2f} {statistics.mean(ttfb) * 1000:>10.1f} "
+          f"{statistics.median(latency):>8.2f} {p95:>8.2f} {threads:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--tokens", type=int, default=100, help="completion tokens per LLM call")
+    parser.add_argument("--ttft", type=float, default=0.3, help="fake prefill time (s)")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="fake decode speed (tokens/s)")
+    parser.add_argument("--search-latency", type=float, default=0.5, help="fake DuckDuckGo latency (s)")
+    parser.add_argument("--max-inflight", type=int, default=64, help="OLLAMA_MAX_INFLIGHT")
+    args = parser.parse_args()
+
+    pipeline = make_pipeline(args)
+    print(f"{'mode':>7} {'users':>6} {'wall (s)':>9} {'lookups/s':>10} {'TTFB (ms)':>10} {'p50 (s)':>8} {'p95 (s)':>8} {'threads':>8}")
+    try:
+        for users in args.users:
+            report("pipe", users, *run_threads(pipeline, users))
+            wall, results, threads = asyncio.run(run_async(pipeline, users))
+            report("apipe", users, wall, results, threads)
+    finally:
+        asyncio.run(pipeline.on_shutdown())
+
+
+if __name__ == "__main__":
+    main()
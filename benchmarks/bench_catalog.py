@@ -0,0 +1,75 @@
+"""Microbenchmark of the bitmap-indexed catalog against a linear scan.
+
+The stand-in catalog fixture is replicated ``--scale`` times (with unique
+product ids) to get a realistic row count. Every query is checked against
+``fakes.select_products``, the selector's filter written as a plain scan;
+the fixture includes PSRAM and other non-decodable parts that only carry
+the selector columns as fields.
+
+    python benchmarks/bench_catalog.py --scale 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from fakes import CATALOG as FIXTURE, select_products
+from pipeline_utils.catalog import ProductCatalog
+
+QUERIES = [
+    dict(type_of_ddr="DDR3 SDRAM or DDR3(L) SDRAM", Operation_Voltage="T", Density="4Gb"),
+    dict(type_of_ddr="DDR3 SDRAM or DDR3(L) SDRAM", Operation_Voltage="T", Density="4Gb",
+         min_frequency_mhz=900, temperature_range=(0, 85)),
+    dict(type_of_ddr="SDRAM", Density="64Mb"),
+    dict(type_of_ddr="PSRAM"),
+    dict(type_of_ddr="PSRAM", Operation_Voltage="L", Density="64Mb"),
+    dict(Operation_Voltage="D"),
+    dict(temperature_range=(-40, 105), min_frequency_mhz=1600),
+]
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixture", default=FIXTURE)
+    parser.add_argument("--scale", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.fixture, encoding="utf-8") as f:
+        base = json.load(f)["products"]
+    products = [
+        {**p, "product_id": f"{p['product_id']}-{n}" if n else p["product_id"]}
+        for n in range(args.scale) for p in base
+    ]
+
+    start = time.perf_counter()
+    catalog = ProductCatalog(products)
+    build = time.perf_counter() - start
+    print(f"rows: {len(catalog)}  index build: {build * 1000:.1f} ms (once, at on_startup)\n")
+
+    print(f"{'query':<90} {'rows':>6} {'index':>10} {'scan':>10}")
+    for query in QUERIES:
+        selected = catalog.get_filtered_products(**query)
+        assert sorted(p["product_id"] for p in selected["products"]) == sorted(
+            p["product_id"] for p in select_products(products, **query))
+        rows = selected["total_matches"]
+        indexed = best_of(lambda: catalog.select(**query), args.repeat)
+        scanned = best_of(lambda: select_products(products, **query), max(1, args.repeat // 10))
+        label = ", ".join(f"{k}={v}" for k, v in query.items())
+        print(f"{label[:90]:<90} {rows:>6} {indexed * 1e6:>8.1f}us {scanned * 1e3:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Latency saved per request by decoding candidates with the naming rule.
+
+Compares the rule-based decoder (DECODE_MODE="rule") with the LLM decode
+stage it replaces. Without --ollama-url the LLM side is estimated from the
+size of the JSON it would have to generate; with it, the decode is run
+against a real Ollama server.
+
+    python benchmarks/bench_decode_stage.py
+    python benchmarks/bench_decode_stage.py --ollama-url http://ollama:11434
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.dram_decoder import decode_candidates
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "filtered_products.json")
+# qwen2.5 tokenizer averages roughly this many characters per token on JSON
+CHARS_PER_TOKEN = 3.5
+
+
+def time_rule_decode(filtered_products, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        records, _ = decode_candidates(filtered_products)
+    elapsed = (time.perf_counter() - start) / repeat
+    return elapsed, json.dumps(records, ensure_ascii=False, indent=2)
+
+
+def time_llm_decode(url, model, filtered_products):
+    import requests
+
+    prompt = (
+        f"This is the candidate products:\n{filtered_products}\n\n"
+        "Please decode the candidate products by the DRAM Naming Pattern "
+        "<Category> <Product Family> <Operation Voltage> <Density> <I/O Pin Number> <Address>, "
+        "and show the decoded result and all the features of the candidate product ids in json format."
+    )
+    start = time.perf_counter()
+    r = requests.post(
+        f"{url}/v1/chat/completions",
+        json={"model": model, "messages": [{"role": "user", "content": prompt}], "stream": False},
+        timeout=600,
+    )
+    r.raise_for_status()
+    return time.perf_counter() - start, r.json().get("usage", {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixture", default=FIXTURE)
+    parser.add_argument("--repeat", type=int, default=1000)
+    parser.add_argument("--ollama-url")
+    parser.add_argument("--model", default="qwen2.5-32b-20k:latest")
+    parser.add_argument("--tokens-per-sec", type=float, default=15.0,
+                        help="generation speed used for the estimate (32B on one GPU)")
+    args = parser.parse_args()
+
+    with open(args.fixture, encoding="utf-8") as f:
+        filtered_products = json.load(f)
+
+    rule_time, decoded_json = time_rule_decode(filtered_products, args.repeat)
+    print(f"candidates:            {filtered_products.get('total_matches')}")
+    print(f"rule decode:           {rule_time * 1000:.3f} ms")
+
+    if args.ollama_url:
+        llm_time, usage = time_llm_decode(args.ollama_url, args.model, filtered_products)
+        print(f"llm decode (measured): {llm_time:.2f} s  usage={usage}")
+    else:
+        tokens = len(decoded_json) / CHARS_PER_TOKEN
+        llm_time = tokens / args.tokens_per_sec
+        print(f"llm decode (estimate): {llm_time:.2f} s  (~{tokens:.0f} output tokens at {args.tokens_per_sec} tok/s)")
+    print(f"saved per request:     {llm_time - rule_time:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Throughput of the rule-based part-number decoder.
+
+Generates a synthetic result set from the naming-rule tables (plus a few
+malformed ids) and compares decode_batch, a per-id decode loop, and the
+LLM decode it replaces (estimated from output tokens per record).
+
+    python benchmarks/bench_decoder.py --n 10000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.dram_decoder import (
+    BODY_TABLE, OPERATION_VOLTAGE, PRODUCT_FAMILY, decode_batch, decode_part_number,
+)
+
+CHARS_PER_TOKEN = 3.5
+SUFFIXES = ["A", "A-DEB2G", "A-DEB2GI", "B-EFBG2S", "E-GFBG2IS", "A-5TG"]
+
+
+def make_ids(n, bad_ratio, seed):
+    rng = random.Random(seed)
+    families = list(PRODUCT_FAMILY)
+    voltages = list(OPERATION_VOLTAGE)
+    blocks = [b for b, entry in BODY_TABLE.items() if entry[3]]
+    ids = []
+    for _ in range(n):
+        if rng.random() < bad_ratio:
+            ids.append(f"X{rng.randint(0, 99999)}")
+        else:
+            ids.append(f"M{rng.choice(families)}{rng.choice(voltages)}{rng.choice(blocks)}{rng.choice(SUFFIXES)}")
+    return ids
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=10000)
+    parser.add_argument("--bad-ratio", type=float, default=0.02)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tokens-per-sec", type=float, default=15.0)
+    args = parser.parse_args()
+
+    ids = make_ids(args.n, args.bad_ratio, args.seed)
+
+    batch_time = best_of(lambda: decode_batch(ids), args.repeat)
+    loop_time = best_of(lambda: [decode_part_number(pn) for pn in ids], args.repeat)
+    batch = decode_batch(ids)
+
+    sample = next(r for r in batch.records() if r is not None)
+    tokens_per_record = len(json.dumps(sample.as_dict(), indent=2)) / CHARS_PER_TOKEN
+    llm_rate = args.tokens_per_sec / tokens_per_record
+
+    print(f"ids:            {len(ids)} ({len(batch.failures)} failures reported)")
+    print(f"decode_batch:   {batch_time * 1000:8.2f} ms  {len(ids) / batch_time:12,.0f} ids/s")
+    print(f"per-id loop:    {loop_time * 1000:8.2f} ms  {len(ids) / loop_time:12,.0f} ids/s")
+    print(f"llm (estimate): {len(ids) / llm_rate:8.0f} s   {llm_rate:12,.2f} ids/s "
+          f"(~{tokens_per_record:.0f} tokens/record at {args.tokens_per_sec} tok/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""End-to-end benchmark of the pipelines against offline fakes.
+
+Starts the fake OpenAI-compatible server from benchmarks/fakes.py, replaces
+DuckDuckGo and selector.get_filtered_products with the fixtures, and drives
+``Pipeline.pipe`` the way the pipelines server does (one thread per request
+iterating the response). For each pipeline and each number of concurrent
+users it reports p50/p95 latency, time to first byte, throughput and the peak
+RSS of the process.
+
+    python benchmarks/bench_e2e.py
+    python benchmarks/bench_e2e.py --pipeline pn --users 1 8 32 --token-rate 25
+    python benchmarks/bench_e2e.py --save-baseline          # record benchmarks/baselines/e2e.json
+    python benchmarks/bench_e2e.py --compare                # fail (exit 1) on a regression
+
+``--valve NAME=VALUE`` sets a valve of the pipeline under test, e.g.
+``--valve PARAMS_MODE=llm``. ``--parts N`` makes the concurrent users ask for
+only N different part numbers (a burst of duplicate lookups, see
+SINGLE_FLIGHT). Baselines only compare meaningfully when taken on
+the same machine with the same options: ``--compare`` refuses a baseline
+taken with other options (exit 2) unless ``--ignore-config`` is given. A
+metric regresses when it is worse by more than ``--tolerance`` and by more
+than its absolute noise floor (10 ms for the timings), so a 2 ms -> 3 ms
+TTFB is not a regression. Both
+pipelines run in one process, so the peak RSS of the second includes what the
+first left loaded.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakes
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "e2e.json")
+PIPELINES = ("pn", "streaming")
+# 比較基準時, 這些指標變大才算退步; throughput 變小才算退步
+LOWER_IS_BETTER = ("p50_s", "p95_s", "ttfb_p50_s", "peak_rss_mb")
+# 小於這個絕對差值的變化視為雜訊 (毫秒級的 TTFB 相對變化很大, 但沒有意義)
+NOISE_FLOOR = {"p50_s": 0.01, "p95_s": 0.01, "ttfb_p50_s": 0.01, "peak_rss_mb": 2.0, "throughput_rps": 0.01}
+
+
+class RssSampler:
+    """Peak resident set size while the block runs (sampled from /proc every ``interval`` s)."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._page = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def rss(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self._page
+        except OSError:
+            # 非 Linux: 只有整個行程的最高值可用
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.rss())
+
+    def __enter__(self):
+        self.peak = self.rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.rss())
+
+
+def set_valve(pipeline, assignment):
+    name, _, value = assignment.partition("=")
+    current = getattr(pipeline.valves, name)
+    if isinstance(current, bool):
+        value = value.lower() in ("1", "true", "yes")
+    elif current is not None:
+        value = type(current)(value)
+    setattr(pipeline.valves, name, value)
+
+
+def make_pipeline(name, base_url, args):
+    if name == "pn":
+        import pn
+        pipeline = pn.Pipeline()
+        pipeline.valves.SEARCH_CACHE_ENABLED = False
+        pipeline.valves.STAGE_CACHE_ENABLED = False
+        pipeline.valves.PART_INDEX_ENABLED = False
+        pipeline.valves.SUMMARY_MODE = "llm"
+        pipeline.valves.METRICS_JSON_LOG = False
+    else:
+        import true_sreaming_ollama
+        pipeline = true_sreaming_ollama.Pipeline()
+    pipeline.valves.OLLAMA_BASE_URL = base_url
+    pipeline.valves.MODEL = fakes.MODEL
+    for assignment in args.valve:
+        if hasattr(pipeline.valves, assignment.partition("=")[0]):
+            set_valve(pipeline, assignment)
+    asyncio.run(pipeline.on_startup())
+    return pipeline
+
+
+def request_for(i, parts=0):
+    # 預設每個請求用不同的料號, 不讓快取影響結果
+    pn = f"MT41K256M16TW-{i % parts if parts else i:04d}"
+    return pn, [{"role": "user", "content": pn}]
+
+
+def run_users(pipeline, name, users, parts=0):
+    """``users`` threads each iterate one pipe() call; returns wall time and per-request samples."""
+    results = [None] * users
+    barrier = threading.Barrier(users + 1)
+
+    def worker(i):
+        message, messages = request_for(i, parts)
+        barrier.wait()
+        start = time.perf_counter()
+        ttfb, size = None, 0
+        response = pipeline.pipe(message, name, messages, {})
+        for chunk in ([response] if isinstance(response, str) else response):
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            size += len(chunk)
+        results[i] = (ttfb, time.perf_counter() - start, size)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, results
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(users, wall, results, peak_rss):
+    latency = [r[1] for r in results]
+    return {
+        "users": users,
+        "p50_s": round(statistics.median(latency), 3),
+        "p95_s": round(percentile(latency, 0.95), 3),
+        "ttfb_p50_s": round(statistics.median(r[0] for r in results), 3),
+        "throughput_rps": round(users / wall, 3),
+        "bytes_per_request": round(statistics.mean(r[2] for r in results)),
+        "peak_rss_mb": round(peak_rss / 2 ** 20, 1),
+    }
+
+
+def compare(baseline, current, tolerance):
+    """Print the change of every metric against the baseline; return the regressions.
+
+    A change counts when it exceeds both ``tolerance`` (relative) and the
+    metric's NOISE_FLOOR (absolute).
+    """
+    regressions = []
+    print(f"\ncompared with {baseline['created']} (tolerance {tolerance:.0%}, above the noise floor):")
+    for name, rows in current["results"].items():
+        base_rows = {row["users"]: row for row in baseline["results"].get(name, [])}
+        for row in rows:
+            base = base_rows.get(row["users"])
+            if base is None:
+                continue
+            changes = []
+            for metric in LOWER_IS_BETTER + ("throughput_rps",):
+                if not base.get(metric):
+                    continue
+                change = row[metric] / base[metric] - 1
+                worse = change > tolerance if metric in LOWER_IS_BETTER else change < -tolerance
+                worse = worse and abs(row[metric] - base[metric]) > NOISE_FLOOR[metric]
+                changes.append(f"{metric} {change:+.0%}{' REGRESSION' if worse else ''}")
+                if worse:
+                    regressions.append((name, row["users"], metric, base[metric], row[metric]))
+            print(f"  {name:<10} users={row['users']:<4} " + ", ".join(changes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipeline", choices=PIPELINES + ("all",), default="all")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--ttft", type=float, default=0.3, help="fake prefill time (s)")
+    parser.add_argument("--token-rate", type=float, default=40.0, help="fake decode speed (tokens/s)")
+    parser.add_argument("--tokens", type=int, default=120, help="tokens per summary reply")
+    parser.add_argument("--parallel", type=int, default=4,
+                        help="replies the fake server generates at once, like OLLAMA_NUM_PARALLEL (0 = unlimited)")
+    parser.add_argument("--search-latency", type=float, default=0.5, help="fake DuckDuckGo latency (s)")
+    parser.add_argument("--search-error-rate", type=float, default=0.0, help="fraction of failing searches")
+    parser.add_argument("--selector-latency", type=float, default=0.05, help="fake get_filtered_products latency (s)")
+    parser.add_argument("--parts", type=int, default=0, help="distinct part numbers among the users (0 = all different)")
+    parser.add_argument("--valve", action="append", default=[], metavar="NAME=VALUE")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file (%(default)s)")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to --baseline")
+    parser.add_argument("--compare", action="store_true", help="compare with --baseline, exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change (default 20%%)")
+    parser.add_argument("--ignore-config", action="store_true",
+                        help="compare even when the baseline was taken with other options")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipelines' own log output")
+    args = parser.parse_args()
+    config = {k: v for k, v in vars(args).items()
+              if k not in ("baseline", "save_baseline", "compare", "tolerance", "ignore_config", "verbose", "pipeline")}
+    if args.compare:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        # 結果依 users 逐列比較, 其他選項不同時數字沒有可比性
+        base_config = baseline.get("config", {})
+        differ = {k: (base_config.get(k), config.get(k)) for k in set(base_config) | set(config)
+                  if k != "users" and base_config.get(k) != config.get(k)}
+        if differ:
+            changed = ", ".join(f"{k}: {old!r} -> {new!r}" for k, (old, new) in sorted(differ.items()))
+            if not args.ignore_config:
+                print(f"baseline was taken with different options ({changed}); not comparing "
+                      "(re-run with the same options, --save-baseline, or --ignore-config)")
+                sys.exit(2)
+            print(f"warning: baseline was taken with different options ({changed})")
+
+    fakes.install_runtime_stubs(args.selector_latency)
+    fakes.FakeDDGS.latency = args.search_latency
+    fakes.FakeDDGS.error_rate = args.search_error_rate
+    server = fakes.FakeOpenAIServer(args.ttft, args.token_rate, args.tokens, parallel=args.parallel)
+    base_url = server.start()
+
+    current = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "config": config, "results": {}}
+    names = PIPELINES if args.pipeline == "all" else (args.pipeline,)
+    print(f"{'pipeline':<10} {'users':>5} {'p50 (s)':>8} {'p95 (s)':>8} {'TTFB (s)':>9} "
+          f"{'req/s':>7} {'bytes/req':>10} {'peak RSS (MB)':>14}")
+    try:
+        for name in names:
+            quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+            rows = current["results"][name] = []
+            with quiet:
+                pipeline = make_pipeline(name, base_url, args)
+            try:
+                for users in args.users:
+                    with quiet, RssSampler() as rss:
+                        wall, results = run_users(pipeline, name, users, args.parts)
+                    row = summarize(users, wall, results, rss.peak)
+                    rows.append(row)
+                    print(f"{name:<10} {users:>5} {row['p50_s']:>8.2f} {row['p95_s']:>8.2f} {row['ttfb_p50_s']:>9.3f} "
+                          f"{row['throughput_rps']:>7.2f} {row['bytes_per_request']:>10} {row['peak_rss_mb']:>14.1f}")
+            finally:
+                with quiet:
+                    asyncio.run(pipeline.on_shutdown())
+    finally:
+        server.stop()
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+            f.write("\n")
+        print(f"\nbaseline saved to {args.baseline}")
+    if args.compare:
+        regressions = compare(baseline, current, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s)")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
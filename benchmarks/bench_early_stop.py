@@ -0,0 +1,111 @@
+"""Tokens and GPU time saved by closing LLM streams once the answer is complete.
+
+Runs pn.py against the fake server of benchmarks/fakes.py with all four LLM
+stages enabled (PARAMS_MODE/DECODE_MODE/MATCH_MODE="llm"), once with
+EARLY_STOP off and once on. The fake replies go on after their structure
+(text after the closing tag, whitespace after the JSON object, notes after
+the match table), like real models do. Per stage it reports the completion
+tokens and streaming seconds per request, and, for the EARLY_STOP run, the
+saving the pipeline itself estimated from its holdout calls
+(EARLY_STOP_HOLDOUT) next to the measured one.
+
+    python benchmarks/bench_early_stop.py
+    python benchmarks/bench_early_stop.py --requests 40 --token-rate 20 --params-output json
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakes
+
+STAGES = ("summary", "params", "decode", "match")
+
+
+def counter(registry, name, stage, **labels):
+    key = (f"pn_{name}", tuple(sorted({"stage": stage, **labels}.items())))
+    return registry.counters.get(key, 0.0)
+
+
+def seconds(registry, stage):
+    hist = registry.histograms.get(("pn_llm_stage_seconds", (("stage", stage),)))
+    return hist[1] if hist else 0.0
+
+
+def run(base_url, args, early_stop):
+    import pn
+
+    pipeline = pn.Pipeline()
+    valves = pipeline.valves
+    valves.OLLAMA_BASE_URL = base_url
+    valves.MODEL = fakes.MODEL
+    valves.SEARCH_CACHE_ENABLED = valves.STAGE_CACHE_ENABLED = valves.PART_INDEX_ENABLED = False
+    valves.METRICS_JSON_LOG = False
+    valves.SUMMARY_MODE = "llm"
+    valves.PARAMS_MODE = valves.DECODE_MODE = valves.MATCH_MODE = "llm"
+    valves.PARAMS_OUTPUT = args.params_output
+    valves.EARLY_STOP = early_stop
+    valves.EARLY_STOP_HOLDOUT = args.holdout if early_stop else 0.0
+    asyncio.run(pipeline.on_startup())
+    try:
+        for i in range(args.requests):
+            part_number = f"MT41K256M16TW-{i:04d}"
+            for _ in pipeline.pipe(part_number, "pn", [{"role": "user", "content": part_number}], {}):
+                pass
+    finally:
+        asyncio.run(pipeline.on_shutdown())
+    registry = pipeline.metrics
+    return {
+        stage: {
+            "tokens": counter(registry, "llm_tokens_total", stage, type="completion") / args.requests,
+            "seconds": seconds(registry, stage) / args.requests,
+            "estimated_tokens": counter(registry, "llm_saved_tokens_total", stage) / args.requests,
+            "estimated_gpu_s": counter(registry, "llm_saved_gpu_seconds_total", stage) / args.requests,
+        }
+        for stage in STAGES
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--ttft", type=float, default=0.05, help="fake prefill time (s)")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="fake decode speed (tokens/s)")
+    parser.add_argument("--tokens", type=int, default=120, help="tokens per summary reply")
+    parser.add_argument("--params-output", choices=("tags", "json"), default="tags")
+    parser.add_argument("--holdout", type=float, default=0.2, help="EARLY_STOP_HOLDOUT of the EARLY_STOP run")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's own log output")
+    args = parser.parse_args()
+
+    fakes.install_runtime_stubs(0.0)
+    fakes.FakeDDGS.latency = 0.0
+    server = fakes.FakeOpenAIServer(args.ttft, args.token_rate, args.tokens)
+    base_url = server.start()
+    try:
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+        with quiet:
+            off = run(base_url, args, early_stop=False)
+            on = run(base_url, args, early_stop=True)
+    finally:
+        server.stop()
+
+    print(f"{args.requests} requests, {args.token_rate:g} tokens/s, holdout {args.holdout:.0%}; per request:")
+    print(f"{'stage':<8} {'tokens off':>10} {'tokens on':>10} {'saved':>6} {'est.':>6} "
+          f"{'s off':>7} {'s on':>7} {'saved s':>8} {'est. GPU s':>11}")
+    totals = [0.0] * 4
+    for stage in STAGES:
+        a, b = off[stage], on[stage]
+        saved, saved_s = a["tokens"] - b["tokens"], a["seconds"] - b["seconds"]
+        totals = [t + v for t, v in zip(totals, (saved, b["estimated_tokens"], saved_s, b["estimated_gpu_s"]))]
+        print(f"{stage:<8} {a['tokens']:>10.1f} {b['tokens']:>10.1f} {saved:>6.1f} {b['estimated_tokens']:>6.1f} "
+              f"{a['seconds']:>7.3f} {b['seconds']:>7.3f} {saved_s:>8.3f} {b['estimated_gpu_s']:>11.3f}")
+    print(f"{'total':<8} {'':>10} {'':>10} {totals[0]:>6.1f} {totals[1]:>6.1f} "
+          f"{'':>7} {'':>7} {totals[2]:>8.3f} {totals[3]:>11.3f}")
+    print("\n'est.' is what the pipeline reported (llm_saved_*_total) from its holdout calls; "
+          "it only covers the calls that were stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""Bytes on the wire, server CPU and token-to-screen latency of the output formats.
+
+Modes (valves STREAM_FORMAT / STREAM_COALESCE_MS / STREAM_COALESCE_BYTES):
+
+- sse: the raw SSE line of every token, as before,
+- content: the content of every token, not coalesced (0 ms),
+- coalesced: content coalesced on ``--window`` ms / ``--max-bytes``, cut at
+  markdown-safe points (pipeline_utils.output_stream).
+
+The replay streams a lookup-like reply token by token at ``--token-rate``
+(jittered gaps), with progress messages between the parts. The reply is the
+fake server's summary, a JSON code block and a match table. It runs through
+both paths the pipelines use:
+
+- async: pn.py's and true_sreaming_ollama.py's path, streaming.stream_task flushing on a timer and
+  BackgroundLoop.iterate handing each chunk to the caller's thread;
+- sync: ollama_openrouter_pipeline.py's path, output_stream.output_chunks.
+
+Every chunk is framed the way the pipelines server frames it
+(fakes.frame_chunk) and written to a local socket in HTTP chunked encoding
+(``Wire``). Per request it reports:
+
+- chunks and bytes on the wire,
+- server CPU: process time of the output layer, the thread hop, the framing
+  and the socket writes, without the thread reading the socket. The JSON
+  decoding of Ollama's lines is the same in every mode and is not counted,
+- token-to-screen latency the layer adds: from a token's arrival to the write
+  of the chunk that carries it (p50 / p95 / max),
+- markdown breaks: chunks that end inside a code fence line, a table's
+  header or delimiter row, a table cell, or an open code span or strong
+  emphasis.
+
+``--e2e`` also runs both pipelines against the fake server in every mode. It
+reports bytes on the wire and the CPU of the whole process per request
+(HTTP, decoding and stages).
+
+    python benchmarks/bench_output_stream.py
+    python benchmarks/bench_output_stream.py --window 50 --max-bytes 512 --token-rate 80
+    python benchmarks/bench_output_stream.py --e2e
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fakes
+from bench_e2e import make_pipeline, percentile, request_for
+from pipeline_utils.output_stream import Coalescer, output_chunks
+from pipeline_utils.sse import SSEDecoder
+from pipeline_utils.streaming import BackgroundLoop, stream_task
+
+MESSAGES = (
+    "## Processing part number: MT41K256M16TW-107\n\nPerforming web search to gather information...",
+    "\n\n### Search completed. Analyzing information...\n\n",
+    "\n\n### Found 2 potential matching products\n\nDecoding product information...\n\n",
+    "\n\n",
+)
+REPLIES = (fakes.SUMMARY_TEXT + fakes.FILLER * 3, fakes.DECODE_TEXT, fakes.MATCH_TEXT)
+
+
+class Wire:
+    """Local socket standing in for the client connection; a thread reads and discards what is sent."""
+
+    def __init__(self):
+        self.server, self.client = socket.socketpair()
+        self.bytes = 0
+        self.reader_cpu = 0.0
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        start = time.thread_time()
+        while self.client.recv(65536):
+            self.reader_cpu = time.thread_time() - start
+
+    def send(self, framed):
+        self.bytes += len(framed)
+        self.server.sendall(b"%x\r\n%s\r\n" % (len(framed), framed))
+
+    def close(self):
+        self.server.close()
+        self.thread.join()
+        self.client.close()
+
+
+def tokens_of(text):
+    words = text.split(" ")
+    return [w + " " for w in words[:-1]] + [words[-1]]
+
+
+def script(args, seed):
+    """Items of one replayed request: (gap before it in s, message str or SSEEvent)."""
+    rnd = random.Random(seed)
+    decoder = SSEDecoder()
+    items = [(0.0, MESSAGES[0]), (0.5, MESSAGES[1])]
+    for i, reply in enumerate(REPLIES):
+        for j, token in enumerate(tokens_of(reply)):
+            # Ollama 的 OpenAI 相容串流格式
+            line = "data: " + json.dumps({
+                "id": "chatcmpl-417", "object": "chat.completion.chunk", "created": 1760000000,
+                "model": "qwen2.5:latest", "system_fingerprint": "fp_ollama",
+                "choices": [{"index": 0, "delta": {"role": "assistant", "content": token}, "finish_reason": None}],
+            }, separators=(",", ":"))
+            # 第一個 token 前為 prefill 時間, 之後的間隔 ±50% 抖動
+            gap = args.ttft if j == 0 else rnd.uniform(0.5, 1.5) / args.token_rate
+            items.append((gap, decoder.feed(line)))
+        items.append((0.0, MESSAGES[2 + min(i, 1)]))
+    return items
+
+
+def markdown_breaks(chunks):
+    """Chunk boundaries inside a code fence line, a table's header or delimiter row, a table cell,
+    or (outside code blocks) an open code span or strong emphasis."""
+    text, breaks, pos = "".join(chunks), 0, 0
+    for chunk in chunks[:-1]:
+        pos += len(chunk)
+        prefix = text[:pos]
+        lines = prefix.split("\n")
+        line, before = lines[-1], lines[:-1]
+        if not line:
+            continue
+        in_code_block = sum(1 for l in before if l.lstrip().startswith("```")) % 2 == 1
+        in_table = bool(before) and before[-1].lstrip().startswith(("|---", "| ---")) or (
+            len(before) > 1 and before[-1].lstrip().startswith("|") and before[-2].lstrip().startswith("|"))
+        if line.lstrip().startswith(("`", "~")):
+            breaks += 1
+        elif line.lstrip().startswith("|"):
+            breaks += not (in_table and line.endswith("|"))
+        elif not in_code_block:
+            breaks += bool(line.count("`") % 2 or line.count("**") % 2)
+    return breaks
+
+
+def produce_sync(items, log):
+    for gap, item in items:
+        time.sleep(gap)
+        log.append((time.perf_counter(), item if isinstance(item, str) else item.content))
+        yield item
+
+
+def replay_sync(items, mode, args, wire):
+    coalescer = Coalescer(args.window / 1000, args.max_bytes) if mode == "coalesced" else None
+    produced, received = [], []
+    for chunk in output_chunks(produce_sync(items, produced), mode == "sse", coalescer):
+        received.append((time.perf_counter(), chunk))
+        wire.send(fakes.frame_chunk(chunk))
+    return produced, received
+
+
+def replay_async(items, mode, args, loop, wire):
+    coalescer = Coalescer(args.window / 1000, args.max_bytes) if mode == "coalesced" else None
+    produced, received = [], []
+
+    async def run(out):
+        for gap, item in items:
+            await asyncio.sleep(gap)
+            text = item if isinstance(item, str) else item.content
+            produced.append((time.perf_counter(), text))
+            await out.write(item.raw if mode == "sse" and not isinstance(item, str) else text)
+
+    for chunk in loop.iterate(stream_task(run, 64, coalescer)):
+        received.append((time.perf_counter(), chunk))
+        wire.send(fakes.frame_chunk(chunk))
+    return produced, received
+
+
+def latencies(produced, received):
+    """Per produced token: seconds until the chunk carrying its last character was received."""
+    ends, offset = [], 0
+    for at, chunk in received:
+        if isinstance(chunk, bytes):
+            # 原始 SSE 行: 一行一個 token
+            chunk = json.loads(chunk[5:])["choices"][0]["delta"]["content"]
+        offset += len(chunk)
+        ends.append((offset, at))
+    result, offset, i = [], 0, 0
+    for at, text in produced:
+        offset += len(text)
+        while ends[i][0] < offset:
+            i += 1
+        result.append(ends[i][1] - at)
+    return result
+
+
+def replay(args):
+    print(f"replay: {args.requests} request(s) per row, {args.token_rate:g} tokens/s, "
+          f"coalesced = {args.window:g} ms / {args.max_bytes} B")
+    print(f"{'path':<6} {'mode':<10} {'chunks':>7} {'wire KB':>8} {'CPU ms':>7} "
+          f"{'latency p50':>12} {'p95':>7} {'max':>7} {'md breaks':>10}")
+    loop = BackgroundLoop("bench-output")
+    try:
+        for path in ("async", "sync"):
+            for mode in ("sse", "content", "coalesced"):
+                chunks = size = breaks = 0
+                cpu = 0.0
+                lags = []
+                for seed in range(args.requests):
+                    items = script(args, seed)
+                    wire = Wire()
+                    start = time.process_time()
+                    if path == "sync":
+                        produced, received = replay_sync(items, mode, args, wire)
+                    else:
+                        produced, received = replay_async(items, mode, args, loop, wire)
+                    wire.close()
+                    cpu += time.process_time() - start - wire.reader_cpu
+                    chunks += len(received)
+                    size += wire.bytes
+                    lags += latencies(produced, received)
+                    if mode != "sse":
+                        breaks += markdown_breaks([chunk for _, chunk in received])
+                n = args.requests
+                print(f"{path:<6} {mode:<10} {chunks / n:>7.0f} {size / n / 1024:>8.1f} {cpu / n * 1e3:>7.1f} "
+                      f"{percentile(lags, 0.5) * 1e3:>10.1f}ms {percentile(lags, 0.95) * 1e3:>5.1f}ms "
+                      f"{max(lags) * 1e3:>5.1f}ms {breaks / n:>10.1f}")
+    finally:
+        loop.stop()
+
+
+def e2e(args):
+    server = fakes.FakeOpenAIServer(args.ttft, args.token_rate, 120)
+    base_url = server.start()
+    print(f"\ne2e: {args.requests} request(s) per row against the fake server")
+    print(f"{'pipeline':<10} {'mode':<10} {'chunks':>7} {'wire KB':>8} {'CPU ms':>7}")
+    try:
+        for name in ("pn", "streaming"):
+            for mode in ("sse", "content", "coalesced"):
+                valves = {"sse": ["STREAM_FORMAT=sse"], "content": ["STREAM_FORMAT=content", "STREAM_COALESCE_MS=0"],
+                          "coalesced": ["STREAM_FORMAT=content", f"STREAM_COALESCE_MS={args.window}",
+                                        f"STREAM_COALESCE_BYTES={args.max_bytes}"]}[mode]
+                settings = argparse.Namespace(valve=valves)
+                with contextlib.redirect_stdout(open(os.devnull, "w")):
+                    pipeline = make_pipeline(name, base_url, settings)
+                chunks = size = 0
+                cpu = 0.0
+                try:
+                    for i in range(args.requests):
+                        message, messages = request_for(i)
+                        wire = Wire()
+                        with contextlib.redirect_stdout(open(os.devnull, "w")):
+                            start = time.process_time()
+                            response = pipeline.pipe(message, name, messages, {})
+                            for chunk in ([response] if isinstance(response, str) else response):
+                                chunks += 1
+                                wire.send(fakes.frame_chunk(chunk))
+                            wire.close()
+                            cpu += time.process_time() - start - wire.reader_cpu
+                        size += wire.bytes
+                finally:
+                    with contextlib.redirect_stdout(open(os.devnull, "w")):
+                        asyncio.run(pipeline.on_shutdown())
+                n = args.requests
+                print(f"{name:<10} {mode:<10} {chunks / n:>7.0f} {size / n / 1024:>8.1f} {cpu / n * 1e3:>7.1f}")
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--window", type=float, default=30.0, help="coalescing window (ms)")
+    parser.add_argument("--max-bytes", type=int, default=256, help="coalescing size limit (bytes)")
+    parser.add_argument("--token-rate", type=float, default=40.0, help="tokens/s")
+    parser.add_argument("--ttft", type=float, default=0.3, help="seconds before the first token of each reply")
+    parser.add_argument("--requests", type=int, default=2, help="requests per row")
+    parser.add_argument("--e2e", action="store_true", help="also run the pipelines against the fake server")
+    args = parser.parse_args()
+
+    replay(args)
+    if args.e2e:
+        fakes.install_runtime_stubs(0.05)
+        fakes.FakeDDGS.latency = 0.2
+        e2e(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Hit rate and lookup latency of the part-number index on a recorded query log.
+
+Replays a query log (default: benchmarks/fixtures/query_log.tsv) through
+pipeline_utils.part_index.PartIndex the way pn.py uses it: look the part
+number up, then add it as resolved. Each lookup is one of
+
+- exact: the same normalized part number was resolved before (what the
+  existing caches already catch),
+- variant: a known part with the same core and different suffixes; the
+  work it saves depends on which suffixes differ,
+- miss: nothing reusable.
+
+The report gives the hit rates, lookup/add latency, and the searches and LLM
+calls the variant hits avoid (assuming every earlier resolution succeeded).
+
+    python benchmarks/bench_part_index.py
+    python benchmarks/bench_part_index.py --log my_queries.tsv --repeat 20
+"""
+import argparse
+import collections
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.part_index import PartIndex
+
+LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "query_log.tsv")
+SEARCH_ASPECTS = ("ddr type", "operation voltage", "density", "operating temperature", "max frequency")
+
+
+def load_log(path):
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            queries.append(line.rstrip("\n").split("\t")[-1])
+    return queries
+
+
+def replay(queries):
+    """Lookup + add for every query; returns per-query (result, variant, lookup s, add s)."""
+    index = PartIndex()
+    rows = []
+    for query in queries:
+        start = time.perf_counter()
+        variant = index.lookup(query)
+        lookup = time.perf_counter() - start
+        result = "miss" if variant is None else "exact" if variant.exact else "variant"
+        start = time.perf_counter()
+        index.add(
+            query, {aspect: [{"title": aspect}] for aspect in SEARCH_ASPECTS},
+            f"summary of {query}", {"Density": "4Gb"},
+        )
+        rows.append((result, variant, lookup, time.perf_counter() - start))
+    return index, rows
+
+
+def micros(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default=LOG)
+    parser.add_argument("--repeat", type=int, default=10, help="replays for the latency figures")
+    args = parser.parse_args()
+
+    queries = load_log(args.log)
+    index, rows = replay(queries)
+    lookups = [r[2] for _ in range(args.repeat) for r in replay(queries)[1]]
+    adds = [r[3] for r in rows]
+
+    counts = collections.Counter(r[0] for r in rows)
+    differs = collections.Counter(",".join(sorted(r[1].differs)) for r in rows if r[0] == "variant")
+    n = len(rows)
+    print(f"{n} queries, {len(index)} distinct part numbers indexed")
+    for result in ("exact", "variant", "miss"):
+        print(f"  {result:<8} {counts[result]:>5} ({counts[result] / n:.0%})")
+    for kind, count in differs.most_common():
+        print(f"    variant differing in {kind or '-'}: {count}")
+    print(f"hit rate: {(counts['exact'] + counts['variant']) / n:.0%} with the index, "
+          f"{counts['exact'] / n:.0%} with exact keys only")
+    print(f"lookup: p50 {micros(lookups, 0.5):.1f} µs, p99 {micros(lookups, 0.99):.1f} µs, "
+          f"max {max(lookups) * 1e6:.1f} µs; add: p50 {micros(adds, 0.5):.1f} µs")
+
+    # 變體命中省下的工作 (精確命中原本就由快取處理, 不計入)
+    searches = summaries = params = 0
+    for result, variant, _, _ in rows:
+        if result != "variant":
+            continue
+        reused = variant.results(SEARCH_ASPECTS)
+        searches += len(reused)
+        summaries += variant.summary is not None and len(reused) == len(SEARCH_ASPECTS)
+        params += variant.params is not None
+    print(f"saved by variant hits: {searches} of {counts['variant'] * len(SEARCH_ASPECTS)} searches, "
+          f"{summaries} summary calls, {params} params calls "
+          f"({searches / max(1, counts['variant']):.1f} searches per variant hit)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Prefill saved by the prompt-cache friendly layout of pipeline_utils/prompt_templates.
+
+Ollama keeps the evaluated prompt of each parallel slot and only prefills the
+part of a new prompt after the longest common prefix with a slot. The
+templates put the static instructions first (system message) and the data
+last; the old layout put the data (part number, search results, summary,
+candidates) in front of the instructions, in a single user message, so almost
+nothing could be reused.
+
+Without --ollama the reuse is simulated over the fixture summaries: every
+request runs summary -> params -> decode -> match, ``--concurrency`` requests
+are interleaved stage by stage, and each prompt goes to the free slot with the
+longest common prefix (``--parallel`` slots, like OLLAMA_NUM_PARALLEL). Tokens
+are estimated with prompting.estimate_tokens; prefill time with
+``--prefill-rate``. With --ollama the same prompts are sent to a real server
+(/api/chat, num_predict=1) and Ollama's own prompt_eval_count/duration are
+summed.
+
+    python benchmarks/bench_prompt_prefix.py
+    python benchmarks/bench_prompt_prefix.py --parallel 4 --concurrency 4
+    python benchmarks/bench_prompt_prefix.py --ollama http://ollama:11434 --model qwen2.5:latest
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.dram_decoder import decode_candidates
+from pipeline_utils.prompt_templates import DECODE, MATCH, PARAMS_TAGS, SUMMARY
+from pipeline_utils.prompting import compact_candidates, estimate_tokens
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def stage_prompts(part_number, summary, candidates):
+    """(template, fields) of the four LLM stages of one request."""
+    search_results = f"[{part_number}] {summary}"
+    return [
+        (SUMMARY, {"part_number": part_number, "search_results": search_results}),
+        (PARAMS_TAGS, {"part_number": part_number, "summary": summary}),
+        (DECODE, {"summary": summary, "candidates": candidates}),
+        (MATCH, {"part_number": part_number, "summary": summary, "candidates": candidates, "precheck": ""}),
+    ]
+
+
+def layout_templates(template, fields):
+    return template.render(**fields)
+
+
+def layout_data_first(template, fields):
+    # 改版前的寫法: 資料在前, 指示在後, 全部放在一則 user 訊息
+    return [{"role": "user", "content": template.user.format(**fields) + "\n\n" + template.system}]
+
+
+LAYOUTS = {"data-first": layout_data_first, "templates": layout_templates}
+
+
+def chat_text(messages):
+    """The prompt as the model sees it (ChatML, as used by qwen2.5)."""
+    return "".join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages) + "<|im_start|>assistant\n"
+
+
+def common_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def load_requests(count):
+    with open(os.path.join(FIXTURES, "summaries.json"), encoding="utf-8") as f:
+        summaries = json.load(f)
+    with open(os.path.join(FIXTURES, "filtered_products.json"), encoding="utf-8") as f:
+        filtered_products = json.load(f)
+    candidates = compact_candidates(decode_candidates(filtered_products)[0])
+    return [
+        stage_prompts(item["part_number"], item["summary"], candidates)
+        for item in (summaries * (count // len(summaries) + 1))[:count]
+    ]
+
+
+def schedule(requests, concurrency):
+    """Prompts in the order the server sees them: ``concurrency`` requests advance stage by stage."""
+    for start in range(0, len(requests), concurrency):
+        wave = requests[start:start + concurrency]
+        for stage in range(len(wave[0])):
+            yield [request[stage] for request in wave]
+
+
+def simulate(requests, layout, parallel, concurrency):
+    """Total and prefilled tokens with ``parallel`` slots keeping their last prompt."""
+    slots = [""] * parallel
+    total = prefilled = 0
+    for batch in schedule(requests, concurrency):
+        free = list(range(parallel))
+        for template, fields in batch:
+            text = chat_text(LAYOUTS[layout](template, fields))
+            if not free:
+                free = list(range(parallel))
+            slot = max(free, key=lambda s: common_prefix(slots[s], text))
+            free.remove(slot)
+            reused = common_prefix(slots[slot], text)
+            tokens = estimate_tokens(text)
+            total += tokens
+            prefilled += tokens - (estimate_tokens(text[:reused]) if reused else 0)
+            slots[slot] = text
+    return total, prefilled
+
+
+def measure(url, model, requests, layout, keep_alive):
+    """Sum Ollama's prompt_eval_count / prompt_eval_duration over all prompts (sent one at a time)."""
+    import requests as http
+
+    total = prefilled = 0
+    seconds = 0.0
+    for batch in schedule(requests, 1):
+        for template, fields in batch:
+            r = http.post(f"{url}/api/chat", json={
+                "model": model, "messages": LAYOUTS[layout](template, fields), "stream": False,
+                "keep_alive": keep_alive, "options": {"num_predict": 1},
+            }, timeout=600)
+            r.raise_for_status()
+            data = r.json()
+            total += estimate_tokens(chat_text(LAYOUTS[layout](template, fields)))
+            prefilled += data.get("prompt_eval_count") or 0
+            seconds += (data.get("prompt_eval_duration") or 0) / 1e9
+    return total, prefilled, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--parallel", type=int, default=1, help="Ollama slots (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--concurrency", type=int, default=1, help="requests in flight at once")
+    parser.add_argument("--prefill-rate", type=float, default=1500.0,
+                        help="prompt tokens/s used for the estimate (32B on one GPU)")
+    parser.add_argument("--ollama", help="measure against this Ollama server instead of simulating")
+    parser.add_argument("--model", default="qwen2.5:latest")
+    parser.add_argument("--keep-alive", default="30m")
+    args = parser.parse_args()
+
+    requests = load_requests(args.requests)
+    print(f"{args.requests} requests x 4 stages, parallel={args.parallel}, concurrency={args.concurrency}")
+    for name, template in (("summary", SUMMARY), ("params", PARAMS_TAGS), ("decode", DECODE), ("match", MATCH)):
+        print(f"  {name:<8} static prefix ~{estimate_tokens(template.system)} tokens")
+    print(f"\n{'layout':<12} {'prompt tokens':>14} {'prefilled':>10} {'reused':>7} {'prefill (s)':>12}")
+    results = {}
+    for layout in LAYOUTS:
+        if args.ollama:
+            # 先送一次讓模型載入, 不列入計算
+            measure(args.ollama, args.model, requests[:1], layout, args.keep_alive)
+            start = time.perf_counter()
+            total, prefilled, seconds = measure(args.ollama, args.model, requests, layout, args.keep_alive)
+            print(f"  ({layout}: {time.perf_counter() - start:.1f}s wall)")
+        else:
+            total, prefilled = simulate(requests, layout, args.parallel, args.concurrency)
+            seconds = prefilled / args.prefill_rate
+        results[layout] = seconds
+        print(f"{layout:<12} {total:>14} {prefilled:>10} {1 - prefilled / total:>7.0%} {seconds:>12.2f}")
+    saved = results["data-first"] - results["templates"]
+    print(f"\nprefill saved: {saved:.2f}s total, {saved / args.requests:.2f}s per request")
+
+
+if __name__ == "__main__":
+    main()
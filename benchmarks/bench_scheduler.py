@@ -0,0 +1,150 @@
+"""Chat latency next to batch lookups, with and without the shared scheduler.
+
+Starts the fake server of benchmarks/fakes.py with ``--parallel`` generation
+slots (like OLLAMA_NUM_PARALLEL) and runs, at the same time,
+
+- ``--batch-users`` users each sending one batch of ``--parts`` part numbers
+  to pn.py (priority "batch"),
+- ``--chat-users`` users chatting with true_sreaming_ollama.py (priority
+  "interactive"): one message, a pause of ``--think`` seconds, the next one,
+  until the batches are done.
+
+Both pipelines share one scheduler (see pipeline_utils.scheduler). The run is
+made twice:
+
+- scheduler: OLLAMA_MAX_INFLIGHT = ``--parallel``, so the scheduler hands out
+  exactly the server's slots and chats go first;
+- fifo: OLLAMA_MAX_INFLIGHT so large that every call goes straight to the
+  server, which serves them in arrival order (the behaviour without the
+  scheduler: chats wait behind the queued batch calls).
+
+Reported per run: chat time to first content token and latency (p50/p95),
+batch completion time, and the mean queue wait per priority class.
+
+    python benchmarks/bench_scheduler.py
+    python benchmarks/bench_scheduler.py --parallel 2 --batch-users 3 --chat-users 6
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakes
+from bench_e2e import percentile
+
+FIFO_SLOTS = 10_000
+# 排隊訊息的開頭 (true_sreaming_ollama.scheduled_completion), 不算第一個 token
+QUEUE_NOTICE = "\n\n⏳"
+
+
+def make_pipelines(base_url, inflight):
+    import pn
+    import true_sreaming_ollama
+
+    lookup = pn.Pipeline()
+    lookup.valves.SEARCH_CACHE_ENABLED = False
+    lookup.valves.STAGE_CACHE_ENABLED = False
+    lookup.valves.PART_INDEX_ENABLED = False
+    lookup.valves.SUMMARY_MODE = "llm"
+    lookup.valves.METRICS_JSON_LOG = False
+    chat = true_sreaming_ollama.Pipeline()
+    for pipeline in (lookup, chat):
+        pipeline.valves.OLLAMA_BASE_URL = base_url
+        pipeline.valves.MODEL = fakes.MODEL
+        pipeline.valves.OLLAMA_MAX_INFLIGHT = inflight
+        pipeline.valves.OLLAMA_HEALTH_INTERVAL = 0
+        asyncio.run(pipeline.on_startup())
+    return lookup, chat
+
+
+def run(args, inflight):
+    """One run on a fresh server (and so a fresh scheduler); returns chat samples, batch times, queue waits."""
+    server = fakes.FakeOpenAIServer(args.ttft, args.token_rate, args.tokens, parallel=args.parallel)
+    base_url = server.start()
+    chats, batches = [], []
+    done = threading.Event()
+    try:
+        lookup, chat = make_pipelines(base_url, inflight)
+
+        def batch_user(i):
+            parts = [f"MT41K256M16TW-{i:02d}{j:02d}" for j in range(args.parts)]
+            start = time.perf_counter()
+            response = lookup.pipe("\n".join(parts), "pn", [], {"user": {"id": f"batch-{i}", "name": f"batch-{i}"}})
+            for _ in ([response] if isinstance(response, str) else response):
+                pass
+            batches.append(time.perf_counter() - start)
+
+        def chat_user(i):
+            # 錯開開始時間, 讓對話在批次進行中陸續到達
+            time.sleep(args.think * i / max(1, args.chat_users))
+            while not done.is_set():
+                message = f"chat {i}: what is DDR3L?"
+                start = time.perf_counter()
+                first = None
+                response = chat.pipe(message, "chat", [{"role": "user", "content": message}],
+                                     {"user": {"id": f"chat-{i}", "name": f"chat-{i}"}})
+                for chunk in ([response] if isinstance(response, str) else response):
+                    if first is None and not (isinstance(chunk, str) and chunk.startswith(QUEUE_NOTICE)):
+                        first = time.perf_counter() - start
+                chats.append((first, time.perf_counter() - start))
+                done.wait(args.think)
+
+        batch_threads = [threading.Thread(target=batch_user, args=(i,)) for i in range(args.batch_users)]
+        chat_threads = [threading.Thread(target=chat_user, args=(i,)) for i in range(args.chat_users)]
+        for thread in batch_threads + chat_threads:
+            thread.start()
+        for thread in batch_threads:
+            thread.join()
+        done.set()
+        for thread in chat_threads:
+            thread.join()
+
+        waits = {}
+        for (name, labels), (_, total, count) in lookup.get_scheduler().metrics.histograms.items():
+            if name == "scheduler_queue_wait_seconds" and count:
+                waits[dict(labels)["priority"]] = total / count
+        for pipeline in (lookup, chat):
+            asyncio.run(pipeline.on_shutdown())
+    finally:
+        server.stop()
+    return chats, batches, waits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--parallel", type=int, default=4, help="server generation slots (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--batch-users", type=int, default=2)
+    parser.add_argument("--parts", type=int, default=8, help="part numbers per batch")
+    parser.add_argument("--chat-users", type=int, default=4)
+    parser.add_argument("--think", type=float, default=2.0, help="pause between a chat user's messages (s)")
+    parser.add_argument("--ttft", type=float, default=0.3, help="fake prefill time (s)")
+    parser.add_argument("--token-rate", type=float, default=60.0, help="fake decode speed (tokens/s)")
+    parser.add_argument("--tokens", type=int, default=60, help="tokens per summary reply")
+    parser.add_argument("--search-latency", type=float, default=0.2, help="fake DuckDuckGo latency (s)")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipelines' own log output")
+    args = parser.parse_args()
+
+    fakes.install_runtime_stubs(0.02)
+    fakes.FakeDDGS.latency = args.search_latency
+    print(f"{args.batch_users} batch user(s) x {args.parts} parts, {args.chat_users} chat user(s), "
+          f"server parallel {args.parallel}")
+    print(f"{'mode':<10} {'chats':>5} {'TTFT p50':>9} {'TTFT p95':>9} {'chat p50':>9} {'chat p95':>9} "
+          f"{'batch max':>10}  mean queue wait")
+    for mode, inflight in (("scheduler", args.parallel), ("fifo", FIFO_SLOTS)):
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+        with quiet:
+            chats, batches, waits = run(args, inflight)
+        ttft = [c[0] for c in chats if c[0] is not None]
+        latency = [c[1] for c in chats]
+        wait = ", ".join(f"{p} {s:.2f}s" for p, s in sorted(waits.items()))
+        print(f"{mode:<10} {len(chats):>5} {statistics.median(ttft):>8.2f}s {percentile(ttft, 0.95):>8.2f}s "
+              f"{statistics.median(latency):>8.2f}s {percentile(latency, 0.95):>8.2f}s {max(batches):>9.2f}s  {wait}")
+
+
+if __name__ == "__main__":
+    main()
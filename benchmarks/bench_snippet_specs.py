@@ -0,0 +1,152 @@
+"""Hit rate, accuracy and LLM time saved by SUMMARY_MODE="snippets".
+
+Runs pipeline_utils.snippet_specs.extract_specs over a corpus of saved search
+results (default: benchmarks/fixtures/search_results.json; per part number
+the results of the five aspect queries of pn.py and the expected specs, or
+null when the results do not state them). A part is a hit when the record is
+confident (``--min-confidence``, like SNIPPET_MIN_CONFIDENCE), so pn.py skips
+the summary LLM call and, as the record already has the selector arguments,
+the params call. Reported:
+
+- hit rate, and wrong hits (confident but a selector argument differs from
+  the expected one; those would filter on the wrong candidates),
+- per field, how often the rendered summary states the expected value, and
+  how often it leaves the field open (not stated or sources disagree: the
+  match then treats it as unknown, as with an LLM summary that omits it),
+- extraction time per part,
+- time saved: for every hit, the summary call it replaces, estimated from
+  the prompt size (``--prefill-rate``) and a typical summary length
+  (``--summary-tokens`` at ``--token-rate``), or timed on a real server with
+  --ollama. The params call is only counted with ``--params-llm``
+  (PARAMS_MODE="llm"); in "speculative" mode it is mostly skipped already.
+
+    python benchmarks/bench_snippet_specs.py
+    python benchmarks/bench_snippet_specs.py --min-confidence 0.6 --verbose
+    python benchmarks/bench_snippet_specs.py --ollama http://ollama:11434 --model qwen2.5:latest
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.matcher import target_from
+from pipeline_utils.prompt_templates import PARAMS_TAGS, SUMMARY
+from pipeline_utils.prompting import compact_search_results, estimate_tokens
+from pipeline_utils.snippet_specs import PARAM_FIELDS, SPEC_FIELDS, extract_specs
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "search_results.json")
+SNIPPET_MAX_CHARS = 400
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        corpus = json.load(f)
+    for item in corpus:
+        # 與 pn.py 的 search_stage 相同: 依面向順序合併
+        item["merged"] = [r for results in item["results"].values() for r in results]
+    return corpus
+
+
+def summary_messages(item):
+    search_context = compact_search_results(item["merged"], SNIPPET_MAX_CHARS)
+    return SUMMARY.render(part_number=item["part_number"], search_results=search_context)
+
+
+def estimate_seconds(messages, output_tokens, args):
+    prompt = sum(estimate_tokens(m["content"]) for m in messages)
+    return prompt / args.prefill_rate + output_tokens / args.token_rate
+
+
+def measure_seconds(url, model, messages, max_tokens):
+    """Wall time of one non-streamed /api/chat call."""
+    import requests as http
+
+    start = time.perf_counter()
+    r = http.post(f"{url}/api/chat", json={
+        "model": model, "messages": messages, "stream": False, "options": {"num_predict": max_tokens},
+    }, timeout=600)
+    r.raise_for_status()
+    return time.perf_counter() - start, r.json().get("message", {}).get("content", "")
+
+
+def field_outcome(name, specs, target, expected):
+    """0 correct, 1 left open, 2 wrong"""
+    if name in PARAM_FIELDS:
+        return 0 if specs.value(name) == expected[name] else 2
+    value = getattr(target, name)
+    if value is None:
+        return 1
+    want = tuple(expected[name]) if name == "temperature" else expected[name]
+    return 0 if value == want else 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--min-confidence", type=float, default=0.8)
+    parser.add_argument("--repeat", type=int, default=20, help="extractions per part for the timing")
+    parser.add_argument("--prefill-rate", type=float, default=1500.0, help="prompt tokens/s (32B on one GPU)")
+    parser.add_argument("--token-rate", type=float, default=25.0, help="generated tokens/s (32B on one GPU)")
+    parser.add_argument("--summary-tokens", type=int, default=250, help="typical summary length")
+    parser.add_argument("--params-tokens", type=int, default=120, help="typical params reply length")
+    parser.add_argument("--params-llm", action="store_true", help="count the params call too (PARAMS_MODE=llm)")
+    parser.add_argument("--ollama", help="time the skipped summary calls on this Ollama server")
+    parser.add_argument("--model", default="qwen2.5:latest")
+    parser.add_argument("--verbose", action="store_true", help="print every record")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    hits = wrong = 0
+    fields = {name: [0, 0, 0] for name in SPEC_FIELDS}
+    extract_s, saved_s = [], 0.0
+    for item in corpus:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            specs = extract_specs(item["merged"], item["part_number"])
+        extract_s.append((time.perf_counter() - start) / args.repeat)
+        confident = specs.confidence >= args.min_confidence
+        summary = specs.summary(args.min_confidence) if specs.params else ""
+        expected = item["expected"]
+        if args.verbose:
+            print(f"{item['part_number']:<24} {specs.confidence:.2f} {'hit ' if confident else 'miss'} {specs.params}")
+        if not confident:
+            continue
+        hits += 1
+        if expected is None or any(specs.value(n) != expected[n] for n in PARAM_FIELDS):
+            wrong += 1
+            print(f"  wrong: {item['part_number']}: {specs.params}, expected {expected}")
+            continue
+        target = target_from(specs.params, summary)
+        for name, counts in fields.items():
+            counts[field_outcome(name, specs, target, expected)] += 1
+
+        messages = summary_messages(item)
+        if args.ollama:
+            seconds, text = measure_seconds(args.ollama, args.model, messages, args.summary_tokens * 4)
+        else:
+            seconds, text = estimate_seconds(messages, args.summary_tokens, args), "x" * (args.summary_tokens * 4)
+        saved_s += seconds
+        if args.params_llm:
+            params_messages = PARAMS_TAGS.render(part_number=item["part_number"], summary=text)
+            saved_s += estimate_seconds(params_messages, args.params_tokens, args)
+
+    n = len(corpus)
+    known = sum(1 for item in corpus if item["expected"] is not None)
+    print(f"{n} parts ({known} with expected specs), min confidence {args.min_confidence:g}")
+    print(f"hits: {hits} ({hits / n:.0%} of all, {(hits - wrong) / max(1, known):.0%} of the parts with specs), "
+          f"wrong hits: {wrong}")
+    for name, (ok, open_, bad) in fields.items():
+        print(f"  {name:<18} correct {ok:>3}, left open {open_:>3}, wrong {bad:>3}")
+    extract_s.sort()
+    print(f"extraction: p50 {extract_s[len(extract_s) // 2] * 1e3:.2f} ms, max {extract_s[-1] * 1e3:.2f} ms per part")
+    source = f"timed on {args.ollama}" if args.ollama else (
+        f"estimated at {args.prefill_rate:g} prompt / {args.token_rate:g} generated tokens/s")
+    calls = "summary + params" if args.params_llm else "summary"
+    print(f"LLM time saved ({calls} calls, {source}): {saved_s:.1f}s in total, "
+          f"{saved_s / max(1, hits):.1f}s per hit, {saved_s / n:.1f}s per request")
+
+
+if __name__ == "__main__":
+    main()
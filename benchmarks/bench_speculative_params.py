@@ -0,0 +1,81 @@
+"""Time-to-candidates with PARAMS_MODE="speculative" vs the LLM params stage.
+
+Replays the fixture summaries through ParamExtractor the way they arrive from
+the summary stream (a few characters per token) and reports, per part:
+
+- where in the stream the arguments became confident (the candidate query
+  starts there),
+- whether the extracted arguments equal the expected ones, or the extractor
+  declined and the LLM path is used,
+- the estimated time from the start of the summary until the candidates are
+  known, with and without the LLM params call.
+
+    python benchmarks/bench_speculative_params.py
+    python benchmarks/bench_speculative_params.py --token-rate 25 --params-tokens 300
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.param_extractor import ParamExtractor
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "summaries.json")
+# qwen2.5 tokenizer averages roughly this many characters per token on English prose
+CHARS_PER_TOKEN = 4.0
+
+
+def replay(summary, chars_per_chunk):
+    extractor = ParamExtractor()
+    for i in range(0, len(summary), chars_per_chunk):
+        extractor.feed(summary[i:i + chars_per_chunk])
+    return extractor, extractor.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixture", default=FIXTURE)
+    parser.add_argument("--token-rate", type=float, default=20.0, help="decode speed of the 32B model (tokens/s)")
+    parser.add_argument("--ttft", type=float, default=1.5, help="prefill time of the params prompt (s)")
+    parser.add_argument("--params-tokens", type=int, default=250, help="tokens the params stage generates (CoT + call)")
+    args = parser.parse_args()
+
+    with open(args.fixture, encoding="utf-8") as f:
+        cases = json.load(f)
+
+    chunk = max(1, int(CHARS_PER_TOKEN))
+    params_call = args.ttft + args.params_tokens / args.token_rate
+    rows, baseline_total, speculative_total = [], 0.0, 0.0
+    correct = declined = wrong = 0
+    for case in cases:
+        summary = case["summary"]
+        extractor, params = replay(summary, chunk)
+        summary_time = len(summary) / CHARS_PER_TOKEN / args.token_rate
+        baseline = summary_time + params_call
+        if params is None:
+            declined += 1
+            outcome, speculative = "LLM fallback", baseline
+        elif params == case["expected"]:
+            correct += 1
+            outcome, speculative = "ok", summary_time
+        else:
+            wrong += 1
+            outcome, speculative = f"WRONG {params}", summary_time
+        confident = f"{extractor.confident_at / len(summary):.0%}" if extractor.confident_at else "-"
+        rows.append((case["part_number"], confident, outcome, baseline, speculative))
+        baseline_total += baseline
+        speculative_total += speculative
+
+    print(f"{'part number':<24} {'confident at':>12} {'baseline (s)':>13} {'speculative (s)':>16}  result")
+    for pn, confident, outcome, baseline, speculative in rows:
+        print(f"{pn:<24} {confident:>12} {baseline:>13.1f} {speculative:>16.1f}  {outcome}")
+    n = len(cases)
+    print()
+    print(f"cases: {n}  extracted correctly: {correct}  declined (LLM fallback): {declined}  wrong: {wrong}")
+    print(f"mean time-to-candidates: baseline {baseline_total / n:.1f}s, speculative {speculative_total / n:.1f}s "
+          f"({1 - speculative_total / baseline_total:.0%} less)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""Offline stand-ins for the services the pipelines talk to.
+
+- ``FakeOpenAIServer``: a local OpenAI-compatible ``/v1/chat/completions``
+  endpoint (and Ollama's native ``/api/chat``) that streams chunks after
+  ``ttft`` seconds at ``token_rate`` tokens/s, with a usage block in the last
+  chunk, like Ollama. The reply is
+  chosen from the request (JSON for ``response_format``, a tagged
+  get_filtered_products call for the params prompt, a JSON block for the
+  decode prompt, a ✅/❌ table for the match prompt, a part summary
+  otherwise). Structured replies go on with some text after the structure,
+  as models do; ``stop`` and ``max_tokens``/``num_predict`` are honoured.
+  With ``parallel`` it generates at most that many replies at once and
+  queues the others, like Ollama with OLLAMA_NUM_PARALLEL.
+- ``frame_chunk``: the bytes the pipelines server sends to the client for
+  one item a pipeline yields.
+- ``FakeDDGS``: drop-in for ``duckduckgo_search.DDGS`` with fixed latency and an
+  optional error rate (to exercise the retries).
+- ``select_products``: the selector's filter as a plain scan of the catalog
+  fixture, independent of ``ProductCatalog`` (the reference it is checked
+  against).
+- ``install_runtime_stubs``: puts a ``selector`` module answering from
+  ``select_products`` (and ``schemas`` when the pipelines server is not
+  installed) into ``sys.modules`` before the pipelines are imported.
+
+The server can also be run on its own, e.g. to point a development Open WebUI
+at it:
+
+    python benchmarks/fakes.py --port 11434 --ttft 0.3 --token-rate 40
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import types
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+CATALOG = os.path.join(FIXTURES, "catalog.json")
+# 假伺服器在 /v1/models 回報的模型名稱; 基準測試把 pipeline 的 MODEL 設為這個值
+MODEL = "fake"
+
+SUMMARY_TEXT = (
+    "The part is a DDR3L SDRAM with a 1.35V supply (compatible with 1.5V). "
+    "Its density is 4Gb, organized as 256M x16. "
+    "The maximum frequency is 800MHz (DDR3-1600) and the operating temperature is 0°C to 95°C. "
+)
+FILLER = "It comes in a 96-ball FBGA package and is intended for consumer and industrial designs. "
+PARAMS_TEXT = (
+    "The summary states DDR3L, 1.35V and 4Gb.\n<get_filtered_products>\nget_filtered_products(\n"
+    '    type_of_ddr="DDR3 SDRAM or DDR3(L) SDRAM",\n    Operation_Voltage="T",\n    Density="4Gb",\n)\n'
+    "</get_filtered_products>\n\nThese arguments select DDR3(L) parts at 1.35V with a density of 4Gb; "
+    "the I/O width and speed grade are checked in the next steps against the candidate products."
+)
+PARAMS_JSON = json.dumps({
+    "reasoning": "DDR3L, 1.35V, 4Gb",
+    "type_of_ddr": "DDR3 SDRAM or DDR3(L) SDRAM",
+    "Operation_Voltage": "T",
+    "Density": "4Gb",
+})
+# JSON mode 的模型常在物件之後輸出一連串空白/換行
+PARAMS_JSON_REPLY = PARAMS_JSON + " \n" * 24
+DECODE_TEXT = (
+    "Decoding the candidates with the DRAM naming pattern:\n```json\n[\n"
+    + ",\n".join(
+        f'  {{"product_id": "M15T4G16256A-DEB2G{s}", "family": "DDR3 SDRAM", "voltage": "1.35V", '
+        f'"density": "4Gb", "io": "x16", "max_frequency": "800MHz", "temperature": "{t}"}}'
+        for s, t in (("", "0°C to 95°C"), ("I", "-40°C to 95°C"))
+    )
+    + "\n]\n```\n\nBoth candidates decode to a 4Gb DDR3(L) x16 device at 1.35V; they differ only in the "
+    "operating temperature range, which the industrial (I) suffix extends down to -40°C. The remaining "
+    "fields of the part number follow the naming rule as listed in the reference."
+)
+MATCH_TEXT = (
+    "| Product ID | DDR type | Voltage | Density | Frequency | Temperature |\n|---|---|---|---|---|---|\n"
+    "| M15T4G16256A-DEB2G | DDR3L ✅ | 1.35V ✅ | 4Gb ✅ | 800MHz ✅ | 0°C to 95°C ✅ |\n"
+    "| M15T4G16256A-DEB2GI | DDR3L ✅ | 1.35V ✅ | 4Gb ✅ | 800MHz ✅ | -40°C to 95°C ❌ |\n\n"
+    "M15T4G16256A-DEB2G meets every feature of the golden target; the I variant has a wider temperature range "
+    "than required.\nBest match product_id: M15T4G16256A-DEB2G\n\nNote that both parts share the same package "
+    "and pin-out, so the industrial variant is a drop-in replacement should the temperature requirement change "
+    "later. Availability and lead times should be confirmed with sales before the design is frozen."
+)
+
+
+def reply_for(payload, tokens):
+    """Text the fake model answers ``payload`` with, split into ``tokens`` pieces at most."""
+    prompt = " ".join(str(m.get("content", "")) for m in payload.get("messages", []))
+    options = payload.get("options") or {}
+    if payload.get("response_format") or payload.get("format"):
+        text = PARAMS_JSON_REPLY
+    elif "<golden_target_description>" in prompt:
+        text = MATCH_TEXT
+    elif "Please decode the candidate products" in prompt:
+        text = DECODE_TEXT
+    elif "<get_filtered_products>" in prompt:
+        text = PARAMS_TEXT
+    else:
+        text = SUMMARY_TEXT + FILLER * max(0, math.ceil((tokens - len(SUMMARY_TEXT.split())) / len(FILLER.split())))
+        text = " ".join(text.split(" ")[:tokens])
+    stop = payload.get("stop") or options.get("stop") or ()
+    for sequence in [stop] if isinstance(stop, str) else stop:
+        if sequence in text:
+            text = text[:text.index(sequence)]
+    words = text.split(" ")
+    pieces = [w + " " for w in words[:-1]] + [words[-1]]
+    limit = payload.get("max_tokens") or options.get("num_predict")
+    if limit and len(pieces) > limit:
+        return pieces[:limit], len(prompt) // 4, "length"
+    return pieces, len(prompt) // 4, "stop"
+
+
+class FakeOpenAIServer:
+    """OpenAI-compatible SSE server on 127.0.0.1 with configurable TTFT and token rate.
+
+    ``start()`` runs it in a child process (so its threads do not compete with
+    the pipeline for the GIL) and returns the base URL; ``stop()`` ends it.
+    """
+
+    def __init__(self, ttft=0.3, token_rate=40.0, tokens=120, port=0, parallel=0):
+        self.ttft = ttft
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.port = port
+        self.parallel = parallel
+        self.process = None
+        self.base_url = None
+
+    def start(self):
+        ctx = get_context("spawn")
+        ready = ctx.Queue()
+        self.process = ctx.Process(
+            target=serve, args=(self.ttft, self.token_rate, self.tokens, self.port, ready, self.parallel), daemon=True
+        )
+        self.process.start()
+        self.base_url = f"http://127.0.0.1:{ready.get(timeout=30)}"
+        return self.base_url
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join(5)
+            self.process = None
+
+
+def make_handler(ttft, token_rate, tokens):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            # 健康檢查 (GET /v1/models)
+            if self.path.rstrip("/") != "/v1/models":
+                self.send_error(404)
+                return
+            data = json.dumps({"object": "list", "data": [{"id": self.server.model, "object": "model"}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            path = self.path.rstrip("/")
+            if path not in ("/v1/chat/completions", "/api/chat"):
+                self.send_error(404)
+                return
+            native = path == "/api/chat"
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            pieces, prompt_tokens, finish_reason = reply_for(payload, tokens)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson" if native else "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            # 同時生成的回覆數已達上限時排隊 (OLLAMA_NUM_PARALLEL)
+            slots = self.server.slots
+            if slots is not None:
+                slots.acquire()
+            try:
+                time.sleep(ttft)
+                start = time.perf_counter()
+                for i, piece in enumerate(pieces):
+                    # 以絕對時間排程, 避免 sleep 誤差累積
+                    delay = start + (i + 1) / token_rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    self.send_piece(native, piece)
+                self.send_piece(native, None, prompt_tokens, len(pieces), time.perf_counter() - start, finish_reason)
+                self.send_chunk(b"")
+            except (BrokenPipeError, ConnectionResetError):
+                # 用戶端提前關閉串流 (例如參數階段讀到結束標籤)
+                self.close_connection = True
+            finally:
+                if slots is not None:
+                    slots.release()
+
+        def send_piece(self, native, piece, prompt_tokens=0, completion_tokens=0, decode_time=0.0, finish_reason="stop"):
+            """One content piece, or the final message with usage when ``piece`` is None."""
+            model = self.server.model
+            if native:
+                if piece is not None:
+                    data = {"model": model, "message": {"role": "assistant", "content": piece}, "done": False}
+                else:
+                    data = {"model": model, "message": {"role": "assistant", "content": ""}, "done": True,
+                            "done_reason": finish_reason, "prompt_eval_count": prompt_tokens, "eval_count": completion_tokens,
+                            "prompt_eval_duration": int(ttft * 1e9), "eval_duration": int(decode_time * 1e9)}
+                self.send_chunk(json.dumps(data).encode() + b"\n")
+                return
+            if piece is not None:
+                data = {"choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            else:
+                data = {"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}],
+                        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                  "total_tokens": prompt_tokens + completion_tokens}}
+            data.update(object="chat.completion.chunk", model=model)
+            self.send_chunk(b"data: " + json.dumps(data).encode() + b"\n\n")
+            if piece is None:
+                self.send_chunk(b"data: [DONE]\n\n")
+
+        def send_chunk(self, data):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(ttft, token_rate, tokens, port=0, ready=None, parallel=0):
+    httpd = ThreadingHTTPServer(("127.0.0.1", port), make_handler(ttft, token_rate, tokens))
+    httpd.daemon_threads = True
+    httpd.request_queue_size = 1024
+    httpd.model = MODEL
+    httpd.slots = threading.Semaphore(parallel) if parallel > 0 else None
+    if ready is not None:
+        ready.put(httpd.server_address[1])
+    else:
+        print(f"fake OpenAI server: http://127.0.0.1:{httpd.server_address[1]}/v1/chat/completions")
+    httpd.serve_forever()
+
+
+def frame_chunk(chunk, model=MODEL):
+    """Server-sent event the pipelines server writes for one item of a pipeline's stream.
+
+    Like its ``stream_content``: ``data:`` lines pass through, anything else
+    is wrapped in a ``chat.completion.chunk`` with a fresh id.
+    """
+    if isinstance(chunk, bytes):
+        chunk = chunk.decode("utf-8")
+    if chunk.startswith("data:"):
+        return f"{chunk}\n\n".encode("utf-8")
+    message = {
+        "id": f"{model}-{uuid.uuid4()}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {"content": chunk}, "logprobs": None, "finish_reason": None}],
+    }
+    return f"data: {json.dumps(message)}\n\n".encode("utf-8")
+
+
+class FakeDDGS:
+    """``duckduckgo_search.DDGS`` replacement: ``latency`` seconds per query, fails with ``error_rate``."""
+
+    latency = 0.5
+    error_rate = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def text(self, query, max_results=5, region=None):
+        time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise RuntimeError("202 Ratelimit")
+        return [
+            {"title": f"{query} datasheet {i}", "href": f"https://example.com/{i}/{query.replace(' ', '-')}",
+             "body": f"{query}: {SUMMARY_TEXT.split('. ')[i % 3]}."}
+            for i in range(max_results)
+        ]
+
+
+def selector_row(product):
+    """The selector columns of a fixture row: DDR type, voltage code, density (Mb) and I/O width.
+
+    Rows with a column of their own (the PSRAM and other non-decodable parts)
+    use it; for the stand-in rows the column is what the product id encodes.
+    """
+    from pipeline_utils.matcher import DDR_TYPE_FAMILIES
+    from pipeline_utils.dram_decoder import decode_part_number
+    from pipeline_utils.units import parse_density_mb
+
+    decoded = decode_part_number(product["product_id"])
+    types = [name for name, families in DDR_TYPE_FAMILIES.items()
+             if decoded is not None and decoded.product_family_code in families]
+    return {
+        "types": [product["type_of_ddr"]] if "type_of_ddr" in product else types,
+        "voltage": product.get("Operation_Voltage", decoded and decoded.voltage_code),
+        "density_mb": parse_density_mb(product["Density"]) if "Density" in product else decoded and decoded.density_mb,
+        "io": int(product["io"][1:]) if "io" in product else decoded and decoded.io,
+    }
+
+
+def select_products(products, type_of_ddr=None, Operation_Voltage=None, Density=None, io=None,
+                    min_frequency_mhz=None, temperature_range=None):
+    """What a selector without indexes does per request: check every row."""
+    from pipeline_utils.matcher import temperature_fits
+    from pipeline_utils.units import parse_density_mb, parse_frequency_mhz, parse_temperature_range
+
+    matches = []
+    for p in products:
+        row = selector_row(p)
+        if type_of_ddr and type_of_ddr not in row["types"]:
+            continue
+        if Operation_Voltage and row["voltage"] != Operation_Voltage:
+            continue
+        if Density and row["density_mb"] != parse_density_mb(Density):
+            continue
+        if io and row["io"] != int(str(io).lstrip("xX")):
+            continue
+        if min_frequency_mhz is not None:
+            f = parse_frequency_mhz(p["max_frequency"])
+            if f is None or f < min_frequency_mhz:
+                continue
+        if temperature_range is not None:
+            t = parse_temperature_range(p["operating_temperature"])
+            if t is None or not temperature_fits(t, temperature_range):
+                continue
+        matches.append(p)
+    return matches
+
+
+def install_runtime_stubs(selector_latency=0.0):
+    """Provide the pipelines-server modules the pipelines import.
+
+    ``selector.get_filtered_products`` is answered from the catalog fixture
+    by ``select_products``; ``schemas`` is only stubbed when the pipelines
+    server is not installed.
+    """
+    with open(CATALOG, encoding="utf-8") as f:
+        products = json.load(f)["products"]
+
+    def get_filtered_products(**filters):
+        if selector_latency:
+            time.sleep(selector_latency)
+        matches = select_products(products, **filters)
+        return {"total_matches": len(matches), "products": matches}
+
+    selector = types.ModuleType("selector")
+    selector.get_filtered_products = get_filtered_products
+    sys.modules["selector"] = selector
+    try:
+        import schemas  # noqa: F401
+    except ImportError:
+        schemas = types.ModuleType("schemas")
+        schemas.OpenAIChatMessage = dict
+        sys.modules["schemas"] = schemas
+
+    import pipeline_utils.search
+    pipeline_utils.search.DDGS = FakeDDGS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--ttft", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=40.0, help="tokens/s")
+    parser.add_argument("--tokens", type=int, default=120, help="tokens per summary reply")
+    parser.add_argument("--parallel", type=int, default=0, help="replies generated at once (0 = unlimited)")
+    args = parser.parse_args()
+    serve(args.ttft, args.token_rate, args.tokens, args.port, parallel=args.parallel)
+
+
+if __name__ == "__main__":
+    main()
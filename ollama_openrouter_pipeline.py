@@ -1 +1,147 @@
+from typing import List, Union, Generator, Iterator
+from schemas import OpenAIChatMessage
+from pydantic import BaseModel
 
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from pipeline_utils.backends import Backend, BackendPool, Failover, HealthChecker, parse_backend_urls
+from pipeline_utils.ollama_client import STREAM_ERRORS, OllamaClient
+from pipeline_utils.output_stream import Coalescer, output_chunks
+from pipeline_utils.sse import SSEDecoder
+
+class Pipeline:
+    class Valves(BaseModel):
+        # OpenRouter (OpenAI 相容 API); 模型名稱使用 OpenRouter 的命名
+        OPENROUTER_API_KEY: str = ""
+        OPENROUTER_BASE_URL: str = "https://openrouter.ai/api"
+        OPENROUTER_MODEL: str = "qwen/qwen-2.5-72b-instruct"
+        # 備援的 Ollama 後端 (逗號分隔, 留空 = 不使用); 只在 OpenRouter 出錯或無法連線時使用
+        OLLAMA_BASE_URL: str = ""
+        OLLAMA_MODEL: str = "qwen2.5:latest"
+        # 後端健康檢查間隔 (秒, 0 = 不檢查); 串流中途出錯時改由其他後端接續的次數
+        HEALTH_INTERVAL: float = 60.0
+        FAILOVER_ATTEMPTS: int = 2
+        # 連線池大小與逾時 (秒); read timeout 為兩個串流片段間的最長間隔
+        POOL_SIZE: int = 10
+        CONNECT_TIMEOUT: float = 5.0
+        READ_TIMEOUT: float = 300.0
+        # 輸出格式: "content" 只送出文字並合併成較大的片段; "sse" 逐一轉送原始 SSE 行
+        # 合併的時間與大小窗口 (ms / bytes; 0 ms = 不合併), 只在不會打斷 markdown 區塊的位置切開
+        STREAM_FORMAT: str = "content"
+        STREAM_COALESCE_MS: float = 30.0
+        STREAM_COALESCE_BYTES: int = 256
+
+    def __init__(self):
+        # self.id = "ollama_openrouter_pipeline"
+        self.name = "OpenRouter Pipeline"
+        self.valves = self.Valves(OPENROUTER_API_KEY=os.getenv("OPENROUTER_API_KEY", ""))
+        self.client = None
+        self.backends = None
+        self.health_checker = None
+        pass
+
+    async def on_startup(self):
+        # This function is called when the server is started.
+        print(f"on_startup:{__name__}")
+        if self.valves.HEALTH_INTERVAL > 0 and self.health_checker is None:
+            client = self.get_client()
+            self.health_checker = HealthChecker(
+                self.get_backends(), lambda b: client.list_models(b.url, b.headers()),
+                self.valves.HEALTH_INTERVAL,
+            )
+            self.health_checker.start()
+        pass
+
+    async def on_shutdown(self):
+        # This function is called when the server is stopped.
+        print(f"on_shutdown:{__name__}")
+        if self.health_checker is not None:
+            self.health_checker.stop()
+            self.health_checker = None
+        self.backends = None
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        pass
+
+    async def on_valves_updated(self):
+        # 金鑰或後端改變時重新建立後端池
+        await self.on_shutdown()
+        await self.on_startup()
+
+    def get_client(self):
+        """取得共用的 HTTP 連線池 (OllamaClient 適用任何 OpenAI 相容的 API)"""
+        if self.client is None:
+            self.client = OllamaClient(
+                pool_size=self.valves.POOL_SIZE,
+                connect_timeout=self.valves.CONNECT_TIMEOUT,
+                read_timeout=self.valves.READ_TIMEOUT,
+            )
+        return self.client
+
+    def get_backends(self):
+        """OpenRouter 為主要後端, OLLAMA_BASE_URL 中的各台為備援"""
+        if self.backends is None:
+            backends = [Backend(
+                self.valves.OPENROUTER_BASE_URL.rstrip("/"), self.valves.OPENROUTER_API_KEY,
+                model=self.valves.OPENROUTER_MODEL, name="openrouter",
+            )]
+            backends += [
+                Backend(url, model=self.valves.OLLAMA_MODEL, fallback=True)
+                for url in parse_backend_urls(self.valves.OLLAMA_BASE_URL)
+            ]
+            self.backends = BackendPool(backends)
+        return self.backends
+
+    def make_coalescer(self):
+        """每個回應各自的 output_stream.Coalescer; "sse" 格式或窗口為 0 時不合併"""
+        if self.valves.STREAM_FORMAT == "sse" or self.valves.STREAM_COALESCE_MS <= 0:
+            return None
+        return Coalescer(self.valves.STREAM_COALESCE_MS / 1000, self.valves.STREAM_COALESCE_BYTES)
+
+    def stream_completion(self, payload, decoder):
+        """串流呼叫 chat completions, 逐一產生 SSE 事件 (內容同時累積在 decoder)
+
+        OpenRouter reports some upstream failures as an error event inside a
+        200 stream; those end the stream without a finish reason and are
+        treated like a dropped connection: the next backend continues from
+        what was already streamed (backends.Failover).
+        """
+        client = self.get_client()
+        failover = Failover(
+            self.get_backends(), lambda backend, request: client.stream_chat(backend.url, request, backend.headers()),
+            STREAM_ERRORS, self.valves.FAILOVER_ATTEMPTS,
+        )
+        return failover.events(payload, decoder)
+
+    def pipe(
+        self, user_message: str, model_id: str, messages: List[dict], body: dict
+    ) -> Union[str, Generator, Iterator]:
+        print(f"pipe:{__name__}")
+
+        if "user" in body:
+            print("######################################")
+            print(f'# User: {body["user"]["name"]} ({body["user"]["id"]})')
+            print(f"# Message: {user_message}")
+            print("######################################")
+
+        try:
+            payload = {
+                # 實際模型由各後端決定 (OPENROUTER_MODEL / OLLAMA_MODEL)
+                "model": self.valves.OPENROUTER_MODEL,
+                "messages": messages,
+                "stream": True,
+            }
+
+            def response():
+                decoder = SSEDecoder()
+                for event in self.stream_completion(payload, decoder):
+                    if not event.done:
+                        yield event
+                print(f"response: {len(decoder.text())} chars, usage={decoder.usage}")
+
+            return output_chunks(response(), self.valves.STREAM_FORMAT == "sse", self.make_coalescer())
+
+        except Exception as e:
+            return f"Error: {e}"
@@ -0,0 +1,5 @@
+"""Shared helpers for the pipelines in this directory.
+
+The pipelines server only loads the top level ``*.py`` files as pipelines, so
+everything that is reused across them lives in this package instead.
+"""
@@ -0,0 +1,75 @@
+"""asyncio counterpart of OllamaClient (aiohttp)."""
+import asyncio
+
+import aiohttp
+
+from .ollama_native import native_request, sse_lines
+
+# 連線失敗, 逾時或串流中斷: 可以換一台後端重試
+STREAM_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, OSError)
+
+
+class AsyncOllamaClient:
+    """Keep-alive connection pool for the async pipeline.
+
+    The aiohttp session is bound to the event loop it is created on, so it is
+    created lazily on first use (from the pipeline's loop) rather than in the
+    constructor. ``pool_size`` caps the open connections; ``read_timeout`` is
+    the longest allowed gap between two streamed chunks.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=5.0, read_timeout=300.0):
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.session = None
+
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.pool_size),
+                timeout=self.timeout,
+            )
+        return self.session
+
+    async def stream_chat(self, base_url, payload, headers=None, native=False):
+        """POST a streaming chat completion and yield the non-empty SSE lines.
+
+        With ``native`` the request goes to Ollama's /api/chat (which honours
+        keep_alive and options) and the NDJSON answer is translated to the
+        same SSE lines. If the consumer stops early or the task is cancelled,
+        the connection is dropped instead of returned to the pool, so Ollama
+        sees the disconnect and stops generating.
+        """
+        if native:
+            url, payload = f"{base_url}/api/chat", native_request(payload)
+        else:
+            url = f"{base_url}/v1/chat/completions"
+        async with self.get_session().post(url, json=payload, headers=headers) as r:
+            try:
+                r.raise_for_status()
+                async for line in r.content:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    if native:
+                        for sse_line in sse_lines(line):
+                            yield sse_line
+                    else:
+                        yield line
+            except (asyncio.CancelledError, GeneratorExit):
+                r.close()
+                raise
+
+    async def list_models(self, base_url, headers=None, timeout=5.0):
+        """Model ids served by ``base_url`` (used as the health check)."""
+        async with self.get_session().get(
+            f"{base_url}/v1/models", headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as r:
+            r.raise_for_status()
+            data = await r.json()
+        return [m.get("id") for m in data.get("data", [])]
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
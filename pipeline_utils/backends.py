@@ -0,0 +1,277 @@
+"""Pool of OpenAI-compatible chat backends (Ollama boxes, OpenRouter).
+
+``BackendPool.acquire(model)`` hands out the healthy backend with the fewest
+requests in flight, preferring backends known to serve ``model``;
+``release(backend, error)`` gives it back and takes a backend that failed out
+of rotation until a health check succeeds again. Health checks ask each
+backend for its model list (``GET /v1/models``) and are driven by the
+pipeline: ``HealthChecker`` from a thread for the synchronous pipelines,
+``health_loop`` as a task on the async pipeline's event loop. ``Failover``
+streams one completion from the pool, moving to the next backend when one
+fails.
+
+The pool only tracks state and is safe to share between threads and the
+event loop; the HTTP calls stay in OllamaClient / AsyncOllamaClient.
+"""
+import asyncio
+import itertools
+import threading
+import time
+from contextlib import aclosing
+
+
+def parse_backend_urls(value):
+    """Valve value "http://gpu1:11434, http://gpu2:11434" -> list of URLs without trailing "/"."""
+    return [url.strip().rstrip("/") for url in (value or "").replace("\n", ",").split(",") if url.strip()]
+
+
+class Backend:
+    """One endpoint.
+
+    ``model`` (optional) replaces the requested model on this backend, for
+    pools that mix providers with different model names. A ``fallback``
+    backend only gets requests when no regular backend is healthy, or when
+    the regular ones already failed the request.
+    """
+
+    def __init__(self, url, api_key=None, model=None, name=None, fallback=False):
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.name = name or url
+        self.fallback = fallback
+        self.outstanding = 0
+        self.healthy = True
+        self.models = None  # None = 未知, 視為所有模型都可用
+        self.failures = 0
+        self.last_error = None
+        self.checked = None
+
+    def headers(self):
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else None
+
+    def payload(self, payload):
+        """The request as this backend should receive it."""
+        return {**payload, "model": self.model} if self.model else payload
+
+    def serves(self, model):
+        return self.model is not None or self.models is None or model in self.models
+
+    def stats(self):
+        return {
+            "backend": self.name, "healthy": self.healthy, "outstanding": self.outstanding,
+            "failures": self.failures, "last_error": self.last_error,
+        }
+
+
+class BackendPool:
+    """Least-outstanding-requests selection over ``backends``."""
+
+    def __init__(self, backends):
+        self.backends = list(backends)
+        if not self.backends:
+            raise ValueError("BackendPool needs at least one backend")
+        self._lock = threading.Lock()
+        # 請求數相同時輪流分配, 避免全部落在第一台
+        self._turn = itertools.count()
+
+    @classmethod
+    def from_urls(cls, urls, api_key=None):
+        return cls(Backend(url, api_key) for url in parse_backend_urls(urls))
+
+    def __len__(self):
+        return len(self.backends)
+
+    def acquire(self, model=None, exclude=()):
+        """Pick a backend for ``model`` and count the request against it.
+
+        Healthy regular backends that serve the model come first, then any
+        healthy backend; if none is healthy the least loaded one is used
+        rather than failing outright. ``exclude`` holds backends that already
+        failed this request.
+        """
+        with self._lock:
+            candidates = [b for b in self.backends if b not in exclude] or self.backends
+            for usable in (
+                lambda b: b.healthy and not b.fallback and b.serves(model),
+                lambda b: b.healthy and not b.fallback,
+                lambda b: b.healthy,
+                lambda b: True,
+            ):
+                choices = [b for b in candidates if usable(b)]
+                if choices:
+                    break
+            turn = next(self._turn)
+            backend = min(choices, key=lambda b: (b.outstanding, (self.backends.index(b) - turn) % len(self.backends)))
+            backend.outstanding += 1
+            return backend
+
+    def release(self, backend, error=None):
+        with self._lock:
+            backend.outstanding -= 1
+            if error is not None:
+                backend.failures += 1
+                backend.last_error = f"{type(error).__name__}: {error}"[:200]
+                if backend.healthy:
+                    print(f"backends: {backend.name} taken out of rotation ({backend.last_error})")
+                backend.healthy = False
+
+    def mark(self, backend, healthy, models=None, error=None):
+        """Record the result of a health check."""
+        with self._lock:
+            if healthy and not backend.healthy:
+                print(f"backends: {backend.name} back in rotation")
+            elif not healthy and backend.healthy:
+                print(f"backends: {backend.name} failed its health check ({error})")
+            backend.healthy = healthy
+            backend.checked = time.time()
+            if healthy:
+                backend.models = set(models) if models is not None else None
+            elif error is not None:
+                backend.last_error = f"{type(error).__name__}: {error}"[:200]
+
+    def stats(self):
+        with self._lock:
+            return [b.stats() for b in self.backends]
+
+
+class Failover:
+    """Stream one chat completion from ``pool``, failing over between its backends.
+
+    ``open_stream(backend, request)`` opens the streamed SSE lines on a
+    backend (a generator for ``events``, an async generator for
+    ``aevents``); after one of ``errors`` the backend is taken out of
+    rotation and the next one continues the answer, at most ``attempts``
+    times. What ``decoder`` gathered so far is sent along as the start of the
+    assistant message, so the output is not repeated. A stream that ends
+    without [DONE] or a finish reason counts as failed. Closing the events
+    early (the answer is complete, the client left) releases the backend
+    without blaming it.
+
+    ``backend`` is the backend that served the (last part of the) answer and
+    ``failed`` the ones that failed it.
+    """
+
+    def __init__(self, pool, open_stream, errors, attempts=2, model=None, label=None):
+        self.pool = pool
+        self.open_stream = open_stream
+        self.errors = errors
+        self.attempts = attempts
+        self.model = model
+        self.label = label
+        self.backend = None
+        self.failed = []
+
+    def _acquire(self):
+        self.backend = self.pool.acquire(self.model, exclude=self.failed)
+        return self.backend
+
+    def _fail_over(self, payload, decoder, error):
+        """Request for the next backend after ``error``; None when no attempt is left."""
+        self.pool.release(self.backend, error)
+        self.failed.append(self.backend)
+        if len(self.failed) > self.attempts:
+            return None
+        partial = decoder.text()
+        print(f"backends: {self.label + ' ' if self.label else ''}failed on {self.backend.name} after {len(partial)} chars, failing over ({error})")
+        if not partial:
+            return payload
+        # 由下一台後端接續已輸出的內容
+        return {**payload, "messages": payload["messages"] + [{"role": "assistant", "content": partial}]}
+
+    def events(self, payload, decoder):
+        """SSE events of the completion (their content also gathers in ``decoder``)."""
+        request = payload
+        while True:
+            backend = self._acquire()
+            try:
+                yield from decoder.iter_events(self.open_stream(backend, backend.payload(request)))
+                if not (decoder.done or decoder.finish_reason):
+                    raise ConnectionError("stream ended before [DONE]")
+            except self.errors as e:
+                request = self._fail_over(payload, decoder, e)
+                if request is None:
+                    raise
+                continue
+            except BaseException:
+                self.pool.release(backend)
+                raise
+            self.pool.release(backend)
+            return
+
+    async def aevents(self, payload, decoder):
+        """``events`` for the async pipeline; iterate it under ``aclosing`` to stop early."""
+        request = payload
+        while True:
+            backend = self._acquire()
+            try:
+                async with aclosing(self.open_stream(backend, backend.payload(request))) as lines:
+                    async for line in lines:
+                        event = decoder.feed(line)
+                        if event is not None:
+                            yield event
+                if not (decoder.done or decoder.finish_reason):
+                    raise ConnectionError("stream ended before [DONE]")
+            except self.errors as e:
+                request = self._fail_over(payload, decoder, e)
+                if request is None:
+                    raise
+                continue
+            except BaseException:
+                self.pool.release(backend)
+                raise
+            self.pool.release(backend)
+            return
+
+
+class HealthChecker:
+    """Run ``probe(backend) -> model ids`` for every backend every ``interval`` s on a daemon thread."""
+
+    def __init__(self, pool, probe, interval=15.0):
+        self.pool = pool
+        self.probe = probe
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        for backend in self.pool.backends:
+            try:
+                self.pool.mark(backend, True, self.probe(backend))
+            except Exception as e:
+                self.pool.mark(backend, False, error=e)
+
+    def _run(self):
+        while True:
+            self.check()
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="backend-health", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+
+async def check_backends(pool, probe):
+    """One round of ``await probe(backend)`` for all backends, concurrently."""
+    async def check(backend):
+        try:
+            pool.mark(backend, True, await probe(backend))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            pool.mark(backend, False, error=e)
+
+    await asyncio.gather(*(check(b) for b in pool.backends))
+
+
+async def health_loop(pool, probe, interval=15.0):
+    """Check all backends every ``interval`` seconds until cancelled."""
+    while True:
+        await check_backends(pool, probe)
+        await asyncio.sleep(interval)
@@ -0,0 +1,140 @@
+"""Small persistent key/value cache backed by SQLite.
+
+Entries expire after ``ttl`` seconds and the table is kept under
+``max_entries`` rows per namespace by evicting the least recently used rows.
+Values are stored as JSON, so anything json.dumps can handle can be cached.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def content_hash(*parts):
+    """Short, stable hash of JSON-serializable data (dict order does not matter)."""
+    data = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:32]
+
+
+class SQLiteCache:
+    def __init__(self, path, namespace="default", ttl=7 * 24 * 3600, max_entries=5000):
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # 搜尋在多個執行緒中進行, 以 lock 保護同一條連線
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, accessed)"
+        )
+
+    @staticmethod
+    def make_key(*parts):
+        """Build a stable string key from JSON-serializable parts."""
+        return json.dumps(parts, ensure_ascii=False, sort_keys=True)
+
+    def get(self, key, default=None):
+        """Return the cached value, or ``default`` on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            value, created = row
+            if self.ttl and now - created > self.ttl:
+                self._conn.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+                )
+                self.misses += 1
+                return default
+            self._conn.execute(
+                "UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key),
+            )
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value):
+        now = time.time()
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, data, now, now),
+            )
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+            )
+
+    def items(self):
+        """All unexpired (key, value) pairs of the namespace, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM cache WHERE namespace = ? AND created >= ? ORDER BY created",
+                (self.namespace, time.time() - self.ttl if self.ttl else 0),
+            ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def _evict(self):
+        if self.ttl:
+            self._conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND created < ?",
+                (self.namespace, time.time() - self.ttl),
+            )
+        if not self.max_entries:
+            return
+        (count,) = self._conn.execute(
+            "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM cache WHERE rowid IN ("
+                " SELECT rowid FROM cache WHERE namespace = ? ORDER BY accessed LIMIT ?)",
+                (self.namespace, overflow),
+            )
+            self.evictions += overflow
+
+    def stats(self):
+        with self._lock:
+            (size,) = self._conn.execute(
+                "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+        total = self.hits + self.misses
+        return {
+            "namespace": self.namespace,
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,222 @@
+"""In-memory product catalog with bitmap indexes.
+
+The catalog is loaded once (normally from ``get_filtered_products()`` with
+no filter, i.e. every product). Attributes are stored column-wise and each
+indexed attribute keeps an inverted index {value: bitmap}. Bitmaps are plain
+Python ints, bit i set = row i. A multi-attribute filter is the AND of the
+per-attribute bitmaps. Range predicates (minimum frequency, temperature
+grade) OR together the bitmaps of all qualifying values.
+
+The selector attributes (DDR type, voltage, density, I/O) are taken from the
+product's own fields when it has them (the selector's columns) and otherwise
+decoded from the product id. Rows where neither works (e.g. a PSRAM part
+without those fields) are unknown; a query they might match is left to the
+selector (``get_filtered_products`` returns None).
+"""
+from .dram_decoder import OPERATION_VOLTAGE, candidate_id, decode_batch, iter_candidates
+from .matcher import (
+    DDR_TYPE_FAMILIES, FREQUENCY_FIELDS, TEMPERATURE_FIELDS, product_field, temperature_fits,
+)
+from .units import parse_density_mb, parse_frequency_mhz, parse_temperature_range
+
+# 產品本身帶有的 selector 欄位 (欄位名稱不分大小寫)
+TYPE_FIELDS = ("type_of_ddr", "ddr_type")
+VOLTAGE_FIELDS = ("operation_voltage",)
+DENSITY_FIELDS = ("density",)
+IO_FIELDS = ("io", "organization")
+
+INDEXED = ("type", "voltage", "density_mb", "io", "temperature", "frequency_mhz")
+# 與 selector 的參數對應, 其值未知的列可能符合, 需由 selector 判斷
+SELECTOR_ATTRS = ("type", "voltage", "density_mb", "io")
+
+# product family code -> 對應的 type_of_ddr 值 (53 同時是 Mobile DDR 與 LPDDR)
+FAMILY_TYPES = {
+    family: tuple(name for name, families in DDR_TYPE_FAMILIES.items() if family in families)
+    for families in DDR_TYPE_FAMILIES.values() for family in families
+}
+
+
+def own_field(product, names):
+    """Value of the key named one of ``names`` (case-insensitive), or None."""
+    for key, value in product.items():
+        if key.lower() in names and value not in (None, ""):
+            return str(value).strip()
+    return None
+
+
+def _own_type(value):
+    for name in DDR_TYPE_FAMILIES:
+        if name.lower() == value.lower():
+            return (name,)
+    return (value,)
+
+
+def _own_voltage(value):
+    if value.upper() in OPERATION_VOLTAGE:
+        return value.upper()
+    # "1.35V" 等電壓值只在對應到唯一代碼時換算
+    codes = [code for code, description in OPERATION_VOLTAGE.items()
+             if description.split(" ")[0] == value.replace(" ", "")]
+    return codes[0] if len(codes) == 1 else value
+
+
+def _own_io(value):
+    digits = value.lstrip("xX")
+    return int(digits) if digits.isdigit() else value
+
+
+def _bits(rows, size):
+    # 先寫入 bytearray 再一次轉成 int, 避免逐位元建立大整數
+    buf = bytearray((size + 7) // 8)
+    for i in rows:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, "little")
+
+
+def _iter_bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class ProductCatalog:
+    def __init__(self, products):
+        self.products = list(products)
+        ids = [candidate_id(p) for p in self.products]
+        decoded = decode_batch(ids)
+        cols = decoded.columns
+        self.ids = ids
+        self.columns = {
+            "type": [
+                _own_type(v) if v is not None else (
+                    FAMILY_TYPES.get(family, ()) if family is not None else None)
+                for v, family in zip(self._own(TYPE_FIELDS), cols["product_family_code"])
+            ],
+            "voltage": [
+                _own_voltage(v) if v is not None else code
+                for v, code in zip(self._own(VOLTAGE_FIELDS), cols["voltage_code"])
+            ],
+            "density_mb": [
+                (parse_density_mb(v) or v) if v is not None else mb
+                for v, mb in zip(self._own(DENSITY_FIELDS), cols["density_mb"])
+            ],
+            "io": [_own_io(v) if v is not None else io for v, io in zip(self._own(IO_FIELDS), cols["io"])],
+            "temperature": [parse_temperature_range(product_field(p, *TEMPERATURE_FIELDS)) for p in self.products],
+            "frequency_mhz": [
+                parse_frequency_mhz(product_field(p, *FREQUENCY_FIELDS)) for p in self.products
+            ],
+        }
+        self.all_rows = (1 << len(self.products)) - 1
+        self.index = {}
+        for attr in INDEXED:
+            postings = {}
+            for i, value in enumerate(self.columns[attr]):
+                if value is None:
+                    continue
+                # type 欄可能對應多個 type_of_ddr 值
+                for v in (value if attr == "type" else (value,)):
+                    postings.setdefault(v, []).append(i)
+            self.index[attr] = {value: _bits(rows, len(self.products)) for value, rows in postings.items()}
+        self.unknown = {
+            attr: _bits([i for i, value in enumerate(self.columns[attr]) if value is None], len(self.products))
+            for attr in SELECTOR_ATTRS
+        }
+
+    @classmethod
+    def from_selector_result(cls, result):
+        return cls(iter_candidates(result))
+
+    def __len__(self):
+        return len(self.products)
+
+    def _own(self, names):
+        return [own_field(p, names) for p in self.products]
+
+    def unknown_rows(self):
+        """Number of rows with at least one unknown selector attribute."""
+        mask = 0
+        for bits in self.unknown.values():
+            mask |= bits
+        return bin(mask).count("1")
+
+    def _eq(self, attr, values):
+        postings = self.index[attr]
+        mask = 0
+        for value in values:
+            mask |= postings.get(value, 0)
+        return mask
+
+    def select(self, **filters):
+        """Bitmap of the rows matching every given predicate (see ``lookup``)."""
+        return self.lookup(**filters)[0]
+
+    def lookup(self, type_of_ddr=None, Operation_Voltage=None, Density=None, io=None,
+               min_frequency_mhz=None, temperature_range=None, **unknown):
+        """Bitmaps of the rows matching every given predicate, and of those that might.
+
+        The first four arguments take the same values as get_filtered_products;
+        ``temperature_range`` keeps the rows whose range fits (low, high)
+        (matcher.temperature_fits).
+        The second bitmap adds the rows whose selector attributes are unknown
+        and that match the rest; when it differs from the first, only the
+        selector can tell.
+        """
+        if unknown:
+            print(f"catalog: ignoring unknown filters {sorted(unknown)}")
+        mask = maybe = self.all_rows
+        for attr, value in (
+            ("type", type_of_ddr),
+            ("voltage", Operation_Voltage and _own_voltage(Operation_Voltage)),
+            ("density_mb", Density and (parse_density_mb(Density) or Density)),
+            ("io", io and _own_io(str(io))),
+        ):
+            if value:
+                match = self.index[attr].get(value, 0)
+                mask &= match
+                maybe &= match | self.unknown[attr]
+        if min_frequency_mhz is not None:
+            postings = self.index["frequency_mhz"]
+            match = self._eq("frequency_mhz", [f for f in postings if f >= min_frequency_mhz])
+            mask &= match
+            maybe &= match
+        if temperature_range is not None:
+            postings = self.index["temperature"]
+            match = self._eq("temperature", [t for t in postings if temperature_fits(t, temperature_range)])
+            mask &= match
+            maybe &= match
+        return mask, maybe
+
+    def rank(self, rows, target_frequency_mhz=None, target_temperature=None):
+        """Order rows so the closest fits come first.
+
+        Rows meeting the target frequency and temperature come before the
+        rest; among them, the smallest frequency overshoot and narrowest
+        temperature range (the cheapest part that still fits) come first.
+        """
+        freq = self.columns["frequency_mhz"]
+        temp = self.columns["temperature"]
+
+        def key(i):
+            f, t = freq[i], temp[i]
+            freq_ok = target_frequency_mhz is None or (f is not None and f >= target_frequency_mhz)
+            temp_ok = target_temperature is None or (t is not None and temperature_fits(t, target_temperature))
+            overshoot = (f - target_frequency_mhz) if (freq_ok and target_frequency_mhz and f) else 0
+            width = (t[1] - t[0]) if t else float("inf")
+            return (not (freq_ok and temp_ok), not freq_ok, not temp_ok, overshoot, width, i)
+
+        return sorted(rows, key=key)
+
+    def get_filtered_products(self, target_frequency_mhz=None, target_temperature=None, **filters):
+        """Drop-in for selector.get_filtered_products, with ranked products.
+
+        Returns None when rows with unknown attributes might match.
+        """
+        mask, maybe = self.lookup(**filters)
+        if mask != maybe:
+            return None
+        rows = self.rank(_iter_bits(mask), target_frequency_mhz, target_temperature)
+        return {
+            "total_matches": len(rows),
+            "products": [self.products[i] for i in rows],
+        }
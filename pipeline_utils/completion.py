@@ -0,0 +1,150 @@
+"""Detect, while an answer streams, that its required structure is complete.
+
+Each detector has the same interface as function_call.TagStream:
+``feed(delta)`` returns True once the structure has fully arrived, so the
+caller can close the stream instead of paying for whatever the model adds
+afterwards (explanations, notes, trailing whitespace in JSON mode).
+
+- ``JsonStream``: the first top-level JSON object/array. When the value is
+  inside a ```json fence, the closing fence is waited for as well, so the
+  markdown shown to the user stays balanced.
+- ``TableStream``: a markdown table followed by a final line matching a
+  pattern (e.g. "Best match product_id: ...").
+
+``TailStats`` keeps, per stage, how many tokens the model generated after the
+structure was complete on calls that were allowed to run to the end; that is
+what an early stop is estimated to save.
+"""
+import re
+
+FENCE = "```"
+
+
+class JsonStream:
+    """First complete top-level JSON value in a stream of text deltas.
+
+    The value starts at the first ``{`` or ``[`` inside a code fence or at the
+    start of a line (so brackets in prose before it are ignored).
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.in_fence = False
+        self.fenced = False
+        self.start = None
+        self.end = None
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.complete = False
+
+    def feed(self, delta):
+        if self.complete:
+            return True
+        self.text += delta
+        text = self.text
+        while self.pos < len(text):
+            i = self.pos
+            c = text[i]
+            if self.end is not None:
+                # 值已結束, 只等 code fence 關閉
+                j = text.find(FENCE, i)
+                if j < 0:
+                    self.pos = max(i, len(text) - len(FENCE) + 1)
+                    return False
+                self.complete = True
+                return True
+            if self.start is None:
+                if text.startswith(FENCE, i):
+                    self.in_fence = not self.in_fence
+                    self.pos = i + len(FENCE)
+                    continue
+                if text[i:i + 1] == "`" and len(text) - i < len(FENCE):
+                    # 可能是被切開的 ```, 等下一段
+                    return False
+                if c in "{[" and (self.in_fence or not text[text.rfind("\n", 0, i) + 1:i].strip()):
+                    self.start = i
+                    self.fenced = self.in_fence
+                    self.depth = 1
+                self.pos = i + 1
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c in "{[":
+                self.depth += 1
+            elif c in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = i + 1
+                    self.pos = i + 1
+                    if not self.fenced:
+                        self.complete = True
+                        return True
+                    continue
+            self.pos = i + 1
+        return False
+
+    @property
+    def value(self):
+        """Text of the JSON value once it is complete, else None."""
+        return self.text[self.start:self.end] if self.end is not None else None
+
+
+class TableStream:
+    """A markdown table, then a complete line matching ``final``.
+
+    Only whole lines are inspected, so a final line whose value is still
+    streaming (a product id split over several deltas) is not cut short.
+    """
+
+    def __init__(self, final):
+        self.final = re.compile(final) if isinstance(final, str) else final
+        self.buffer = ""
+        self.rows = 0
+        self.table_done = False
+        self.complete = False
+
+    def feed(self, delta):
+        if self.complete:
+            return True
+        self.buffer += delta
+        *lines, self.buffer = self.buffer.split("\n")
+        for line in lines:
+            stripped = line.strip()
+            if not self.table_done:
+                if stripped.startswith("|"):
+                    self.rows += 1
+                elif self.rows >= 2:
+                    # 表頭 + 分隔線之後的第一個非表格行
+                    self.table_done = True
+                else:
+                    self.rows = 0
+            if self.table_done and self.final.search(stripped):
+                self.complete = True
+                return True
+        return False
+
+
+class TailStats:
+    """Running mean of the tokens generated after the structure was complete, per stage."""
+
+    def __init__(self):
+        self.count = {}
+        self.total = {}
+
+    def add(self, stage, tokens):
+        self.count[stage] = self.count.get(stage, 0) + 1
+        self.total[stage] = self.total.get(stage, 0) + tokens
+
+    def mean(self, stage):
+        """None until at least one call of ``stage`` was measured."""
+        count = self.count.get(stage)
+        return self.total[stage] / count if count else None
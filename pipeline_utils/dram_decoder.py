@@ -0,0 +1,271 @@
+"""Rule-based decoder for our DRAM part numbers.
+
+Part numbers follow the DRAM naming pattern that is also spelled out in the
+decode prompt of pn.py:
+
+    <Category> <Product Family> <Operation Voltage> <Density> <I/O Pin Number> <Address>
+
+e.g. ``M15T4G16256A`` -> M / 15 (DDR3) / T (1.35V) / 4G / x16 / 256M, followed
+by a free-form suffix. Density, I/O width and address are written without
+separators, so every valid block is precomputed in BODY_TABLE and the split
+where ``density == address * io`` wins.
+
+decode_batch decodes a whole result set into columns and reports the ids that
+could not be decoded together with the reason.
+"""
+import re
+from dataclasses import dataclass
+from typing import NamedTuple
+
+CATEGORY = {"M": "DRAM"}
+
+PRODUCT_FAMILY = {
+    "12": "SDRAM",
+    "52": "LP SDRAM",
+    "13": "DDR SDRAM",
+    "53": "LPDDR SDRAM",
+    "14": "DDR2 SDRAM",
+    "54": "LPDDR2 SDRAM",
+    "15": "DDR3 SDRAM",
+    "55": "LPDDR3 SDRAM",
+    "16": "DDR4 SDRAM",
+    "56": "LPDDR4/4X SDRAM",
+}
+
+OPERATION_VOLTAGE = {
+    "L": "3.3V",
+    "S": "2.5V",
+    "F": "1.5V",
+    "T": "1.35V",
+    "U": "1.2V",
+    "D": "1.8V (VDD=1.8V, VDD2=VDDQ=1.2V)",
+    "Y": "1.8V (VDD=1.8V, VDD2=VDDQ=1.1V)",
+    "Z": "1.8V (VDD=1.8V, VDD2=1.1V, VDDQ=0.6V)",
+}
+
+# code -> density in Mb
+DENSITY = {
+    "8": 8, "16": 16, "32": 32, "64": 64, "128": 128, "256": 256, "512": 512,
+    "1G": 1024, "2G": 2048, "4G": 4096, "8G": 8192, "16G": 16384,
+}
+
+IO_PIN_NUMBER = {"8": 8, "16": 16, "32": 32}
+
+# code -> possible address depths in Mb; "512" is 512Kb on small parts and
+# 512Mb on large ones, the density check picks the right one
+ADDRESS = {
+    "512": (0.5, 512), "1": (1,), "2": (2,), "4": (4,), "8": (8,), "16": (16,),
+    "32": (32,), "64": (64,), "128": (128,), "256": (256,),
+}
+
+_HEAD = re.compile(r"^(M)(\d{2})([A-Z])(\d+(?:G\d+)?)(.*)$")
+
+
+def format_bits(mb):
+    """8 -> '8Mb', 4096 -> '4Gb', 0.5 -> '512Kb'"""
+    if mb < 1:
+        return f"{int(mb * 1024)}Kb"
+    if mb >= 1024:
+        return f"{int(mb // 1024)}Gb"
+    return f"{int(mb)}Mb"
+
+
+def _build_body_table():
+    """Precompute every <Density><I/O><Address> digit block.
+
+    Maps the block (e.g. "4G16256") to (density_mb, io, address_mb,
+    consistent). When a block can be split several ways the split satisfying
+    density == address * io wins.
+    """
+    table = {}
+    for d_code, density in DENSITY.items():
+        for io_code, io in IO_PIN_NUMBER.items():
+            for a_code, depths in ADDRESS.items():
+                block = d_code + io_code + a_code
+                for depth in depths:
+                    entry = (density, io, depth, density == depth * io)
+                    current = table.get(block)
+                    if current is None or (entry[3] and not current[3]):
+                        table[block] = entry
+    return table
+
+
+BODY_TABLE = _build_body_table()
+# 顯示用字串也預先算好, 批次解碼時不必重複格式化
+_BITS_LABEL = {mb: format_bits(mb) for mb in set(DENSITY.values()) | {d for ds in ADDRESS.values() for d in ds}}
+
+
+@dataclass
+class DecodedPartNumber:
+    part_number: str
+    product_family_code: str
+    voltage_code: str
+    density_mb: float
+    io: int
+    address_mb: float
+    suffix: str
+    consistent: bool
+    category: str = "M"
+
+    @property
+    def product_family(self):
+        return PRODUCT_FAMILY[self.product_family_code]
+
+    @property
+    def operation_voltage(self):
+        return OPERATION_VOLTAGE[self.voltage_code]
+
+    def as_dict(self):
+        return {
+            "part_number": self.part_number,
+            "category": self.category,
+            "product_family_code": self.product_family_code,
+            "product_family": self.product_family,
+            "operation_voltage_code": self.voltage_code,
+            "operation_voltage": self.operation_voltage,
+            "density": _BITS_LABEL[self.density_mb],
+            "io_pin_number": f"x{self.io}",
+            "address": _BITS_LABEL[self.address_mb],
+            "suffix": self.suffix,
+            "consistent": self.consistent,
+        }
+
+
+class DecodeFailure(NamedTuple):
+    index: int
+    part_number: str
+    reason: str
+
+
+def _decode_one(pn):
+    """Return (fields, None) or (None, reason) for an upper-cased part number."""
+    m = _HEAD.match(pn)
+    if not m:
+        return None, "does not match <M><family><voltage><density><io><address>"
+    _, family, voltage, block, suffix = m.groups()
+    if family not in PRODUCT_FAMILY:
+        return None, f"unknown product family '{family}'"
+    if voltage not in OPERATION_VOLTAGE:
+        return None, f"unknown operation voltage '{voltage}'"
+    entry = BODY_TABLE.get(block)
+    if entry is None:
+        return None, f"unknown density/io/address block '{block}'"
+    return (family, voltage) + entry + (suffix,), None
+
+
+class DecodeBatch:
+    """Column-oriented result of decode_batch.
+
+    Each column has one slot per input id; rows that failed hold None and are
+    listed in ``failures`` with the reason.
+    """
+
+    COLUMNS = ("product_family_code", "voltage_code", "density_mb", "io",
+               "address_mb", "consistent", "suffix")
+
+    def __init__(self, part_numbers):
+        self.part_numbers = part_numbers
+        self.ok = []
+        self.failures = []
+        self.columns = {name: [] for name in self.COLUMNS}
+
+    def __len__(self):
+        return len(self.part_numbers)
+
+    def record(self, i):
+        if not self.ok[i]:
+            return None
+        values = {name: self.columns[name][i] for name in self.COLUMNS}
+        return DecodedPartNumber(
+            part_number=self.part_numbers[i],
+            product_family_code=values["product_family_code"],
+            voltage_code=values["voltage_code"],
+            density_mb=values["density_mb"],
+            io=values["io"],
+            address_mb=values["address_mb"],
+            suffix=values["suffix"],
+            consistent=values["consistent"],
+        )
+
+    def records(self):
+        return [self.record(i) for i in range(len(self))]
+
+
+def decode_batch(part_numbers):
+    """Decode many part numbers in one pass.
+
+    Identical ids are decoded once; the work per id is a regex match and a
+    few dict lookups into the precomputed tables.
+    """
+    part_numbers = list(part_numbers)
+    batch = DecodeBatch(part_numbers)
+    columns = [batch.columns[name] for name in DecodeBatch.COLUMNS]
+    empty = (None,) * len(columns)
+    memo = {}
+    for i, raw in enumerate(part_numbers):
+        pn = (raw or "").strip().upper()
+        hit = memo.get(pn)
+        if hit is None:
+            hit = memo[pn] = _decode_one(pn)
+        fields, reason = hit
+        if fields is None:
+            batch.failures.append(DecodeFailure(i, raw, reason))
+            fields = empty
+        batch.ok.append(reason is None)
+        # _decode_one 回傳順序: family, voltage, density, io, address, consistent, suffix
+        for column, value in zip(columns, fields):
+            column.append(value)
+    return batch
+
+
+def decode_part_number(part_number):
+    """Decode one part number; returns a DecodedPartNumber or None.
+
+    ``consistent`` is False when no split satisfies density == address * io.
+    """
+    return decode_batch([part_number]).record(0)
+
+
+_ID_KEYS = ("product_id", "part_number", "Product_ID", "Part_Number", "product", "part")
+
+
+def candidate_id(product):
+    """The id of a candidate product dict (product_id, part_number, ...)."""
+    return next(product[k] for k in _ID_KEYS if isinstance(product.get(k), str))
+
+
+def iter_candidates(filtered_products):
+    """Yield the candidate product dicts found anywhere in a selector result.
+
+    Any dict carrying one of the id keys counts as a candidate; bare strings
+    that look like part numbers are wrapped as {"part_number": ...}.
+    """
+    stack = [filtered_products]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if any(isinstance(node.get(k), str) for k in _ID_KEYS):
+                yield node
+                continue
+            stack.extend(reversed(list(node.values())))
+        elif isinstance(node, (list, tuple)):
+            stack.extend(reversed(node))
+        elif isinstance(node, str) and _HEAD.match(node.strip().upper()):
+            yield {"part_number": node}
+
+
+def decode_candidates(filtered_products):
+    """Decode every candidate of a get_filtered_products result.
+
+    Returns (records, failures): each record keeps the original features and
+    adds a ``decoded`` dict (None when the id does not follow the naming
+    pattern); failures is a list of DecodeFailure.
+    """
+    products = list(iter_candidates(filtered_products))
+    ids = [candidate_id(p) for p in products]
+    batch = decode_batch(ids)
+    records = []
+    for i, product in enumerate(products):
+        decoded = batch.record(i)
+        records.append({**product, "decoded": decoded.as_dict() if decoded else None})
+    return records, batch.failures
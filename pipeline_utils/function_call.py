@@ -0,0 +1,194 @@
+"""Parsing and validation of the get_filtered_products call produced by the LLM.
+
+Two output formats are supported for the params stage:
+
+- "tags": chain of thought followed by a Python-style call between
+  <get_filtered_products> tags. ``TagStream`` watches the stream and reports
+  the moment the closing tag arrives so the generation can be cut off there;
+  ``parse_call_arguments`` reads the call with ``ast`` (falling back to a
+  tolerant regex), so unquoted values, escaped quotes and comments copied
+  from the prompt are handled.
+- "json": Ollama is asked for JSON constrained by ``PARAMS_SCHEMA``.
+
+Either way the arguments go through ``validate_params``, which only lets the
+allowed enum values reach get_filtered_products.
+"""
+import ast
+import json
+import re
+
+from .param_extractor import DDR_TYPES, DENSITIES, VOLTAGE_CODES, find_ddr_types, voltage_code
+from .units import parse_density_mb, parse_voltage
+
+FUNCTION_NAME = "get_filtered_products"
+
+PARAMS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "reasoning": {"type": "string"},
+        "type_of_ddr": {"type": "string", "enum": list(DDR_TYPES)},
+        "Operation_Voltage": {"type": "string", "enum": list(VOLTAGE_CODES)},
+        "Density": {"type": "string", "enum": list(DENSITIES)},
+    },
+    "required": ["reasoning"],
+    "additionalProperties": False,
+}
+
+# OpenAI-compatible structured output (Ollama >= 0.5)
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": FUNCTION_NAME, "schema": PARAMS_SCHEMA, "strict": True},
+}
+
+_ARG = re.compile(
+    r"""(\w+)\s*=\s*(?:"((?:\\.|[^"\\])*)"|'((?:\\.|[^'\\])*)'|([^,\s)#]+))"""
+)
+_ESCAPE = re.compile(r"\\(.)")
+_DENSITY_BY_MB = {parse_density_mb(d): d for d in DENSITIES}
+
+
+class TagStream:
+    """Find the first <tag>...</tag> block in a stream of text deltas.
+
+    ``feed`` returns True once the closing tag has arrived; ``block`` is then
+    the text between the tags. Tags split across deltas are handled.
+    """
+
+    def __init__(self, tag=FUNCTION_NAME):
+        self.open_tag = f"<{tag}>"
+        self.close_tag = f"</{tag}>"
+        self.text = ""
+        self.start = None
+        self.block = None
+
+    @property
+    def closed(self):
+        return self.block is not None
+
+    def feed(self, delta):
+        if self.closed:
+            return True
+        scan_from = max(0, len(self.text) - len(self.close_tag))
+        self.text += delta
+        if self.start is None:
+            i = self.text.find(self.open_tag, scan_from)
+            if i < 0:
+                return False
+            self.start = i + len(self.open_tag)
+            scan_from = self.start
+        j = self.text.find(self.close_tag, max(scan_from, self.start))
+        if j < 0:
+            return False
+        self.block = self.text[self.start:j]
+        return True
+
+
+def find_call_block(text, tag=FUNCTION_NAME):
+    """Text of the first complete <tag> block, or None."""
+    stream = TagStream(tag)
+    stream.feed(text or "")
+    return stream.block
+
+
+def _literal(node):
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        # type_of_ddr=SDRAM (未加引號)
+        return node.id
+    return ast.unparse(node)
+
+
+def parse_call_arguments(text, name=FUNCTION_NAME):
+    """Keyword arguments of ``name(...)`` in ``text`` as a dict of strings."""
+    text = (text or "").strip()
+    start = text.find(f"{name}(")
+    if start >= 0:
+        text = text[start:]
+    try:
+        tree = ast.parse(text, mode="exec")
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call):
+                return {kw.arg: str(_literal(kw.value)) for kw in node.keywords if kw.arg}
+    except SyntaxError:
+        pass
+    args = {}
+    for key, double, single, bare in _ARG.findall(text):
+        value = double or single or bare
+        args[key] = _ESCAPE.sub(r"\1", value) if (double or single) else value
+    return args
+
+
+def parse_json_arguments(text):
+    """Arguments from a (possibly fenced or chatty) JSON object."""
+    text = (text or "").strip()
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return {}
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {k: str(v) for k, v in data.items() if k != "reasoning" and v not in (None, "")}
+
+
+def _normalize_ddr_type(value):
+    if value in DDR_TYPES:
+        return value
+    for ddr_type in DDR_TYPES:
+        if value.lower() == ddr_type.lower():
+            return ddr_type
+    found = set(find_ddr_types(value))
+    return found.pop() if len(found) == 1 else None
+
+
+def _normalize_voltage(value, ddr_type):
+    code = value.strip().upper()
+    if code in VOLTAGE_CODES:
+        return code
+    volts = parse_voltage(value)
+    if volts is None:
+        return None
+    return voltage_code(ddr_type, [volts]) or None
+
+
+def _normalize_density(value):
+    value = value.strip()
+    if value in DENSITIES:
+        return value
+    mb = parse_density_mb(value) or parse_density_mb(value + "b")
+    return _DENSITY_BY_MB.get(mb)
+
+
+def validate_params(raw):
+    """Keep only allowed get_filtered_products arguments.
+
+    Values are normalized where the intent is unambiguous ("ddr3l" -> the
+    DDR3 enum, "1.35V" -> "T", "4 Gb" -> "4Gb"). Returns (params, rejected)
+    where rejected maps each dropped argument to its raw value.
+    """
+    params, rejected = {}, {}
+    for key, value in raw.items():
+        if key not in ("type_of_ddr", "Operation_Voltage", "Density"):
+            rejected[key] = value
+    if raw.get("type_of_ddr"):
+        ddr_type = _normalize_ddr_type(raw["type_of_ddr"])
+        if ddr_type:
+            params["type_of_ddr"] = ddr_type
+        else:
+            rejected["type_of_ddr"] = raw["type_of_ddr"]
+    if raw.get("Operation_Voltage"):
+        code = _normalize_voltage(raw["Operation_Voltage"], params.get("type_of_ddr"))
+        if code:
+            params["Operation_Voltage"] = code
+        else:
+            rejected["Operation_Voltage"] = raw["Operation_Voltage"]
+    if raw.get("Density"):
+        density = _normalize_density(raw["Density"])
+        if density:
+            params["Density"] = density
+        else:
+            rejected["Density"] = raw["Density"]
+    return params, rejected
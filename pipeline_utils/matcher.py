@@ -0,0 +1,297 @@
+"""Deterministic spec matching of candidate products against the target.
+
+Implements the rules from the match prompt in pn.py:
+
+- the candidate's max frequency must meet the target's (units are
+  normalized, so 1600 MHz == 1.6 GHz)
+- the candidate's temperature range must contain the target's and start at
+  the same lower bound (0-85°C accepts 0-95°C but not -40-95°C); the
+  catalog ranks and filters with the same rule (``temperature_fits``)
+- DDR type, operation voltage, density and I/O width must be equal
+
+Every field is scored PASS, FAIL or UNKNOWN. UNKNOWN means a value is
+missing on the candidate or the target is ambiguous; only those cases need
+the LLM.
+"""
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from .dram_decoder import OPERATION_VOLTAGE, PRODUCT_FAMILY, candidate_id, format_bits
+from .units import (
+    covers, find_frequencies_mhz, find_io_widths, find_temperature_ranges, format_frequency,
+    format_temperature, parse_density_mb, parse_frequency_mhz, parse_temperature_range,
+)
+
+# get_filtered_products(type_of_ddr=...) values -> product family codes
+DDR_TYPE_FAMILIES = {
+    "SDRAM": ("12",),
+    "DDR SDRAM": ("13",),
+    "DDR II SDRAM": ("14",),
+    "DDR3 SDRAM or DDR3(L) SDRAM": ("15",),
+    "DDR4 SDRAM": ("16",),
+    "PSRAM": (),
+    "Mobile SDRAM": ("52",),
+    "Mobile DDR SDRAM": ("53",),
+    "LPDDR SDRAM": ("53",),
+    "LPDDR2 SDRAM": ("54",),
+    "LPDDR3 SDRAM": ("55",),
+    "LPDDR4X SDRAM or LPDDR4/LPDDR4X SDRAM": ("56",),
+}
+
+# 產品欄位名稱中含有這些字即視為溫度 / 頻率欄位
+TEMPERATURE_FIELDS = ("temp",)
+FREQUENCY_FIELDS = ("freq", "speed", "clock")
+
+
+def product_field(product, *needles):
+    """Value of the first key whose name contains one of ``needles``."""
+    for key, value in product.items():
+        name = key.lower()
+        if isinstance(value, str) and any(n in name for n in needles):
+            return value
+    return None
+
+
+def temperature_fits(candidate, target):
+    """True when the ``candidate`` range covers ``target`` and starts at the same lower bound."""
+    # 例如目標 0~85°C 時, -40~95°C 屬於不同溫度等級, 不可選為最佳匹配
+    return covers(candidate, target) and candidate[0] == target[0]
+
+
+PASS, FAIL, UNKNOWN = "✅", "❌", "❔"
+
+FIELDS = ("ddr_type", "voltage", "density", "io", "temperature", "frequency")
+FIELD_LABELS = {
+    "ddr_type": "DDR type",
+    "voltage": "Operation voltage",
+    "density": "Density",
+    "io": "I/O",
+    "temperature": "Operating temperature",
+    "frequency": "Max frequency",
+}
+
+
+@dataclass
+class TargetSpec:
+    """The golden target, normalized. None = not specified."""
+    type_of_ddr: Optional[str] = None
+    voltage_code: Optional[str] = None
+    density_mb: Optional[float] = None
+    io: Optional[int] = None
+    temperature: Optional[Tuple[float, float]] = None
+    frequency_mhz: Optional[float] = None
+    # 目標規格中互相矛盾、需要 LLM 判斷的欄位
+    ambiguous: List[str] = field(default_factory=list)
+
+
+def target_from(filtered_params, summary):
+    """Build the target spec from the extracted selector params and summary.
+
+    DDR type, voltage and density come from the get_filtered_products
+    arguments. Frequency is the highest one the summary mentions (the part's
+    max frequency). Temperature and I/O are ambiguous when the summary lists
+    several different values.
+    """
+    target = TargetSpec(
+        type_of_ddr=filtered_params.get("type_of_ddr") or None,
+        voltage_code=filtered_params.get("Operation_Voltage") or None,
+        density_mb=parse_density_mb(filtered_params.get("Density") or ""),
+    )
+    frequencies = find_frequencies_mhz(summary)
+    if frequencies:
+        target.frequency_mhz = max(frequencies)
+    temperatures = list(dict.fromkeys(find_temperature_ranges(summary)))
+    if len(temperatures) == 1:
+        target.temperature = temperatures[0]
+    elif temperatures:
+        target.ambiguous.append("temperature")
+    widths = list(dict.fromkeys(find_io_widths(summary)))
+    if len(widths) == 1:
+        target.io = widths[0]
+    elif widths:
+        target.ambiguous.append("io")
+    return target
+
+
+@dataclass
+class CandidateScore:
+    product: dict
+    cells: dict
+    passed: int = 0
+    failed: int = 0
+    unknown: int = 0
+    # 排序用: 頻率超出量與溫度範圍寬度, 越小越接近目標
+    overshoot: float = 0.0
+    width: float = float("inf")
+
+    @property
+    def product_id(self):
+        return candidate_id(self.product)
+
+    @property
+    def full_match(self):
+        return self.failed == 0 and self.unknown == 0
+
+    def sort_key(self):
+        return (self.failed, self.unknown, self.overshoot, self.width)
+
+
+def _cell(status, reason):
+    return status, reason
+
+
+def score_candidate(record, target):
+    """Score one decode_candidates record against the target."""
+    decoded = record.get("decoded") or {}
+    cells = {}
+
+    family = decoded.get("product_family_code")
+    if target.type_of_ddr is None:
+        cells["ddr_type"] = _cell(PASS, "not specified")
+    elif family is None:
+        cells["ddr_type"] = _cell(UNKNOWN, "not decodable")
+    else:
+        ok = family in DDR_TYPE_FAMILIES.get(target.type_of_ddr, ())
+        cells["ddr_type"] = _cell(PASS if ok else FAIL, f"{PRODUCT_FAMILY[family]} vs {target.type_of_ddr}")
+
+    voltage = decoded.get("operation_voltage_code")
+    if target.voltage_code is None:
+        cells["voltage"] = _cell(PASS, "not specified")
+    elif voltage is None:
+        cells["voltage"] = _cell(UNKNOWN, "not decodable")
+    else:
+        cells["voltage"] = _cell(
+            PASS if voltage == target.voltage_code else FAIL,
+            f"{OPERATION_VOLTAGE[voltage]} vs {OPERATION_VOLTAGE.get(target.voltage_code, target.voltage_code)}",
+        )
+
+    density = parse_density_mb(decoded.get("density") or "")
+    if target.density_mb is None:
+        cells["density"] = _cell(PASS, "not specified")
+    elif density is None:
+        cells["density"] = _cell(UNKNOWN, "not decodable")
+    else:
+        cells["density"] = _cell(
+            PASS if density == target.density_mb else FAIL,
+            f"{decoded['density']} vs {format_bits(target.density_mb)}",
+        )
+
+    io = decoded.get("io_pin_number")
+    if "io" in target.ambiguous:
+        cells["io"] = _cell(UNKNOWN, "target lists several I/O widths")
+    elif target.io is None:
+        cells["io"] = _cell(PASS, "not specified")
+    elif io is None:
+        cells["io"] = _cell(UNKNOWN, "not decodable")
+    else:
+        cells["io"] = _cell(PASS if io == f"x{target.io}" else FAIL, f"{io} vs x{target.io}")
+
+    score = CandidateScore(record, cells)
+
+    temperature = parse_temperature_range(product_field(record, *TEMPERATURE_FIELDS))
+    if temperature is not None:
+        score.width = temperature[1] - temperature[0]
+    if "temperature" in target.ambiguous:
+        cells["temperature"] = _cell(UNKNOWN, "target lists several temperature ranges")
+    elif target.temperature is None:
+        cells["temperature"] = _cell(PASS, "not specified")
+    elif temperature is None:
+        cells["temperature"] = _cell(UNKNOWN, "not listed")
+    else:
+        if temperature_fits(temperature, target.temperature):
+            relation = "covers"
+        elif covers(temperature, target.temperature):
+            relation = "is a wider temperature grade than"
+        else:
+            relation = "does not cover"
+        cells["temperature"] = _cell(
+            PASS if relation == "covers" else FAIL,
+            f"{format_temperature(temperature)} {relation} {format_temperature(target.temperature)}",
+        )
+
+    frequency = parse_frequency_mhz(product_field(record, *FREQUENCY_FIELDS))
+    if target.frequency_mhz is None:
+        cells["frequency"] = _cell(PASS, "not specified")
+    elif frequency is None:
+        cells["frequency"] = _cell(UNKNOWN, "not listed")
+    else:
+        ok = frequency >= target.frequency_mhz
+        if ok:
+            score.overshoot = frequency - target.frequency_mhz
+        relation = ">=" if ok else "<"
+        cells["frequency"] = _cell(
+            PASS if ok else FAIL,
+            f"{format_frequency(frequency)} {relation} {format_frequency(target.frequency_mhz)}",
+        )
+
+    for status, _ in cells.values():
+        if status == PASS:
+            score.passed += 1
+        elif status == FAIL:
+            score.failed += 1
+        else:
+            score.unknown += 1
+    return score
+
+
+def score_candidates(records, target):
+    """Score and sort all records, best first."""
+    return sorted((score_candidate(r, target) for r in records), key=CandidateScore.sort_key)
+
+
+def needs_llm(scores, target):
+    """True when the deterministic result cannot name a best match on its own."""
+    if not scores:
+        return False
+    if target.ambiguous:
+        return True
+    best = scores[0]
+    return not best.full_match and best.unknown > 0
+
+
+def render_table(scores, max_rows=30):
+    """Markdown table with reason + ✅/❌ per feature, one row per candidate."""
+    header = ["Part number", "Product ID"] + [FIELD_LABELS[f] for f in FIELDS] + ["Score"]
+    lines = [
+        "| " + " | ".join(header) + " |",
+        "|" + "---|" * len(header),
+    ]
+    for score in scores[:max_rows]:
+        cells = [f"{reason} {status}" for status, reason in (score.cells[f] for f in FIELDS)]
+        lines.append(
+            "| " + " | ".join(
+                [score.product.get("part_number", ""), score.product_id] + cells
+                + [f"{score.passed}/{len(FIELDS)}"]
+            ) + " |"
+        )
+    if len(scores) > max_rows:
+        lines.append(f"\n_{len(scores) - max_rows} more candidate(s) not shown._")
+    return "\n".join(lines)
+
+
+def render_best_match(scores, target):
+    if not scores:
+        return "No candidate products to match."
+    best = scores[0]
+    if not best.full_match:
+        return (
+            f"No candidate meets every feature of the golden target. "
+            f"The closest is **{best.product_id}** ({best.passed}/{len(FIELDS)} features match)."
+        )
+    reasons = [
+        f"{FIELD_LABELS[f]}: {best.cells[f][1]}"
+        for f in FIELDS if best.cells[f][1] != "not specified"
+    ]
+    others = sum(1 for s in scores[1:] if s.full_match)
+    text = (
+        f"**Best match:** part number **{best.product.get('part_number', best.product_id)}**, "
+        f"product ID **{best.product_id}**.\n\n"
+        + "".join(f"- {r}\n" for r in reasons)
+    )
+    if others:
+        text += (
+            f"\n{others} other candidate(s) also meet every feature; this one is preferred "
+            "because it has the smallest frequency overshoot and the narrowest temperature "
+            "range."
+        )
+    return text
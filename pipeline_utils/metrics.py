@@ -0,0 +1,232 @@
+"""Per-request traces and process-wide Prometheus-style metrics.
+
+A ``Trace`` collects one span per measured step of a request (search query,
+LLM stage, candidate query, cache lookup). Each span can be logged as a JSON
+line as soon as it is recorded; when the request ends ``Trace.finish`` feeds
+the spans into a ``MetricsRegistry``, which renders the Prometheus text
+exposition format for ``MetricsServer`` (``GET /metrics``) or a textfile
+collector (``write_textfile``).
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 秒; 涵蓋 sqlite 快取命中 (ms) 到 32B 模型的長串流 (分鐘)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + "}"
+
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and histograms keyed by (name, labels)."""
+
+    def __init__(self, namespace="pn", buckets=DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def _name(self, name):
+        return f"{self.namespace}_{name}" if self.namespace else name
+
+    def inc(self, name, value=1.0, **labels):
+        key = (self._name(name), tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def set(self, name, value, **labels):
+        key = (self._name(name), tuple(sorted(labels.items())))
+        with self._lock:
+            self.gauges[key] = float(value)
+
+    def observe(self, name, value, **labels):
+        key = (self._name(name), tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = hist[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self.histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_labels(dict(labels))} {value:g}")
+        for (name, labels), value in gauges:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{_labels(dict(labels))} {value:g}")
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            labels = dict(labels)
+            for bound, n in zip(self.buckets, counts):
+                lines.append(f"{name}_bucket{_labels({**labels, 'le': f'{bound:g}'})} {n}")
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path, extra=()):
+        """Write the metrics (and those of the ``extra`` registries) atomically, for node_exporter's textfile collector."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("".join(registry.render() for registry in (self, *extra)))
+        os.replace(tmp, path)
+
+
+class MetricsServer:
+    """Serve ``registry.render()`` (followed by the ``extra`` registries) on ``GET /metrics`` from a daemon thread."""
+
+    def __init__(self, registry, port, host="0.0.0.0", extra=()):
+        self.registry = registry
+        self.extra = tuple(extra)
+        self.port = port
+        self.host = host
+        self.httpd = None
+
+    def start(self):
+        registries = (self.registry, *self.extra)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                payload = "".join(registry.render() for registry in registries).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="metrics-server", daemon=True).start()
+        print(f"metrics: serving http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+
+class Trace:
+    """Spans of one request.
+
+    ``record(kind, name, seconds, **fields)`` adds a span; with ``json_log``
+    every span is printed as one JSON line tagged with the request id.
+    """
+
+    def __init__(self, json_log=False, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex[:12]
+        self.json_log = json_log
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def record(self, kind, name, seconds=None, **fields):
+        span = {"kind": kind, "name": name, "at": round(time.perf_counter() - self.start, 4)}
+        if seconds is not None:
+            span["seconds"] = round(seconds, 4)
+        span.update({k: v for k, v in fields.items() if v is not None})
+        self.spans.append(span)
+        if self.json_log:
+            print(json.dumps({"trace": self.request_id, **span}, ensure_ascii=False, default=str))
+        return span
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def finish(self, registry=None, mode="single", outcome="ok"):
+        """Close the trace and feed its spans into ``registry``."""
+        total = self.elapsed()
+        # 結構完整即關閉串流所省下的生成量 (估計值, 見 Pipeline.stream_completion)
+        saved = [span for span in self.spans if span["kind"] == "llm" and span.get("saved_tokens")]
+        self.record(
+            "request", mode, total, outcome=outcome,
+            saved_tokens=sum(span["saved_tokens"] for span in saved) or None,
+            saved_gpu_s=round(sum(span.get("saved_gpu_s") or 0 for span in saved), 3) or None,
+        )
+        if registry is None:
+            return
+        registry.observe("request_seconds", total, mode=mode)
+        registry.inc("requests_total", mode=mode, outcome=outcome)
+        for span in self.spans:
+            kind, name, seconds = span["kind"], span["name"], span.get("seconds")
+            if kind == "search":
+                registry.observe("search_query_seconds", seconds, outcome=span.get("outcome", ""))
+                if span.get("retries"):
+                    registry.inc("search_retries_total", span["retries"])
+            elif kind == "llm":
+                registry.observe("llm_stage_seconds", seconds, stage=name)
+                if span.get("ttft") is not None:
+                    registry.observe("llm_ttft_seconds", span["ttft"], stage=name)
+                if span.get("prefill_s") is not None:
+                    registry.observe("llm_prefill_seconds", span["prefill_s"], stage=name)
+                for token_kind in ("prompt", "completion"):
+                    if span.get(f"{token_kind}_tokens"):
+                        registry.inc("llm_tokens_total", span[f"{token_kind}_tokens"], stage=name, type=token_kind)
+                if span.get("stopped_early"):
+                    registry.inc("llm_stopped_early_total", stage=name)
+                if span.get("capped"):
+                    registry.inc("llm_capped_total", stage=name)
+                if span.get("saved_tokens"):
+                    registry.inc("llm_saved_tokens_total", span["saved_tokens"], stage=name)
+                if span.get("saved_gpu_s"):
+                    registry.inc("llm_saved_gpu_seconds_total", span["saved_gpu_s"], stage=name)
+            elif kind == "filter":
+                registry.observe("filter_products_seconds", seconds, source=span.get("source", ""))
+            elif kind == "index":
+                registry.observe("part_index_lookup_seconds", seconds)
+                registry.inc("part_index_lookups_total", result=span.get("result", ""))
+            elif kind == "extract":
+                registry.observe("snippet_specs_seconds", seconds)
+                registry.inc("snippet_specs_total", result=span.get("result", ""))
+            elif kind == "coalesce":
+                registry.inc("single_flight_requests_total", result="joined" if span.get("joined") else "leader")
+            elif kind == "cache":
+                registry.inc("cache_requests_total", cache=name, result="hit" if span.get("hit") else "miss")
+
+    def summary(self):
+        """Markdown table of the spans, to append to the response."""
+        rows = ["| step | name | seconds | details |", "|---|---|---|---|"]
+        for span in self.spans:
+            details = ", ".join(f"{k}={v}" for k, v in span.items() if k not in ("kind", "name", "seconds", "at"))
+            seconds = f"{span['seconds']:.2f}" if "seconds" in span else ""
+            rows.append(f"| {span['kind']} | {span['name']} | {seconds} | {details} |")
+        return "\n".join(rows)
@@ -0,0 +1,54 @@
+"""Pooled HTTP client for Ollama's OpenAI-compatible chat completions API."""
+import requests
+from requests.adapters import HTTPAdapter
+
+# 連線失敗, 逾時或串流中斷: 可以換一台後端重試
+STREAM_ERRORS = (requests.RequestException, OSError)
+
+
+class OllamaClient:
+    """Keep-alive connection pool shared by every stage of a pipeline.
+
+    Create one per pipeline in ``on_startup`` and ``close()`` it in
+    ``on_shutdown``. ``pool_size`` is the number of keep-alive connections kept
+    per Ollama host; timeouts are ``(connect, read)`` seconds, where the read
+    timeout is the longest allowed gap between two streamed chunks.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=5.0, read_timeout=300.0):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def stream_chat(self, base_url, payload, headers=None):
+        """POST a streaming chat completion and yield the non-empty SSE lines.
+
+        The response is closed (and its connection returned to the pool or
+        dropped) when the stream ends, fails, or the consumer stops iterating.
+        """
+        r = self.session.post(
+            url=f"{base_url}/v1/chat/completions",
+            json=payload,
+            headers=headers,
+            stream=True,
+            timeout=self.timeout,
+        )
+        try:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if line:
+                    yield line
+        finally:
+            r.close()
+
+    def list_models(self, base_url, headers=None, timeout=5.0):
+        """Model ids served by ``base_url`` (used as the health check)."""
+        r = self.session.get(f"{base_url}/v1/models", headers=headers, timeout=timeout)
+        r.raise_for_status()
+        return [m.get("id") for m in r.json().get("data", [])]
+
+    def close(self):
+        self.session.close()
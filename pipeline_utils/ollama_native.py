@@ -0,0 +1,88 @@
+"""Translation between the OpenAI chat format and Ollama's native /api/chat.
+
+The OpenAI-compatible endpoint of Ollama ignores ``keep_alive`` and
+``options`` (num_ctx, num_predict, ...), and does not report how long the
+prompt took to evaluate. The pipelines build OpenAI-style payloads and
+consume OpenAI-style SSE lines; ``native_request`` turns such a payload into
+an /api/chat request and ``sse_lines`` turns each NDJSON line of the answer
+back into SSE lines, so nothing downstream has to know which API was used.
+"""
+import json
+
+# OpenAI 參數 -> Ollama options
+_OPTION_NAMES = {
+    "max_tokens": "num_predict",
+    "stop": "stop",
+    "temperature": "temperature",
+    "top_p": "top_p",
+    "seed": "seed",
+    "frequency_penalty": "frequency_penalty",
+    "presence_penalty": "presence_penalty",
+}
+
+
+def native_request(payload):
+    """/api/chat request for an OpenAI-style chat completions payload."""
+    options = dict(payload.get("options") or {})
+    for name, option in _OPTION_NAMES.items():
+        if payload.get(name) is not None:
+            options[option] = payload[name]
+    if isinstance(options.get("stop"), str):
+        options["stop"] = [options["stop"]]
+    request = {
+        "model": payload["model"],
+        "messages": payload["messages"],
+        "stream": payload.get("stream", True),
+    }
+    if options:
+        request["options"] = options
+    if payload.get("keep_alive") is not None:
+        request["keep_alive"] = payload["keep_alive"]
+    response_format = payload.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        request["format"] = response_format["json_schema"]["schema"]
+    elif response_format.get("type") == "json_object":
+        request["format"] = "json"
+    return request
+
+
+def _sse(data):
+    return b"data: " + json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+def sse_lines(line):
+    """SSE lines (bytes, without the blank separator) for one NDJSON line from /api/chat.
+
+    The final line becomes a chunk with the finish reason and a usage block
+    (prompt/completion tokens plus Ollama's prompt and generation times in
+    seconds), followed by ``data: [DONE]``.
+    """
+    data = json.loads(line)
+    if "error" in data:
+        return [_sse({"error": {"message": data["error"]}})]
+    content = (data.get("message") or {}).get("content") or ""
+    model = data.get("model")
+    lines = []
+    if content:
+        lines.append(_sse({
+            "object": "chat.completion.chunk", "model": model,
+            "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+        }))
+    if data.get("done"):
+        prompt_tokens = data.get("prompt_eval_count") or 0
+        completion_tokens = data.get("eval_count") or 0
+        lines.append(_sse({
+            "object": "chat.completion.chunk", "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": data.get("done_reason") or "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                # Ollama 回報的時間為奈秒; prompt_eval 為 prefill (不含已在 KV cache 中的前綴)
+                "prompt_eval_seconds": round((data.get("prompt_eval_duration") or 0) / 1e9, 4),
+                "eval_seconds": round((data.get("eval_duration") or 0) / 1e9, 4),
+                "load_seconds": round((data.get("load_duration") or 0) / 1e9, 4),
+            },
+        }))
+        lines.append(b"data: [DONE]")
+    return lines
@@ -0,0 +1,220 @@
+"""Coalescing of the text the pipelines stream to the client.
+
+The pipelines server wraps every str a pipeline yields into its own
+``chat.completion.chunk`` event (and passes raw ``data:`` lines through), so
+forwarding Ollama's stream token by token costs one JSON envelope, one
+write and one browser re-render per token. A ``Coalescer`` collects the
+content deltas and releases them as one chunk once ``window`` seconds have
+passed since the first pending delta or ``max_bytes`` are pending (0 = no
+size limit); the first chunk of a response goes out at once.
+
+A chunk never ends where the markdown rendered so far would change meaning
+with the next chunk (see ``scan``):
+
+- a line that is (or may become) a code fence, a table's header or
+  delimiter row, only at the end of the line;
+- a table body row, after a complete cell;
+- inside a fenced code block, at a space;
+- elsewhere, at a space after the line's block marker ("#", "-", "1.", ">")
+  and outside code spans, ``**`` strong emphasis, link text/targets and
+  HTML tags.
+
+What cannot be cut safely stays pending until it can, or until
+``max_hold`` bytes are pending (a single very long line). ``flush(force=True)``
+and ``close`` release everything.
+"""
+import re
+import time
+from typing import NamedTuple, Optional
+
+# 行首可能是 code fence 的開頭 (``` 或 ~~~, 最多三個空白縮排)
+_FENCE = re.compile(r" {0,3}(`+|~+)")
+# 表格分隔列 (|---|:---:|)
+_TABLE_DELIMITER = re.compile(r" {0,3}\|?(?: *:?-+:? *\|)+ *(?::?-+:? *)?$")
+# 清單、標題、引用等區塊標記; 只有標記而沒有內容時不切
+_BLOCK_PREFIX = re.compile(r"[ \t]*(?:(?:#{1,6}|[>*+-]|\d{1,9}[.)])[ \t]+)*")
+# 行內需要成對的標記與可切開的空白
+_INLINE = re.compile(r"\\.|`|\*\*|[\[\]()<> ]")
+
+
+class BlockState(NamedTuple):
+    """Markdown context at the start of a line."""
+
+    fence: Optional[str] = None
+    # 上一行是表格的分隔列或內容列
+    table: bool = False
+
+
+def _state_after(line, state):
+    """BlockState after the complete ``line``."""
+    m = _FENCE.match(line)
+    if m is not None and len(m.group(1)) >= 3:
+        marker = m.group(1)
+        if state.fence is None:
+            return BlockState(marker)
+        # 結束 fence: 同一種字元, 長度不少於開頭, 後面只有空白
+        if marker[0] == state.fence[0] and len(marker) >= len(state.fence) and not line[m.end():].strip():
+            return BlockState()
+        return state
+    if state.fence is not None:
+        return state
+    if _TABLE_DELIMITER.match(line):
+        return BlockState(table=True)
+    return BlockState(table=state.table and line.lstrip(" ").startswith("|"))
+
+
+def _inline_safe(line, state):
+    """Longest prefix of an incomplete line that can be flushed; 0 if none."""
+    m = _FENCE.match(line)
+    if m is not None and (len(m.group(1)) >= 3 or m.end() == len(line)):
+        return 0
+    if state.fence is not None:
+        return line.rfind(" ") + 1
+    if line.lstrip(" ").startswith("|"):
+        # 表格內容列可在完整的儲存格之後切開; 標題列與分隔列要整行
+        return line.rfind("|") + 1 if state.table and line.count("|") > 1 else 0
+    lead = _BLOCK_PREFIX.match(line).end()
+    safe = 0
+    code = strong = target = tag = False
+    brackets = 0
+    for m in _INLINE.finditer(line, lead):
+        c = m.group()
+        if code:
+            code = c != "`"
+        elif c == "`":
+            code = True
+        elif c == "**":
+            strong = not strong
+        elif c == "[":
+            brackets += 1
+        elif c == "]" and brackets:
+            brackets -= 1
+            target = line.startswith("(", m.end())
+        elif c == ")" and target:
+            target = False
+        elif c == "<":
+            tag = True
+        elif c == ">":
+            tag = False
+        elif c == " " and m.start() > lead and not (strong or brackets or target or tag):
+            safe = m.end()
+    return safe
+
+
+def scan(text, state=BlockState()):
+    """Where ``text`` can be cut without breaking a markdown block.
+
+    ``state`` is the BlockState at the start of ``text``, which must begin
+    at the start of a line. Returns ``(safe, state, line_start)``: the
+    longest prefix that can be flushed, the state after the last complete
+    line, and where the incomplete last line starts.
+    """
+    line_start = 0
+    while True:
+        end = text.find("\n", line_start)
+        if end < 0:
+            break
+        state = _state_after(text[line_start:end], state)
+        line_start = end + 1
+    safe = line_start
+    if line_start < len(text):
+        safe += _inline_safe(text[line_start:], state)
+    return safe, state, line_start
+
+
+class Coalescer:
+    """Collects content deltas and releases them in chunks at markdown-safe points.
+
+    ``feed`` returns the text to send now ("" while it is held back);
+    callers driven by a timer (see streaming.stream_task) call ``flush`` when
+    ``due()`` reaches 0.
+    """
+
+    def __init__(self, window=0.03, max_bytes=256, max_hold=4096, clock=time.monotonic):
+        self.window = window
+        self.max_bytes = max_bytes
+        self.max_hold = max_hold
+        self.clock = clock
+        self.parts = []
+        self.size = 0
+        self.since = None
+        # 已送出、但尚未換行的部分 (判斷切點時需要整行) 與其所在行開頭時的狀態
+        self.line = ""
+        self.state = BlockState()
+        self.chunks = 0
+
+    @property
+    def pending(self):
+        return bool(self.parts)
+
+    def due(self):
+        """Seconds until the pending text should be flushed (None when nothing is pending)."""
+        if not self.parts:
+            return None
+        return max(0.0, self.since + self.window - self.clock())
+
+    def feed(self, text, force=False):
+        if text:
+            if not self.parts:
+                self.since = self.clock()
+            self.parts.append(text)
+            self.size += len(text.encode("utf-8"))
+        # 回應的第一個片段立即送出 (time to first byte)
+        if force or not self.chunks or (self.max_bytes and self.size >= self.max_bytes) or (
+            self.parts and self.clock() - self.since >= self.window
+        ):
+            return self.flush(force)
+        return ""
+
+    def flush(self, force=False):
+        """Release the pending text up to the last safe cut (all of it with ``force``)."""
+        if not self.parts:
+            return ""
+        pending = "".join(self.parts)
+        text = self.line + pending
+        safe, state, line_start = scan(text, self.state)
+        if force or self.size >= self.max_hold:
+            safe = len(text)
+        cut = safe - len(self.line)
+        if cut <= 0:
+            # 沒有安全的切點: 等下一個窗口
+            self.since = self.clock()
+            return ""
+        self.line = text[line_start:safe]
+        self.state = state
+        chunk, rest = pending[:cut], pending[cut:]
+        self.parts = [rest] if rest else []
+        self.size = len(rest.encode("utf-8"))
+        self.since = self.clock() if rest else None
+        self.chunks += 1
+        return chunk
+
+    def close(self):
+        """Everything still pending."""
+        return self.flush(force=True)
+
+
+def output_chunks(items, raw=False, coalescer=None):
+    """Chunks for the pipelines server from a synchronous stream of messages (str) and SSE events.
+
+    With ``raw`` the events go out as their SSE lines; otherwise only their
+    content, coalesced by ``coalescer`` when given. Messages are complete
+    blocks and go out at once (with what is pending). Without a timer the
+    window is checked when the next event arrives.
+    """
+    try:
+        for item in items:
+            if isinstance(item, str):
+                chunk = coalescer.feed(item, force=True) if coalescer is not None else item
+            elif raw:
+                chunk = item.raw
+            else:
+                chunk = coalescer.feed(item.content) if coalescer is not None else item.content
+            if chunk:
+                yield chunk
+        chunk = coalescer.close() if coalescer is not None else ""
+        if chunk:
+            yield chunk
+    finally:
+        # 用戶端中斷時立即關閉上游 (釋放排程名額與連線)
+        items.close()
@@ -0,0 +1,189 @@
+"""Incremental extraction of the get_filtered_products arguments from a summary.
+
+The summary stage streams a description of the competitor part; its DDR type,
+supply voltage and density usually show up in the first sentences.
+``ParamExtractor`` is fed the streamed text as it arrives, scans each completed
+sentence once, and reports as soon as the arguments are known with
+confidence, i.e. every mention seen so far agrees. When something is missing
+or contradictory it never guesses: the caller falls back to the LLM.
+"""
+import asyncio
+import re
+
+from .dram_decoder import OPERATION_VOLTAGE
+from .matcher import DDR_TYPE_FAMILIES
+from .units import find_densities_mb, find_voltages
+
+# Allowed values of the get_filtered_products arguments (see the params prompt in pn.py)
+DDR_TYPES = tuple(DDR_TYPE_FAMILIES)
+VOLTAGE_CODES = tuple(OPERATION_VOLTAGE)
+DENSITIES = ("8Mb", "16Mb", "32Mb", "64Mb", "128Mb", "256Mb", "512Mb", "1Gb", "2Gb", "4Gb", "8Gb", "16Gb")
+
+# (pattern, type_of_ddr) 由具體到一般; 每段文字只取第一個符合的型別, 避免 "LPDDR4" 同時被算成 "DDR4"
+DDR_TYPE_PATTERNS = [
+    (re.compile(r"\bLP\s?DDR\s?4X?\b", re.I), "LPDDR4X SDRAM or LPDDR4/LPDDR4X SDRAM"),
+    (re.compile(r"\bLP\s?DDR\s?3\b", re.I), "LPDDR3 SDRAM"),
+    (re.compile(r"\bLP\s?DDR\s?2\b", re.I), "LPDDR2 SDRAM"),
+    (re.compile(r"\b(?:LP\s?DDR|Mobile\s+DDR)(?![\w])", re.I), "LPDDR SDRAM"),
+    (re.compile(r"\bMobile\s+SDRAM\b", re.I), "Mobile SDRAM"),
+    (re.compile(r"(?<!LP)(?<!LP )\bDDR\s?4\b", re.I), "DDR4 SDRAM"),
+    (re.compile(r"(?<!LP)(?<!LP )\bDDR\s?3L?\b", re.I), "DDR3 SDRAM or DDR3(L) SDRAM"),
+    (re.compile(r"(?<!LP)(?<!LP )\bDDR\s?(?:2|II)\b", re.I), "DDR II SDRAM"),
+    (re.compile(r"(?<!LP)(?<!LP )\bDDR(?:\s?1)?\s+SDRAM\b", re.I), "DDR SDRAM"),
+    (re.compile(r"\bPSRAM\b", re.I), "PSRAM"),
+    (re.compile(r"\bSDR\s+SDRAM\b", re.I), "SDRAM"),
+]
+_LP_TYPES = {"LPDDR SDRAM", "LPDDR2 SDRAM", "LPDDR3 SDRAM", "LPDDR4X SDRAM or LPDDR4/LPDDR4X SDRAM"}
+_SINGLE_SUPPLY = {3.3: "L", 2.5: "S", 1.5: "F", 1.35: "T", 1.2: "U", 1.8: "D"}
+DENSITY_NAMES = {(1024 * int(d[:-2]) if d.endswith("Gb") else int(d[:-2])): d for d in DENSITIES}
+# 速度等級 (DDR3-1866) 不算型別描述
+_DDR3 = re.compile(r"(?<!LP)(?<!LP )\bDDR\s?3(L?)\b(?!-\d)", re.I)
+# 句子結尾: 換行或句點後接空白 (小數點後接數字, 不算)
+_BOUNDARY = re.compile(r"\n|\.\s")
+
+
+def find_ddr_types(text):
+    types = []
+    for pattern, name in DDR_TYPE_PATTERNS:
+        for m in pattern.finditer(text):
+            types.append((m.start(), name))
+            text = text[:m.start()] + " " * (m.end() - m.start()) + text[m.end():]
+    return [name for _, name in sorted(types)]
+
+
+def voltage_code(ddr_type, voltages, low_voltage_only=False):
+    """Map the supply voltages mentioned for a part to an Operation_Voltage code.
+
+    ``low_voltage_only`` is set when the text calls the part DDR3L and never
+    plain DDR3, so "1.35V, compatible with 1.5V" means 1.35V. Returns None when
+    nothing usable was mentioned and ``False`` when the mentions cannot be
+    reduced to one code.
+    """
+    volts = {round(v, 2) for v in voltages}
+    if ddr_type in _LP_TYPES:
+        # LPDDR2 以後: VDD1=1.8V, 依 VDD2/VDDQ 區分
+        if 1.8 not in volts:
+            return None
+        if 0.6 in volts:
+            return "Z"
+        if 1.1 in volts:
+            return "Y"
+        if 1.2 in volts:
+            return "D"
+        return False
+    codes = {_SINGLE_SUPPLY[v] for v in volts if v in _SINGLE_SUPPLY}
+    if low_voltage_only and codes == {"T", "F"}:
+        # DDR3L 為 1.35V, 並相容 1.5V
+        return "T"
+    if not codes:
+        return None
+    return codes.pop() if len(codes) == 1 else False
+
+
+class ParamExtractor:
+    """Watch a streamed summary and pull out type_of_ddr / Operation_Voltage / Density.
+
+    ``feed`` takes text deltas and returns True the first time the arguments
+    become confident; ``finish`` scans the remaining text once the stream has
+    ended. ``params()`` is the argument dict, or None while not confident.
+    Operation_Voltage is left out (as the params prompt asks) when the
+    finished summary never mentions a supply voltage.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.pending = ""
+        self.ddr_types = set()
+        self.voltages = []
+        self.densities = set()
+        self.ddr3_variants = set()
+        self.confident_at = None
+        self.chars = 0
+
+    def text(self):
+        return "".join(self.parts) + self.pending
+
+    def _scan(self, sentence):
+        self.ddr_types.update(find_ddr_types(sentence))
+        self.ddr3_variants.update(m.upper() for m in _DDR3.findall(sentence))
+        self.voltages.extend(find_voltages(sentence))
+        self.densities.update(d for d in find_densities_mb(sentence) if d in DENSITY_NAMES)
+        self.parts.append(sentence)
+
+    def feed(self, delta):
+        if not delta:
+            return False
+        self.chars += len(delta)
+        self.pending += delta
+        last = None
+        for last in _BOUNDARY.finditer(self.pending):
+            pass
+        if last is None:
+            return False
+        self._scan(self.pending[:last.end()])
+        self.pending = self.pending[last.end():]
+        # 串流途中三個參數都要出現才算確定; 電壓可能在後面的句子才提到
+        if self.confident_at is None and self.params(require_voltage=True) is not None:
+            self.confident_at = self.chars
+            return True
+        return False
+
+    def finish(self, text=None):
+        """Scan what is left; ``text`` replaces everything fed so far (e.g. a cached summary)."""
+        if text is not None and text != self.text():
+            self.__init__()
+            self.chars = len(text)
+            self.pending = text
+        if self.pending:
+            self._scan(self.pending)
+            self.pending = ""
+        if self.confident_at is None and self.params() is not None:
+            self.confident_at = self.chars
+        return self.params()
+
+    def params(self, require_voltage=False):
+        if len(self.ddr_types) != 1 or len(self.densities) != 1:
+            return None
+        ddr_type = next(iter(self.ddr_types))
+        code = voltage_code(ddr_type, self.voltages, self.ddr3_variants == {"L"})
+        if code is False or (require_voltage and not code):
+            return None
+        params = {"type_of_ddr": ddr_type, "Density": DENSITY_NAMES[next(iter(self.densities))]}
+        if code:
+            params["Operation_Voltage"] = code
+        return params
+
+
+class SpeculativePrefetch:
+    """Start the candidate query as soon as the extractor is confident.
+
+    ``fetch(params, text)`` is a coroutine function (e.g. Pipeline.filter_products).
+    Pass ``on_content`` as the content callback of the summary stream; later,
+    ``take(params)`` returns the prefetched task if it was started with the same
+    arguments (and cancels it otherwise).
+    """
+
+    def __init__(self, extractor, fetch):
+        self.extractor = extractor
+        self.fetch = fetch
+        self.params = None
+        self.task = None
+
+    def on_content(self, delta):
+        if self.extractor.feed(delta) and self.task is None:
+            self.params = self.extractor.params()
+            self.task = asyncio.ensure_future(self.fetch(self.params, self.extractor.text()))
+
+    def take(self, params):
+        task, self.task = self.task, None
+        if task is None:
+            return None
+        if params == self.params:
+            return task
+        task.cancel()
+        return None
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
@@ -0,0 +1,225 @@
+"""Index of resolved part numbers for reusing work across suffix variants.
+
+Competitor part numbers come with ordering suffixes that do not change what
+the part is: speed grade (``-107``, ``-6A``), temperature grade (``IT``,
+``AAT``), packaging (``TR``, ``:P`` die revision). Letters after the speed
+digits (``-6I``, ``-7TLI``) often carry the temperature grade, so they count
+as part of the temperature grade too: ``-6I`` and ``-6`` differ in both.
+``split_part_number`` takes the suffixes off the end and leaves the ``core``; ``PartIndex`` keeps a prefix
+trie over the cores of every part number the pipeline resolved, with what
+was found for it (search results per aspect, summary, selector arguments).
+
+``PartIndex.lookup`` returns the nearest known ``Variant`` of a new part
+number: one with the same core (preferring the fewest differing suffixes),
+or else the longest known core that is a prefix of the new one followed by
+something shaped like a suffix (``MT41K256M16TW107`` without the dash). The
+variant tells which parts of the earlier work still apply: the selector
+arguments (DDR type, voltage, density) always do, search results unless the
+suffix that changed affects that aspect, the summary only when nothing but
+packaging differs.
+
+The trie follows the same limits as its store: records older than ``ttl``
+seconds are dropped on lookup, and past ``max_entries`` the oldest records
+are evicted (both default to the store's settings).
+
+The suffix patterns are heuristics for the common DRAM vendors; a part
+number whose suffix is not recognized simply has a longer core and only
+matches itself.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from .part_number import normalize_part_number
+
+# 結尾的後綴, 由外而內反覆剝除; 需要分隔符號 (空白, -, /, #) 以免吃掉料號本體
+_PACKAGING = re.compile(r"(?:[\s\-/#]+(?:TR|T&R|REEL|TAPE|TRAY|PBF|LF)|:[A-Z0-9])$")
+_TEMPERATURE = re.compile(r"(?:[\s\-]+|(?<=\d))(?:AIT|AAT|IT|AT|ET|XT|WT|UT)$")
+_SPEED = re.compile(r"-(\d{1,4}[A-Z]{0,4})$")
+# 速度等級數字後的字母常是溫度等級 (Winbond -6I, ISSI -7TLI)
+_SPEED_LETTERS = re.compile(r"[A-Z]+$")
+# 沒有分隔符號時, 接在已知 core 後面而可視為後綴的部分
+_LOOSE_SUFFIX = re.compile(r"[\-/#:]?\d{1,4}[A-Z]{0,4}|(?:AIT|AAT|IT|AT|ET|XT|WT|UT|TR)")
+_SPACES = re.compile(r"\s+")
+_DASH = re.compile(r"\s*-\s*")
+_END = ""
+# core 太短時 (例如只剩廠商代碼) 不視為同一顆料
+MIN_CORE = 6
+
+SUFFIX_KINDS = ("speed", "temperature", "packaging")
+# 後綴改變時需要重新搜尋的面向; 其他面向 (DDR type, voltage, density) 與後綴無關
+AFFECTED_ASPECTS = {
+    "speed": ("max frequency",),
+    "temperature": ("operating temperature",),
+    "packaging": (),
+}
+
+
+class PartKey(NamedTuple):
+    core: str
+    speed: str = ""
+    temperature: str = ""
+    packaging: str = ""
+
+
+def split_part_number(part_number):
+    """PartKey of ``part_number``: normalized core plus the recognized suffixes."""
+    text = _DASH.sub("-", _SPACES.sub(" ", (part_number or "").upper()).strip())
+    found = {"speed": "", "temperature": "", "packaging": ""}
+    changed = True
+    while changed:
+        changed = False
+        for kind, pattern in (("packaging", _PACKAGING), ("temperature", _TEMPERATURE), ("speed", _SPEED)):
+            # 包裝後綴可以有好幾段 (例如 ":P TR"), 其他各一段
+            if found[kind] and kind != "packaging":
+                continue
+            m = pattern.search(text)
+            if m and len(normalize_part_number(text[:m.start()])) >= MIN_CORE:
+                found[kind] = " ".join(filter(None, (m.group().strip(" -/#"), found[kind])))
+                text = text[:m.start()].rstrip()
+                changed = True
+    letters = _SPEED_LETTERS.search(found["speed"])
+    if letters:
+        found["temperature"] = " ".join(filter(None, (letters.group(), found["temperature"])))
+    return PartKey(normalize_part_number(text), **found)
+
+
+class Variant(NamedTuple):
+    """A known part number close to the requested one, and what differs."""
+
+    part_number: str
+    record: dict
+    differs: frozenset
+    exact: bool = False
+
+    def results(self, aspects):
+        """{aspect: search results} that still apply to the requested part."""
+        stale = {a for kind in self.differs for a in AFFECTED_ASPECTS[kind]}
+        found = self.record.get("results") or {}
+        return {a: found[a] for a in aspects if a not in stale and found.get(a)}
+
+    @property
+    def summary(self):
+        """The earlier summary when only packaging differs, else None."""
+        return self.record.get("summary") if self.differs <= {"packaging"} else None
+
+    @property
+    def params(self):
+        return self.record.get("params") or None
+
+
+class PartIndex:
+    """Prefix trie over the cores of resolved part numbers, optionally persisted in a SQLiteCache."""
+
+    def __init__(self, store=None, ttl=None, max_entries=None):
+        self.root = {}
+        # 正規化料號 -> record, 依加入時間排序 (最舊的在前), 供過期與淘汰使用
+        self.entries = OrderedDict()
+        self.store = store
+        self.ttl = ttl if ttl is not None else getattr(store, "ttl", None)
+        self.max_entries = max_entries if max_entries is not None else getattr(store, "max_entries", None)
+        # lookup 在 event loop 上, add 在 worker thread 上
+        self._lock = threading.Lock()
+        if store is not None:
+            with self._lock:
+                for _, record in store.items():
+                    self._insert(record)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _insert(self, record):
+        key = split_part_number(record["part_number"])
+        node = self.root
+        for ch in key.core:
+            node = node.setdefault(ch, {})
+        full = normalize_part_number(record["part_number"])
+        node.setdefault(_END, {})[full] = (key, record)
+        self.entries[full] = record
+        self.entries.move_to_end(full)
+        while self.max_entries and len(self.entries) > self.max_entries:
+            self._remove(*self.entries.popitem(last=False))
+
+    def _remove(self, full, record):
+        """Take ``record`` out of the trie and prune the nodes left empty."""
+        core = split_part_number(record["part_number"]).core
+        path = [self.root]
+        for ch in core:
+            node = path[-1].get(ch)
+            if node is None:
+                return
+            path.append(node)
+        bucket = path[-1].get(_END, {})
+        bucket.pop(full, None)
+        if not bucket:
+            path[-1].pop(_END, None)
+        for depth in range(len(core), 0, -1):
+            if path[depth]:
+                break
+            del path[depth - 1][core[depth - 1]]
+
+    def _expire(self):
+        """Drop the records older than ``ttl`` (the oldest are first in ``entries``)."""
+        if not self.ttl:
+            return
+        cutoff = time.time() - self.ttl
+        while self.entries:
+            full, record = next(iter(self.entries.items()))
+            if record.get("at", 0) >= cutoff:
+                break
+            del self.entries[full]
+            self._remove(full, record)
+
+    def add(self, part_number, results=None, summary=None, params=None):
+        """Remember what was found for ``part_number`` (replaces an earlier entry)."""
+        record = {
+            "part_number": part_number, "results": results or {}, "summary": summary,
+            "params": params or {}, "at": time.time(),
+        }
+        with self._lock:
+            self._insert(record)
+        if self.store is not None:
+            self.store.set(normalize_part_number(part_number), record)
+
+    def lookup(self, part_number) -> Optional[Variant]:
+        """Nearest known variant of ``part_number``, or None."""
+        with self._lock:
+            self._expire()
+            return self._lookup(part_number)
+
+    def _lookup(self, part_number):
+        key = split_part_number(part_number)
+        full = normalize_part_number(part_number)
+        node = self.root
+        last = None
+        for depth, ch in enumerate(key.core, 1):
+            node = node.get(ch)
+            if node is None:
+                break
+            if _END in node and depth >= MIN_CORE:
+                last = (depth, node)
+        else:
+            if _END in node:
+                return self._nearest(node[_END], key, full)
+        if last is None:
+            return None
+        depth, node = last
+        if not _LOOSE_SUFFIX.fullmatch(key.core[depth:]):
+            return None
+        # core 較長 (後綴未被辨識): 保守起見視為速度與溫度都不同
+        known, record = max(node[_END].values(), key=lambda item: item[1].get("at", 0))
+        differs = {"speed", "temperature"} | ({"packaging"} if known.packaging != key.packaging else set())
+        return Variant(record["part_number"], record, frozenset(differs))
+
+    @staticmethod
+    def _nearest(bucket, key, full):
+        if full in bucket:
+            return Variant(bucket[full][1]["part_number"], bucket[full][1], frozenset(), exact=True)
+
+        def differs(known):
+            return frozenset(kind for kind in SUFFIX_KINDS if getattr(known, kind) != getattr(key, kind))
+
+        known, record = min(bucket.values(), key=lambda item: (len(differs(item[0])), -item[1].get("at", 0)))
+        return Variant(record["part_number"], record, differs(known))
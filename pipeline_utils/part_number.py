@@ -0,0 +1,43 @@
+"""Helpers for handling competitor part numbers."""
+import re
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_part_number(pn):
+    """Canonical form used as a cache key: no whitespace, upper case."""
+    return _WHITESPACE.sub("", pn or "").upper()
+
+
+_SPLIT = re.compile(r"[\n\r,;\t]+")
+_HAS_DIGIT = re.compile(r"\d")
+_HAS_ALPHA = re.compile(r"[A-Za-z]")
+
+
+def looks_like_part_number(text):
+    text = text.strip()
+    return 6 <= len(text) <= 40 and bool(_HAS_DIGIT.search(text)) and bool(_HAS_ALPHA.search(text))
+
+
+def parse_part_numbers(message):
+    """Split a pasted list / CSV into part numbers.
+
+    Accepts one part number per line or comma/semicolon/tab separated cells
+    (e.g. a BOM exported as CSV). Cells that do not look like part numbers
+    (headers, quantities, descriptions) are skipped. Returns
+    (part_numbers, duplicates) with duplicates removed by normalized form,
+    keeping the first spelling seen.
+    """
+    seen, part_numbers, duplicates = set(), [], 0
+    for cell in _SPLIT.split(message or ""):
+        cell = cell.strip().strip('"').strip("'").strip()
+        # 含空白的儲存格多半是描述文字, 不是料號
+        if not looks_like_part_number(cell) or " " in cell:
+            continue
+        key = normalize_part_number(cell)
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        part_numbers.append(cell)
+    return part_numbers, duplicates
@@ -0,0 +1,235 @@
+"""Prompt templates laid out for Ollama's prompt (KV) cache.
+
+Ollama keeps the evaluated prompt of each parallel slot and only has to
+prefill the part of a new prompt after the longest common prefix. Every
+template therefore puts static text first, in the system message, and the
+per-request data (part number, search results, summary, candidates) last, in
+the user message. The params, decode and match stages also start with the
+same ``REFERENCE`` block (naming rule, voltage codes, selector arguments), so
+a slot that just served one stage can reuse that prefix for the next stage.
+
+Keep the static parts free of anything that changes per request (dates,
+counts, ids): a single differing character early in the system message
+invalidates the cached prefix from that point on.
+
+Each template also knows the shape of its answer: ``stop`` sequences for the
+server and an ``until`` detector (see completion.py) that tells when the
+answer is complete, so the stream can be closed before the model goes on.
+"""
+from .completion import JsonStream, TableStream
+from .function_call import FUNCTION_NAME, TagStream
+from .prompting import estimate_tokens
+
+REFERENCE = """#### DRAM Naming Pattern
+`<Category> <Product Family> <Operation Voltage> <Density> <I/O Pin Number> <Address>`
+
+DRAM_Naming_Rule:
+  Category:
+    - Description: "Category identifier for memory"
+    - Values:
+        - M: "Fixed category for DRAM products"
+
+  Product_Family:
+    - Description: "Defines the DRAM type and generation"
+    - Values:
+      - 12: "SDRAM"
+      - 52: "LP SDRAM"
+      - 13: "DDR SDRAM"
+      - 53: "LPDDR SDRAM"
+      - 14: "DDR2 SDRAM"
+      - 54: "LPDDR2 SDRAM"
+      - 15: "DDR3 SDRAM"
+      - 55: "LPDDR3 SDRAM"
+      - 16: "DDR4 SDRAM"
+      - 56 "LPDDR4/4X SDRAM"
+
+  Operation_Voltage:
+    - Description: "Defines the operating voltage of the DRAM"
+    - Values:
+      - L: "3.3V"
+      - S: "2.5V"
+      - F: "1.5V"
+      - T: "1.35V"
+      - U: "1.2V"
+      - D: "1.8V (VDD=1.8V, VDD2=VDDQ=1.2V)"
+      - Y: "1.8V (VDD=1.8V, VDD2=VDDQ=1.1V)"
+      - Z: "1.8V (VDD=1.8V, VDD2=1.1V, VDDQ=0.6V)"
+
+  Density:
+    - Description: "Defines the storage density of the DRAM"
+    - Values:
+      - "8": "8Mb"
+      - "16": "16Mb"
+      - "32": "32Mb"
+      - "64": "64Mb"
+      - "128": "128Mb"
+      - "256": "256Mb"
+      - "512": "512Mb"
+      - "1G": "1Gb"
+      - "2G": "2Gb"
+      - "4G": "4Gb"
+      - "8G": "8Gb"
+      - "16G": "16Gb"
+
+  I/O_Pin_Number:
+    - Description: "Defines the number of I/O pins for the DRAM"
+    - Values:
+      - "8": "x8"
+      - "16": "x16"
+      - "32": "x32"
+
+  Address:
+    - Description: "Defines the addressable memory of the DRAM"
+    - Values:
+      - "512": "512Kb"
+      - "1": "1Mb"
+      - "2": "2Mb"
+      - "4": "4Mb"
+      - "8": "8Mb"
+      - "16": "16Mb"
+      - "32": "32Mb"
+      - "64": "64Mb"
+      - "128": "128Mb"
+      - "256": "256Mb"
+      - "512": "512Mb"
+
+#### Selector function
+the argument for the selector function get_filtered_products is:
+get_filtered_products(
+    type_of_ddr="SDRAM", # can be one of the following: "SDRAM", "DDR SDRAM", "DDR II SDRAM", "DDR3 SDRAM or DDR3(L) SDRAM", "DDR4 SDRAM", "PSRAM", "Mobile SDRAM", "Mobile DDR SDRAM", "LPDDR SDRAM", "LPDDR2 SDRAM", "LPDDR3 SDRAM", "LPDDR4X SDRAM or LPDDR4/LPDDR4X SDRAM"
+    Operation_Voltage="D", # can be one of the following: "L", "S", "F", "T", "U", "D", "Y", "Z"
+    Density="64Mb" # can be one of the following: "8Mb", "16Mb", "32Mb", "64Mb", "128Mb", "256Mb", "512Mb", "1Gb", "2Gb", "4Gb", "8Gb", "16Gb"
+)
+
+Operation Voltage argument explanation:
+L: 3.3V
+S: 2.5V
+F: 1.5V
+T: 1.35V
+U: 1.2V
+D: 1.8V (VDD1=1.8V, VDD2=VDDQ=1.2V)
+Y: 1.8V (VDD1=1.8V, VDD2=VDDQ=1.1V)
+Z: 1.8V (VDD1=1.8V, VDD2=1.1V, VDDQ=0.6V)
+"""
+
+
+# match 回答的最後一行 (表格之後)
+BEST_MATCH_LINE = r"(?i)best match product[_ ]?id\W*\w"
+
+
+class PromptTemplate:
+    """Static ``system`` text plus a ``user`` format string for the per-request data.
+
+    ``stop``: stop sequences sent with the request (the server leaves them out
+    of the answer). ``until``: factory of a fresh completion detector per call.
+    """
+
+    def __init__(self, name, system, user, stop=None, until=None):
+        self.name = name
+        self.system = system
+        self.user = user
+        self.stop = stop
+        self.until = until
+
+    def render(self, **fields):
+        """Chat messages: the system prefix is byte-for-byte the same on every call."""
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user.format(**fields)},
+        ]
+
+    def overhead(self):
+        """Estimated tokens of the template without any data."""
+        return estimate_tokens(self.system) + estimate_tokens(self.user.format_map(_Empty()))
+
+
+class _Empty(dict):
+    def __missing__(self, key):
+        return ""
+
+
+SUMMARY = PromptTemplate(
+    "summary",
+    "Summarize the google search result to satisfy the user query in a detailed way. "
+    "Do not include any other knowledge, just the google search result. "
+    "Speed/Frequency should show in Hz, not bps.",
+    "User query: {part_number}\n\n\nGoogle search result:\n{search_results}",
+)
+
+_PARAMS_TASK = """
+
+You are an AI assistant specialized in parsing memory component specifications and translating them into function parameters. Your task is to:
+1. Read and understand the Google search results containing memory specifications
+2. Extract key parameters like DDR type, voltage, density, I/O configuration, and addressing
+3. Map these specifications to the appropriate arguments for the get_filtered_products function
+
+If the google search result does not contain the information of some arguments, please just don't fill in the argument.
+"""
+_PARAMS_USER = "user query for google search: {part_number}\n\ngoogle search result: {summary}"
+
+PARAMS_TAGS = PromptTemplate(
+    "params",
+    REFERENCE + _PARAMS_TASK + """
+Example get_filtered_products:
+<get_filtered_products>
+get_filtered_products(
+    type_of_ddr="DDR SDRAM",
+    Operation_Voltage="D",
+)
+</get_filtered_products>
+
+You first print chain of thought, then print the get_filtered_products function.
+the printed get_filtered_products function should be between the tag <get_filtered_products> and </get_filtered_products>""",
+    _PARAMS_USER,
+    # 伺服器在結束標籤處停止; 標籤本身由 stream_completion 補回
+    stop=[f"</{FUNCTION_NAME}>"],
+    until=TagStream,
+)
+
+PARAMS_JSON = PromptTemplate(
+    "params",
+    REFERENCE + _PARAMS_TASK + """
+Respond with a JSON object: first your chain of thought in "reasoning", then the arguments "type_of_ddr", "Operation_Voltage" and "Density" (leave out the ones you cannot determine).""",
+    _PARAMS_USER,
+    # JSON mode 下模型常在物件之後輸出大量空白, 物件完整即可停止
+    until=JsonStream,
+)
+
+DECODE = PromptTemplate(
+    "decode",
+    REFERENCE + """
+Please decode the candidate products by the DRAM Naming Pattern, and also include all the features of the candidate products.
+
+Show the decoded result and all the features of the candidate product ids in json format, as one JSON array in a single ```json code block.""",
+    "This is the golden target to be matched:\n{summary}\n\nThis is the candidate products:\n{candidates}",
+    until=JsonStream,
+)
+
+MATCH = PromptTemplate(
+    "match",
+    REFERENCE + """
+You are an AI assistant specialized in matching memory component specifications to golden target. Your task is to:
+1. Read and understand the golden target to be matched
+2. Read and understand the decoded result and all the features of the candidate products
+3. Match the golden target with the candidate products based on the features
+
+Some rules you should know:
+- If the golden target's description says that '533 MHz clock speed,' it means that the golden target's clock max frequency is 533 MHz.
+- If the golden target's description says that it is 0°C to 85°C, you can select candidate products's operation temperature range: 0°C to 85°C, or can be wider: 0°C to 95°C, but you cannot select: -40°C to 95°C as the Best Match.
+- Only select the product ID(s) that fully meet the golden target's required max frequency.
+- 1600 MHz is equal to 1.6 GHz.
+
+Show me a markdown table with ✅ or ❌ compared with golden target for every single feature for each candidate product.
+In each table cell, please first tell reason and then tell the result ✅ or ❌
+
+And then for the best match part_number in the table, analyze the reason and tell me the best match product_id under the part_number.
+Finish with the line `Best match product_id: <product_id>`.""",
+    """Original user query for golden target: <query>{part_number}</query>
+
+This is the golden target's description. The golden target is the product that the user wants to match:
+<golden_target_description>{summary}</golden_target_description>
+
+And this is the decoded result and all the features of the candidate products:
+<candidate>{candidates}</candidate>{precheck}""",
+    until=lambda: TableStream(BEST_MATCH_LINE),
+)
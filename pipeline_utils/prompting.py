@@ -0,0 +1,135 @@
+"""Prompt assembly helpers: compact serialization and token budgeting.
+
+Token counts are estimated, not tokenized: about 3.5 characters per token
+for ASCII text and one token per CJK/other multi-byte character, which is
+close enough for the qwen2.5 tokenizer to keep prompts inside num_ctx.
+"""
+import re
+
+# 搜尋結果與候選產品中對 LLM 無用的欄位
+DROP_FIELDS = {"href", "url", "link", "image", "thumbnail", "source", "datasheet_url"}
+
+_SPACES = re.compile(r"\s+")
+
+
+def estimate_tokens(text):
+    text = text or ""
+    chars = len(text)
+    # 多位元組字元 (中文等) 在 UTF-8 中為 3 bytes, 以此估算其數量
+    wide = (len(text.encode("utf-8")) - chars) // 2
+    return int((chars - wide) / 3.5 + wide) + 1
+
+
+def fit_text(text, max_tokens):
+    """Cut ``text`` on a line boundary so it fits ``max_tokens``."""
+    if max_tokens is None or estimate_tokens(text) <= max_tokens:
+        return text
+    lines = text.splitlines()
+    kept, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line + "\n")
+        if used + cost > max_tokens - 16:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept) + f"\n[... {len(lines) - len(kept)} more line(s) truncated to fit the prompt budget ...]"
+
+
+def _normalize_url(url):
+    url = (url or "").strip().lower()
+    url = re.sub(r"^https?://(www\.)?", "", url)
+    return url.rstrip("/")
+
+
+def compact_search_results(results, max_snippet_chars=400):
+    """One line per unique search hit: ``[n] title: snippet``.
+
+    Hits are deduped by URL (and by identical snippet), URLs and other
+    metadata are dropped, and long snippets are shortened.
+    """
+    seen_urls, seen_bodies, lines = set(), set(), []
+    for r in results:
+        url = _normalize_url(r.get("href") or r.get("url"))
+        body = _SPACES.sub(" ", r.get("body") or r.get("snippet") or "").strip()
+        if (url and url in seen_urls) or (body and body in seen_bodies):
+            continue
+        seen_urls.add(url)
+        seen_bodies.add(body)
+        if len(body) > max_snippet_chars:
+            body = body[:max_snippet_chars].rsplit(" ", 1)[0] + " ..."
+        title = _SPACES.sub(" ", r.get("title") or "").strip()
+        lines.append(f"[{len(lines) + 1}] {title}: {body}")
+    return "\n".join(lines)
+
+
+def _flatten(record):
+    row = {}
+    for key, value in record.items():
+        if key in DROP_FIELDS or value is None or value == "":
+            continue
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                # 解碼結果中與產品本身重複或無資訊的欄位
+                if sub_key in ("part_number", "category", "suffix") or sub_value in (None, ""):
+                    continue
+                row[sub_key] = sub_value
+        elif isinstance(value, (list, tuple)):
+            row[key] = ", ".join(str(v) for v in value)
+        else:
+            row[key] = value
+    return row
+
+
+def candidate_rows(records):
+    """Flatten candidate records into (columns, rows, common).
+
+    Columns whose value is the same for every row are moved to ``common`` so
+    they are written once instead of once per candidate.
+    """
+    flat = [_flatten(r) for r in records]
+    columns = list(dict.fromkeys(k for row in flat for k in row))
+    common = {}
+    if len(flat) > 1:
+        for col in columns:
+            values = {str(row.get(col, "")) for row in flat}
+            if len(values) == 1 and "" not in values:
+                common[col] = flat[0][col]
+    columns = [c for c in columns if c not in common]
+    rows = [[str(row.get(c, "")) for c in columns] for row in flat]
+    return columns, rows, common
+
+
+def render_candidates(columns, rows, common):
+    """Markdown-style pipe table; readable by the LLM and by the UI."""
+    out = []
+    if common:
+        out.append("Common to all candidates: " + "; ".join(f"{k}={v}" for k, v in common.items()))
+        out.append("")
+    out.append("| " + " | ".join(columns) + " |")
+    out.append("|" + "---|" * len(columns))
+    out.extend("| " + " | ".join(row) + " |" for row in rows)
+    return "\n".join(out)
+
+
+def compact_candidates(records):
+    return render_candidates(*candidate_rows(records))
+
+
+def chunk_candidates(records, max_tokens):
+    """Split records into tables that each fit ``max_tokens``.
+
+    Yields ``(table, rows)`` with the number of candidate rows in the table.
+    Always yields at least one table; a single row larger than the budget
+    gets a chunk of its own.
+    """
+    columns, rows, common = candidate_rows(records)
+    overhead = estimate_tokens(render_candidates(columns, [], common))
+    chunk, used = [], overhead
+    for row in rows:
+        cost = estimate_tokens("| " + " | ".join(row) + " |\n")
+        if chunk and used + cost > max_tokens:
+            yield render_candidates(columns, chunk, common), len(chunk)
+            chunk, used = [], overhead
+        chunk.append(row)
+        used += cost
+    yield render_candidates(columns, chunk, common), len(chunk)
@@ -0,0 +1,273 @@
+"""Priority scheduling of LLM calls over the Ollama slots shared by all pipelines.
+
+Every pipeline in the process that talks to the same Ollama backends sends
+its LLM calls through one ``Scheduler`` (see ``shared_scheduler``). A call
+``enqueue``s a ``Ticket`` with its priority class and user, waits until the
+ticket is granted one of the ``slots`` (OLLAMA_MAX_INFLIGHT per backend),
+streams, and ``release``s it. Waiting tickets are granted
+
+- by priority class: interactive chat, then single part-number lookups, then
+  batch lookups. A ticket moves up one class for every ``aging`` seconds it
+  has waited, so batches are delayed but never starved;
+- by arrival within a class;
+
+skipping tickets of users that already hold ``per_user`` slots. While a
+ticket waits, ``Ticket.wait`` (threads) / ``Ticket.wait_async`` (event loop)
+report how many tickets are ahead of it, so the response can show the queue
+position.
+
+Admission control is per request: ``admit`` refuses a new request when
+``max_queue`` tickets of its class or a more urgent one are already waiting
+(a queue full of batch work does not lock chats out). The calls of admitted
+requests are never refused, so the queue is bounded by the requests in
+progress.
+
+Queue wait and service time per class, the queue length and the slots in
+use are kept in ``metrics`` (a MetricsRegistry with namespace "scheduler").
+"""
+import asyncio
+import itertools
+import threading
+import time
+
+from .backends import parse_backend_urls
+from .metrics import MetricsRegistry
+
+PRIORITIES = ("interactive", "lookup", "batch")
+INTERACTIVE, LOOKUP, BATCH = PRIORITIES
+# 等待超過 GRACE 秒才顯示排隊位置, 之後位置改變時最多每 REPORT_INTERVAL 秒更新一次
+GRACE = 0.5
+REPORT_INTERVAL = 2.0
+
+
+class Ticket:
+    """One LLM call waiting for, or holding, a slot."""
+
+    def __init__(self, scheduler, priority, user=None):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.rank = PRIORITIES.index(priority)
+        self.user = user
+        self.seq = 0
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self.released = False
+        self._event = threading.Event()
+        self._loop = None
+        self._async_event = None
+
+    @property
+    def granted(self):
+        return self.granted_at is not None
+
+    @property
+    def wait_seconds(self):
+        return (self.granted_at or time.monotonic()) - self.enqueued_at
+
+    def ahead(self):
+        """Number of tickets that will be granted before this one (0 once granted)."""
+        return self.scheduler.position(self)
+
+    def _notify(self):
+        self._event.set()
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._async_event.set)
+            except RuntimeError:
+                # loop 已關閉 (pipeline 停止中)
+                pass
+
+    def _report(self, last, last_at):
+        """The position to show now, or None."""
+        waited = time.monotonic() - self.enqueued_at
+        if waited < GRACE or (last is not None and time.monotonic() - last_at < REPORT_INTERVAL):
+            return None
+        ahead = self.ahead()
+        return None if ahead == last or self.granted else ahead
+
+    def wait(self):
+        """Block until the slot is granted; yields the number of tickets ahead as it changes."""
+        last, last_at = None, 0.0
+        while True:
+            self._event.clear()
+            if self.granted:
+                return
+            ahead = self._report(last, last_at)
+            if ahead is not None:
+                last, last_at = ahead, time.monotonic()
+                yield ahead
+            self._event.wait(GRACE)
+
+    async def wait_async(self):
+        """``wait`` for a caller on an event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._async_event = asyncio.Event()
+        last, last_at = None, 0.0
+        while True:
+            self._async_event.clear()
+            if self.granted:
+                return
+            ahead = self._report(last, last_at)
+            if ahead is not None:
+                last, last_at = ahead, time.monotonic()
+                yield ahead
+            try:
+                await asyncio.wait_for(self._async_event.wait(), GRACE)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self):
+        """Give the slot back, or leave the queue; safe to call more than once."""
+        self.scheduler.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Scheduler:
+    """Slots of one set of Ollama backends, shared by every pipeline in the process."""
+
+    def __init__(self, slots=4, per_user=0, max_queue=0, aging=10.0, name="ollama"):
+        self.name = name
+        self.slots = slots
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self.aging = aging
+        self.waiting = []
+        self.running = set()
+        self.running_by_user = {}
+        self.metrics = MetricsRegistry("scheduler")
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._finish(([], []))
+
+    def configure(self, slots=None, per_user=None, max_queue=None, aging=None):
+        """Change the limits (0 per_user / max_queue = unlimited); tickets already waiting are re-dispatched."""
+        with self._lock:
+            if slots is not None:
+                self.slots = max(1, slots)
+            if per_user is not None:
+                self.per_user = per_user
+            if max_queue is not None:
+                self.max_queue = max_queue
+            if aging is not None:
+                self.aging = aging
+            dispatched = self._dispatch()
+        self._finish(dispatched)
+
+    def admit(self, priority):
+        """False when the queue is full for a new request of class ``priority``."""
+        rank = PRIORITIES.index(priority)
+        with self._lock:
+            waiting = sum(1 for t in self.waiting if t.rank <= rank)
+        if self.max_queue and waiting >= self.max_queue:
+            self.metrics.inc("rejected_total", priority=priority)
+            return False
+        return True
+
+    def enqueue(self, priority, user=None):
+        ticket = Ticket(self, priority, user)
+        with self._lock:
+            ticket.seq = next(self._seq)
+            self.waiting.append(ticket)
+            dispatched = self._dispatch()
+        self._finish(dispatched)
+        return ticket
+
+    def release(self, ticket):
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket in self.running:
+                self.running.discard(ticket)
+                if ticket.user is not None:
+                    self.running_by_user[ticket.user] -= 1
+                    if not self.running_by_user[ticket.user]:
+                        del self.running_by_user[ticket.user]
+                outcome = "served"
+            else:
+                self.waiting.remove(ticket)
+                outcome = "cancelled"
+            dispatched = self._dispatch(changed=True)
+        if outcome == "served":
+            self.metrics.observe("service_seconds", time.monotonic() - ticket.granted_at, priority=ticket.priority)
+        self.metrics.inc("calls_total", priority=ticket.priority, outcome=outcome)
+        self._finish(dispatched)
+
+    def _order(self):
+        """Waiting tickets in the order they will be granted (without the per-user caps)."""
+        now = time.monotonic()
+        if self.aging > 0:
+            return sorted(self.waiting, key=lambda t: (t.rank - (now - t.enqueued_at) / self.aging, t.seq))
+        return sorted(self.waiting, key=lambda t: (t.rank, t.seq))
+
+    def position(self, ticket):
+        with self._lock:
+            if ticket not in self.waiting:
+                return 0
+            return self._order().index(ticket)
+
+    def _dispatch(self, changed=False):
+        """Grant free slots (called with the lock held); returns (granted, tickets to notify)."""
+        granted = []
+        if len(self.running) < self.slots and self.waiting:
+            for ticket in self._order():
+                if len(self.running) >= self.slots:
+                    break
+                if self.per_user and ticket.user is not None and self.running_by_user.get(ticket.user, 0) >= self.per_user:
+                    continue
+                self.waiting.remove(ticket)
+                self.running.add(ticket)
+                if ticket.user is not None:
+                    self.running_by_user[ticket.user] = self.running_by_user.get(ticket.user, 0) + 1
+                ticket.granted_at = time.monotonic()
+                granted.append(ticket)
+        # 有人取得名額或離開佇列時, 其他等待者的位置也跟著改變
+        return granted, granted + (list(self.waiting) if granted or changed else [])
+
+    def _finish(self, dispatched):
+        """Wake the tickets and update the metrics (outside the lock)."""
+        granted, notify = dispatched
+        for ticket in granted:
+            self.metrics.observe("queue_wait_seconds", ticket.wait_seconds, priority=ticket.priority)
+        for ticket in notify:
+            ticket._notify()
+        with self._lock:
+            waiting = {p: 0 for p in PRIORITIES}
+            running = {p: 0 for p in PRIORITIES}
+            for ticket in self.waiting:
+                waiting[ticket.priority] += 1
+            for ticket in self.running:
+                running[ticket.priority] += 1
+            slots = self.slots
+        for priority in PRIORITIES:
+            self.metrics.set("waiting", waiting[priority], priority=priority)
+            self.metrics.set("running", running[priority], priority=priority)
+        self.metrics.set("slots", slots)
+
+    def stats(self):
+        with self._lock:
+            return {"slots": self.slots, "running": len(self.running), "waiting": len(self.waiting)}
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def shared_scheduler(backend_urls, **limits):
+    """The Scheduler of the backends ``backend_urls`` (valve value), created on first use.
+
+    ``limits`` (see Scheduler.configure) apply to every pipeline sharing it;
+    the pipeline configuring it last wins.
+    """
+    key = ",".join(sorted(parse_backend_urls(backend_urls)))
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = _schedulers[key] = Scheduler(name=key)
+    scheduler.configure(**limits)
+    return scheduler
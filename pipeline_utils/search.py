@@ -0,0 +1,194 @@
+"""Concurrent DuckDuckGo search with per-query retry/backoff."""
+import asyncio
+import queue
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from duckduckgo_search import DDGS
+
+
+@dataclass
+class SearchEvent:
+    """Progress event emitted while the searches are running.
+
+    kind is one of "start", "retry", "error", "done" or "failed"; elapsed is
+    the time in seconds since the query started.
+    """
+    kind: str
+    query: str
+    attempt: int = 0
+    wait: float = 0.0
+    results: List[Dict[str, Any]] = field(default_factory=list)
+    error: Optional[BaseException] = None
+    cached: bool = False
+    elapsed: float = 0.0
+
+
+class ConcurrentSearcher:
+    """Run several DuckDuckGo text searches at once.
+
+    Every query gets its own DDGS session and its own retry loop, so a slow or
+    rate-limited query only delays itself. ``max_workers`` bounds how many
+    queries hit DuckDuckGo at the same time.
+
+    When a ``cache`` (see pipeline_utils.cache.SQLiteCache) is given, results
+    are looked up by (query, region, max_results) before any network call and
+    successful searches are written back.
+
+    ``aiter_search`` runs the blocking DDGS calls on ``executor`` (the loop's
+    default executor if None); share one executor between requests so its size
+    bounds the total number of searches in flight.
+    """
+
+    def __init__(self, max_workers=5, max_results=5, region='tw', max_retries=3,
+                 backoff=2.0, jitter=0.5, cache=None, executor=None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_results = max_results
+        self.region = region
+        self.max_retries = max(1, int(max_retries))
+        self.backoff = backoff
+        self.jitter = jitter
+        self.cache = cache
+        self.executor = executor
+
+    def cache_key(self, query):
+        return self.cache.make_key(query, self.region, self.max_results)
+
+    def _fetch(self, query):
+        with DDGS() as ddgs:
+            return [r for r in ddgs.text(query, max_results=self.max_results, region=self.region)]
+
+    @staticmethod
+    def _timed(emit, start):
+        def timed(event):
+            event.elapsed = time.perf_counter() - start
+            emit(event)
+        return timed
+
+    def _run_query(self, query, emit):
+        start = time.perf_counter()
+        emit = self._timed(emit, start)
+        # 錯開同時送出的請求, 避免一次打滿 DuckDuckGo
+        if self.jitter:
+            time.sleep(random.uniform(0, self.jitter))
+        for retry in range(self.max_retries):
+            if retry > 0:
+                wait_time = self.backoff * retry
+                emit(SearchEvent("retry", query, attempt=retry, wait=wait_time))
+                time.sleep(wait_time)
+            try:
+                results = self._fetch(query)
+            except Exception as e:
+                emit(SearchEvent("error", query, attempt=retry + 1, error=e))
+                continue
+            if self.cache is not None and results:
+                self.cache.set(self.cache_key(query), results)
+            emit(SearchEvent("done", query, attempt=retry + 1, results=results))
+            return results
+        emit(SearchEvent("failed", query, attempt=self.max_retries))
+        return []
+
+    def iter_search(self, queries) -> Iterator[SearchEvent]:
+        """Yield SearchEvents in the order they happen.
+
+        A "done" or "failed" event is emitted exactly once per query; once all
+        of them have arrived the generator finishes.
+        """
+        queries = list(dict.fromkeys(queries))
+        events = queue.Queue()
+        for query in queries:
+            yield SearchEvent("start", query)
+
+        # 已快取的查詢直接回傳, 不需要建立任何網路連線
+        misses = []
+        for query in queries:
+            cached = self.cache.get(self.cache_key(query)) if self.cache is not None else None
+            if cached is not None:
+                yield SearchEvent("done", query, results=cached, cached=True)
+            else:
+                misses.append(query)
+        if not misses:
+            return
+
+        pool = ThreadPoolExecutor(max_workers=min(self.max_workers, len(misses)))
+        try:
+            for query in misses:
+                pool.submit(self._run_query, query, events.put)
+            pending = len(misses)
+            while pending:
+                event = events.get()
+                if event.kind in ("done", "failed"):
+                    pending -= 1
+                yield event
+        finally:
+            # 呼叫端提前停止時不再等待尚未完成的查詢
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _arun_query(self, query, slots, emit):
+        emit = self._timed(emit, time.perf_counter())
+        if self.jitter:
+            await asyncio.sleep(random.uniform(0, self.jitter))
+        for retry in range(self.max_retries):
+            if retry > 0:
+                wait_time = self.backoff * retry
+                emit(SearchEvent("retry", query, attempt=retry, wait=wait_time))
+                await asyncio.sleep(wait_time)
+            try:
+                # DDGS 只有同步 API: 在執行緒中呼叫, 等待重試時不佔用執行緒
+                async with slots:
+                    results = await asyncio.get_running_loop().run_in_executor(self.executor, self._fetch, query)
+            except Exception as e:
+                emit(SearchEvent("error", query, attempt=retry + 1, error=e))
+                continue
+            if self.cache is not None and results:
+                await asyncio.to_thread(self.cache.set, self.cache_key(query), results)
+            emit(SearchEvent("done", query, attempt=retry + 1, results=results))
+            return results
+        emit(SearchEvent("failed", query, attempt=self.max_retries))
+        return []
+
+    async def aiter_search(self, queries) -> AsyncIterator[SearchEvent]:
+        """asyncio version of iter_search, for use on the pipeline's event loop.
+
+        Cancelling the consumer cancels the queries that are still running.
+        """
+        queries = list(dict.fromkeys(queries))
+        for query in queries:
+            yield SearchEvent("start", query)
+
+        misses = []
+        for query in queries:
+            cached = await asyncio.to_thread(self.cache.get, self.cache_key(query)) if self.cache is not None else None
+            if cached is not None:
+                yield SearchEvent("done", query, results=cached, cached=True)
+            else:
+                misses.append(query)
+        if not misses:
+            return
+
+        events = asyncio.Queue()
+        slots = asyncio.Semaphore(self.max_workers)
+        tasks = [asyncio.ensure_future(self._arun_query(query, slots, events.put_nowait)) for query in misses]
+        try:
+            pending = len(misses)
+            while pending:
+                event = await events.get()
+                if event.kind in ("done", "failed"):
+                    pending -= 1
+                yield event
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def search(self, queries) -> Dict[str, List[Dict[str, Any]]]:
+        """Run all queries and return {query: results}."""
+        all_results = {}
+        for event in self.iter_search(queries):
+            if event.kind == "done":
+                all_results[event.query] = event.results
+            elif event.kind == "failed":
+                all_results[event.query] = []
+        return all_results
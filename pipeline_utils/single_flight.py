@@ -0,0 +1,111 @@
+"""Share one run of a lookup between concurrent identical requests.
+
+``SingleFlight.join(key, run)`` starts ``run(writer)`` as a task unless a run
+for ``key`` is already in flight; either way the caller gets the ``Flight``
+and reads its output with ``follow()``. A ``Broadcast`` buffer keeps every
+chunk written so far, so a request that attaches late first gets the chunks
+already streamed and then follows the live output.
+
+The run writes into the buffer without waiting for its readers: a slow client
+no longer slows the generation down (the buffer holds at most one answer). It
+is cancelled when its last reader goes away, and forgotten when it ends, so
+a request arriving afterwards starts a new run (the stage caches make that one
+cheap).
+"""
+import asyncio
+
+
+class Broadcast:
+    """Append-only chunk log that any number of readers follow from the start."""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+        self.error = None
+        self._changed = asyncio.Event()
+
+    async def write(self, chunk):
+        self.chunks.append(chunk)
+        self._wake()
+
+    def close(self, error=None):
+        self.closed = True
+        self.error = error
+        self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self):
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.closed:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class Flight:
+    """One in-flight run and its readers."""
+
+    def __init__(self, group, key, owner=None):
+        self.group = group
+        self.key = key
+        # 發起這次執行的請求 (例如 trace id), 供後來加入的請求記錄
+        self.owner = owner
+        self.buffer = Broadcast()
+        self.task = None
+        self.readers = 0
+
+    async def follow(self):
+        self.readers += 1
+        try:
+            async for chunk in self.buffer.follow():
+                yield chunk
+        finally:
+            self.readers -= 1
+            if self.readers == 0 and not self.task.done():
+                # 最後一個讀者離開: 停止執行 (關閉 Ollama 串流), 之後的請求重新開始
+                self.group.forget(self)
+                self.task.cancel()
+
+
+class SingleFlight:
+    """Runs in flight, keyed by e.g. the normalized part number."""
+
+    def __init__(self):
+        self.flights = {}
+
+    def join(self, key, run, owner=None):
+        """(flight, joined): the run in flight for ``key``, or a new one started with ``run(writer)``."""
+        flight = self.flights.get(key)
+        if flight is not None:
+            return flight, True
+        flight = self.flights[key] = Flight(self, key, owner)
+        flight.task = asyncio.ensure_future(self._run(flight, run))
+        return flight, False
+
+    def forget(self, flight):
+        if self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
+
+    async def _run(self, flight, run):
+        try:
+            await run(flight.buffer)
+        except asyncio.CancelledError:
+            flight.buffer.close(asyncio.CancelledError())
+            raise
+        except BaseException as e:
+            flight.buffer.close(e)
+        else:
+            flight.buffer.close()
+        finally:
+            self.forget(flight)
+
+    def __len__(self):
+        return len(self.flights)
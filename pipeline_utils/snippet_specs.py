@@ -0,0 +1,239 @@
+"""Spec record of a competitor part taken straight from its search snippets.
+
+The summary stage only asks the LLM to read DDR type, supply voltage,
+density, operating temperature and max frequency (plus the I/O width the
+match compares) out of the search results, and the snippets usually state
+them as plain tokens ("DDR3L", "1.35V", "4Gb", "-40°C to 95°C", "800MHz",
+"x16"). ``extract_specs`` scans every unique snippet once with a single
+compiled alternation of the patterns of param_extractor and units, and lets
+each snippet (source) vote:
+
+- a source gets weight 1 when it mentions the part's core number (see
+  part_index.split_part_number), ``RELATED_WEIGHT`` otherwise (results about
+  the same family or another density of it);
+- a source naming several values of one field splits its weight between
+  them (a family table "2Gb/4Gb/8Gb" barely counts);
+- a field's confidence is the winning value's share of the votes, scaled
+  down while fewer than ``SUPPORT`` weight agrees on it.
+
+``SnippetSpecs.confidence`` is the lowest confidence of the selector
+arguments (DDR type, density and, when any source states one, voltage);
+temperature, frequency and I/O width go into the rendered summary as one
+value unless other sources contradict it (a source listing several values,
+e.g. "x8/x16", does not). Nothing is guessed: without a confident record
+the caller falls back to the LLM.
+"""
+import re
+from dataclasses import dataclass, field
+
+from .dram_decoder import OPERATION_VOLTAGE
+from .param_extractor import DDR_TYPE_PATTERNS, DENSITY_NAMES, voltage_code
+from .part_index import MIN_CORE, split_part_number
+from .part_number import normalize_part_number
+from .units import (
+    PATTERNS, find_io_widths, find_temperature_ranges, format_frequency, format_temperature, parse_density_mb,
+    parse_frequency_mhz, parse_voltage,
+)
+
+RELATED_WEIGHT = 0.5
+SUPPORT = 2.0
+# 送給 get_filtered_products 的參數; 電壓只在有來源提到時才列入
+PARAM_FIELDS = ("type_of_ddr", "Density", "Operation_Voltage")
+SPEC_FIELDS = PARAM_FIELDS + ("temperature", "frequency_mhz", "io")
+
+
+def _scoped(pattern):
+    return f"(?i:{pattern.pattern})" if pattern.flags & re.I else pattern.pattern
+
+
+# 一次掃描: 溫度範圍在前 (避免 "-40" 被其他規則吃掉), 型別依 param_extractor 由具體到一般
+_TOKEN = re.compile("|".join(
+    [f"(?P<temperature>{_scoped(PATTERNS['temperature'])})"]
+    + [f"(?P<type{i}>{_scoped(p)})" for i, (p, _) in enumerate(DDR_TYPE_PATTERNS)]
+    + [f"(?P<{name}>{_scoped(PATTERNS[name])})" for name in ("frequency", "voltage", "density", "io")]
+))
+_TYPE_NAMES = {f"type{i}": name for i, (_, name) in enumerate(DDR_TYPE_PATTERNS)}
+_DDR3_TYPE = "DDR3 SDRAM or DDR3(L) SDRAM"
+# DDR3-1600 之類的速度等級不算 DDR3 / DDR3L 的描述
+_SPEED_GRADE = re.compile(r"-\d")
+_URL_PREFIX = re.compile(r"^https?://(www\.)?")
+_SPACES = re.compile(r"\s+")
+
+
+@dataclass
+class SpecField:
+    """Outcome of the vote on one field."""
+
+    value: object = None
+    confidence: float = 0.0
+    # 投給 value 的來源數與所有投票的來源數
+    sources: int = 0
+    voters: int = 0
+    votes: dict = field(default_factory=dict)
+    # 提到 value 的來源 (可能同時列出其他值) 佔投票權重的比例; 其餘來源才與 value 矛盾
+    agreement: float = 0.0
+
+
+@dataclass
+class SourceSpecs:
+    """Values one search result mentions."""
+
+    weight: float
+    types: set = field(default_factory=set)
+    ddr3_variants: set = field(default_factory=set)
+    voltages: list = field(default_factory=list)
+    densities: set = field(default_factory=set)
+    temperatures: set = field(default_factory=set)
+    frequencies: set = field(default_factory=set)
+    io_widths: set = field(default_factory=set)
+
+
+@dataclass
+class SnippetSpecs:
+    part_number: str
+    sources: int = 0
+    relevant: int = 0
+    fields: dict = field(default_factory=dict)
+
+    def value(self, name):
+        spec = self.fields.get(name)
+        return spec.value if spec is not None else None
+
+    @property
+    def confidence(self):
+        """Lowest confidence of the selector arguments; 0 when DDR type or density is unknown."""
+        names = [n for n in PARAM_FIELDS if n in self.fields and (n != "Operation_Voltage" or self.fields[n].votes)]
+        if "type_of_ddr" not in names or "Density" not in names:
+            return 0.0
+        return min(self.fields[n].confidence for n in names)
+
+    @property
+    def params(self):
+        """get_filtered_products arguments, or None when DDR type or density is unknown."""
+        if self.value("type_of_ddr") is None or self.value("Density") is None:
+            return None
+        params = {"type_of_ddr": self.value("type_of_ddr"), "Density": self.value("Density")}
+        if self.value("Operation_Voltage"):
+            params["Operation_Voltage"] = self.value("Operation_Voltage")
+        return params
+
+    def summary(self, min_confidence=0.0):
+        """Summary text in place of the LLM's; matcher.target_from reads temperature, frequency and I/O from it.
+
+        Temperature, frequency and I/O width are stated as one value unless
+        sources contradict it (``agreement`` below ``min_confidence``); then
+        every value the sources gave is listed, so the match treats the field
+        as ambiguous.
+        """
+        lines = [f"Specifications of {self.part_number} taken from {self.sources} search result(s), "
+                 f"{self.relevant} of them naming the part:"]
+        lines.append(f"- DDR type: {self.value('type_of_ddr')}")
+        code = self.value("Operation_Voltage")
+        lines.append(f"- Operation voltage: {OPERATION_VOLTAGE[code]}" if code else "- Operation voltage: not stated")
+        lines.append(f"- Density: {self.value('Density')}")
+        for name, label, fmt in (
+            ("temperature", "Operating temperature", format_temperature),
+            ("frequency_mhz", "Max frequency", format_frequency),
+            ("io", "I/O", lambda width: f"x{width}"),
+        ):
+            spec = self.fields.get(name)
+            if spec is None or spec.value is None:
+                lines.append(f"- {label}: not stated")
+            elif spec.agreement >= min_confidence:
+                lines.append(f"- {label}: {fmt(spec.value)}")
+            else:
+                ranked = sorted(spec.votes, key=spec.votes.get, reverse=True)
+                lines.append(f"- {label}: sources disagree ({', '.join(fmt(v) for v in ranked)})")
+        return "\n".join(lines)
+
+
+def _source_key(result):
+    url = _URL_PREFIX.sub("", (result.get("href") or result.get("url") or "").strip().lower()).rstrip("/")
+    return url or _SPACES.sub(" ", result.get("body") or result.get("snippet") or "").strip()
+
+
+def scan_source(text, weight=1.0):
+    """SourceSpecs of one snippet, in a single pass of the combined pattern."""
+    source = SourceSpecs(weight)
+    for m in _TOKEN.finditer(text):
+        kind, token = m.lastgroup, m.group()
+        if kind == "temperature":
+            source.temperatures.update(find_temperature_ranges(token))
+        elif kind == "frequency":
+            source.frequencies.add(parse_frequency_mhz(token))
+        elif kind == "voltage":
+            source.voltages.append(parse_voltage(token))
+        elif kind == "io":
+            source.io_widths.update(find_io_widths(token))
+        elif kind == "density":
+            density = parse_density_mb(token)
+            if density in DENSITY_NAMES:
+                source.densities.add(density)
+        else:
+            name = _TYPE_NAMES[kind]
+            source.types.add(name)
+            if name == _DDR3_TYPE and not _SPEED_GRADE.match(text, m.end()):
+                source.ddr3_variants.add("L" if token.upper().endswith("L") else "")
+    return source
+
+
+def _vote(sources, values_of):
+    """SpecField of the weighted vote; each source splits its weight over the distinct values it names."""
+    spec = SpecField()
+    named = []
+    for source in sources:
+        values = values_of(source)
+        if not values:
+            continue
+        named.append((source.weight, values))
+        for value in values:
+            spec.votes[value] = spec.votes.get(value, 0.0) + source.weight / len(values)
+    candidates = {v: w for v, w in spec.votes.items() if v is not False}
+    spec.voters = len(named)
+    if not candidates:
+        return spec
+    spec.value = max(candidates, key=candidates.get)
+    weight = candidates[spec.value]
+    spec.sources = sum(1 for _, values in named if spec.value in values)
+    spec.confidence = weight / sum(spec.votes.values()) * min(1.0, weight / SUPPORT)
+    spec.agreement = sum(w for w, values in named if spec.value in values) / sum(w for w, _ in named)
+    return spec
+
+
+def extract_specs(results, part_number):
+    """SnippetSpecs of ``part_number`` from its search results (dicts with title/body/href)."""
+    core = split_part_number(part_number).core
+    seen, sources = set(), []
+    for result in results:
+        key = _source_key(result)
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        text = f"{result.get('title') or ''}\n{result.get('body') or result.get('snippet') or ''}"
+        relevant = len(core) >= MIN_CORE and core in normalize_part_number(text)
+        sources.append(scan_source(text, 1.0 if relevant else RELATED_WEIGHT))
+
+    specs = SnippetSpecs(part_number, len(sources), sum(1 for s in sources if s.weight == 1.0))
+    specs.fields["type_of_ddr"] = _vote(sources, lambda s: s.types)
+    specs.fields["Density"] = _vote(sources, lambda s: {DENSITY_NAMES[d] for d in s.densities})
+    specs.fields["temperature"] = _vote(sources, lambda s: s.temperatures)
+    # 每個來源取其提到的最高頻率 (其餘多為較低速度等級)
+    specs.fields["frequency_mhz"] = _vote(sources, lambda s: {max(s.frequencies)} if s.frequencies else set())
+    specs.fields["io"] = _vote(sources, lambda s: s.io_widths)
+
+    ddr_type = specs.value("type_of_ddr")
+    if ddr_type is not None:
+        # DDR3L 為 1.35V 並相容 1.5V: 多數來源只寫 DDR3L 時, "1.35V/1.5V" 視為 1.35V
+        variants = _vote(sources, lambda s: s.ddr3_variants)
+        low_voltage_only = variants.value == "L"
+
+        def codes(source):
+            code = voltage_code(ddr_type, source.voltages, low_voltage_only)
+            if code is None or (code is False and len(set(source.voltages)) < 2):
+                # 只寫一個電壓 (例如 LPDDR 只寫 VDD1=1.8V) 是資訊不足, 不算矛盾
+                return set()
+            # False: 此來源的電壓無法歸為單一代碼, 計入投票但不會勝出
+            return {code}
+
+        specs.fields["Operation_Voltage"] = _vote(sources, codes)
+    return specs
@@ -0,0 +1,88 @@
+"""Incremental decoder for OpenAI-compatible server-sent-event streams."""
+import json
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+_DATA = b"data:"
+_DONE = b"[DONE]"
+
+
+class SSEEvent(NamedTuple):
+    raw: bytes
+    content: str = ""
+    finish_reason: Optional[str] = None
+    usage: Optional[dict] = None
+    done: bool = False
+
+
+class SSEDecoder:
+    """Parse each streamed line exactly once and gather the content deltas.
+
+    Keep-alive/comment lines (``: ...``) and blank lines produce no event; the
+    ``data: [DONE]`` sentinel produces one event with ``done=True``. Text is
+    kept in a list and only joined when ``text()`` is called.
+
+    ``stop_reason`` is the stop sequence the server stopped on, for servers
+    that report it (vLLM); Ollama reports "stop" for both a stop sequence and
+    the end of the answer, and leaves it None.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.finish_reason = None
+        self.stop_reason = None
+        self.usage = None
+        self.done = False
+        self.errors = 0
+
+    def feed(self, line) -> Optional[SSEEvent]:
+        if isinstance(line, str):
+            line = line.encode("utf-8")
+        if not line or line[:1] == b":":
+            return None
+        payload = line[5:].strip() if line.startswith(_DATA) else line.strip()
+        if payload == _DONE:
+            self.done = True
+            return SSEEvent(line, done=True)
+
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            self.errors += 1
+            print(f"sse: skipping undecodable line: {line[:200]!r}")
+            return None
+        if not isinstance(data, dict):
+            return None
+        if "error" in data:
+            self.errors += 1
+            print(f"sse: error in stream: {data['error']}")
+            return None
+
+        content = ""
+        finish_reason = None
+        choices = data.get("choices")
+        if choices:
+            choice = choices[0]
+            delta = choice.get("delta") or choice.get("message") or {}
+            content = delta.get("content") or ""
+            finish_reason = choice.get("finish_reason")
+            if isinstance(choice.get("stop_reason"), str):
+                self.stop_reason = choice["stop_reason"]
+        usage = data.get("usage")
+
+        if content:
+            self.parts.append(content)
+        if finish_reason:
+            self.finish_reason = finish_reason
+        if usage:
+            self.usage = usage
+        return SSEEvent(line, content, finish_reason, usage)
+
+    def iter_events(self, lines: Iterable) -> Iterator[SSEEvent]:
+        feed = self.feed
+        for line in lines:
+            event = feed(line)
+            if event is not None:
+                yield event
+
+    def text(self) -> str:
+        return "".join(self.parts)
@@ -0,0 +1,196 @@
+"""Plumbing between the async pipeline stages and the response stream.
+
+The stages are coroutines that write their output to a ``StreamWriter``;
+``stream_task`` runs them as a task and turns the writer into an async
+generator, and ``BackgroundLoop.iterate`` lets the synchronous ``pipe`` API of
+the pipelines server consume that generator.
+"""
+import asyncio
+import threading
+
+
+class StreamWriter:
+    """Bounded channel from a running pipeline to the response stream.
+
+    ``write`` waits while ``maxsize`` chunks are pending, so a slow client
+    slows the pipeline down (and, through it, the read from Ollama) instead of
+    letting chunks pile up in memory.
+
+    With a ``coalescer`` (output_stream.Coalescer) the written text only
+    enters the channel in coalesced chunks. While writes keep coming the
+    coalescer flushes on them; a timer flushes the pending text when the
+    writes stall (at most one more window after the window expired).
+    """
+
+    def __init__(self, maxsize=64, coalescer=None):
+        self.queue = asyncio.Queue(maxsize=max(1, maxsize))
+        self.coalescer = coalescer
+        self.timer = None
+
+    async def write(self, chunk):
+        if self.coalescer is None:
+            await self.queue.put(chunk)
+            return
+        chunk = self.coalescer.feed(chunk)
+        if chunk and self.timer is not None:
+            # 已由寫入送出; 取消的計時器不會喚醒 event loop
+            self.timer.cancel()
+            self.timer = None
+        self._arm()
+        if chunk:
+            await self.queue.put(chunk)
+
+    def _arm(self):
+        if self.coalescer.pending and self.timer is None:
+            delay = self.coalescer.due() + self.coalescer.window
+            self.timer = asyncio.get_running_loop().call_later(delay, self._expire)
+
+    def _expire(self):
+        self.timer = None
+        if not self.coalescer.pending:
+            return
+        if self.queue.full():
+            # 用戶端較慢, 佇列中還有片段: 稍後再試
+            self._arm()
+            return
+        chunk = self.coalescer.flush()
+        if chunk:
+            self.queue.put_nowait(chunk)
+        self._arm()
+
+    async def close(self):
+        """Send what the coalescer still holds."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.coalescer is not None:
+            chunk = self.coalescer.close()
+            if chunk:
+                await self.queue.put(chunk)
+
+
+class NullWriter:
+    """Writer that discards everything (stages run for their return value only)."""
+
+    async def write(self, chunk):
+        pass
+
+
+NULL_WRITER = NullWriter()
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+async def stream_task(run, maxsize=64, coalescer=None):
+    """Run ``run(writer)`` as a task and yield what it writes.
+
+    With a ``coalescer`` the writes are yielded in coalesced chunks (see
+    StreamWriter).
+
+    An exception raised by ``run`` is re-raised to the consumer. If the
+    consumer stops early (client disconnect, ``aclose()``, cancellation) the
+    task is cancelled, which closes any in-flight HTTP stream it is reading.
+    """
+    writer = StreamWriter(maxsize, coalescer)
+
+    async def runner():
+        try:
+            await run(writer)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            await writer.close()
+            await writer.queue.put(_Failure(e))
+            return
+        await writer.close()
+        await writer.queue.put(_DONE)
+
+    task = asyncio.ensure_future(runner())
+    try:
+        while True:
+            item = await writer.queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        if writer.timer is not None:
+            writer.timer.cancel()
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+class BackgroundLoop:
+    """Event loop running in a daemon thread, shared by every request.
+
+    The pipelines server calls ``pipe`` from a worker thread and iterates the
+    returned generator synchronously; ``iterate`` pulls one item at a time from
+    an async generator running on this loop, so the worker thread only waits
+    for the next chunk while all I/O of all requests is multiplexed here.
+    """
+
+    def __init__(self, name="pipeline-loop"):
+        self.name = name
+        self.loop = None
+        self.thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name=self.name, daemon=True)
+                self.thread.start()
+        return self.loop
+
+    def run(self, coro):
+        """Run a coroutine on the loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.start()).result()
+
+    def spawn(self, coro):
+        """Start a coroutine on the loop without waiting; returns a cancellable future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.start())
+
+    def iterate(self, agen):
+        """Drive an async generator from synchronous code.
+
+        The generator only advances when the caller asks for the next item
+        (back-pressure); closing this generator closes ``agen`` on the loop.
+        """
+        try:
+            while True:
+                try:
+                    yield self.run(agen.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(agen.aclose())
+
+    async def aiterate(self, agen):
+        """Async counterpart of ``iterate`` for callers running on another loop."""
+        loop = self.start()
+        try:
+            while True:
+                try:
+                    yield await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(agen.__anext__(), loop))
+                except StopAsyncIteration:
+                    return
+        finally:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(agen.aclose(), loop))
+
+    def stop(self):
+        with self._lock:
+            if self.loop is None:
+                return
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=5)
+            self.loop.close()
+            self.loop = None
+            self.thread = None
@@ -0,0 +1,111 @@
+"""Parsing of the units that show up in memory specs.
+
+Everything is normalized to one base unit per quantity: MHz for frequency,
+volts, °C and Mb for density.
+"""
+import re
+
+_NUM = r"(\d+(?:\.\d+)?)"
+
+_FREQ = re.compile(_NUM + r"\s*(GHz|MHz|kHz|Hz)\b", re.I)
+_FREQ_SCALE = {"ghz": 1000.0, "mhz": 1.0, "khz": 0.001, "hz": 0.000001}
+
+# "-40°C to 95°C", "0 ~ 85 °C", "-25℃-85℃", "0C to +70C"
+_TEMP_RANGE = re.compile(
+    r"([-−–+]?\s*\d+(?:\.\d+)?)\s*(?:°\s*C|℃|C(?![A-Za-z]))?\s*(?:to|~|–|-|—|/)\s*"
+    r"([-−–+]?\s*\d+(?:\.\d+)?)\s*(?:°\s*C|℃|C(?![A-Za-z]))",
+    re.I,
+)
+
+_VOLT = re.compile(_NUM + r"\s*(mV|V)\b")
+
+_DENSITY = re.compile(_NUM + r"\s*(Gb|Mb|Kb|Gbit|Mbit|Kbit)\b")
+_DENSITY_SCALE = {"g": 1024.0, "m": 1.0, "k": 1.0 / 1024}
+
+
+def _signed(text):
+    text = text.replace(" ", "").replace("−", "-").replace("–", "-")
+    return float(text)
+
+
+def parse_frequency_mhz(text):
+    """'1.6 GHz' -> 1600.0; None when no frequency is found."""
+    m = _FREQ.search(text or "")
+    if not m:
+        return None
+    return float(m.group(1)) * _FREQ_SCALE[m.group(2).lower()]
+
+
+def find_frequencies_mhz(text):
+    return [float(v) * _FREQ_SCALE[u.lower()] for v, u in _FREQ.findall(text or "")]
+
+
+def parse_temperature_range(text):
+    """'-40°C to 95°C' -> (-40.0, 95.0); None when no range is found."""
+    ranges = find_temperature_ranges(text)
+    return ranges[0] if ranges else None
+
+
+def find_temperature_ranges(text):
+    ranges = []
+    for low, high in _TEMP_RANGE.findall(text or ""):
+        low, high = _signed(low), _signed(high)
+        if low < high:
+            ranges.append((low, high))
+    return ranges
+
+
+def parse_voltage(text):
+    """'1.35V' -> 1.35, '1350mV' -> 1.35; None when no voltage is found."""
+    m = _VOLT.search(text or "")
+    if not m:
+        return None
+    value = float(m.group(1))
+    return value / 1000 if m.group(2) == "mV" else value
+
+
+def find_voltages(text):
+    return [float(v) / 1000 if u == "mV" else float(v) for v, u in _VOLT.findall(text or "")]
+
+
+def parse_density_mb(text):
+    """'4Gb' -> 4096.0, '512Mbit' -> 512.0; bytes (GB/MB) are not densities."""
+    m = _DENSITY.search(text or "")
+    if not m:
+        return None
+    return float(m.group(1)) * _DENSITY_SCALE[m.group(2)[0].lower()]
+
+
+def find_densities_mb(text):
+    return [float(v) * _DENSITY_SCALE[u[0].lower()] for v, u in _DENSITY.findall(text or "")]
+
+
+def covers(outer, inner):
+    """True when the temperature range ``outer`` contains ``inner``."""
+    return outer[0] <= inner[0] and outer[1] >= inner[1]
+
+
+_IO_WIDTH = re.compile(r"(?<![A-Za-z0-9])[xX]\s?(4|8|16|32)\b")
+
+
+def find_io_widths(text):
+    """'256M x16' -> [16]"""
+    return [int(v) for v in _IO_WIDTH.findall(text or "")]
+
+
+# 各數值的樣式, 供一次掃描多種數值的呼叫端組合成單一 regex (snippet_specs)
+PATTERNS = {
+    "temperature": _TEMP_RANGE,
+    "frequency": _FREQ,
+    "voltage": _VOLT,
+    "density": _DENSITY,
+    "io": _IO_WIDTH,
+}
+
+
+def format_frequency(mhz):
+    return f"{mhz:g} MHz"
+
+
+def format_temperature(rng):
+    return f"{rng[0]:g}°C to {rng[1]:g}°C"
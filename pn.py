@@ -1,6 +1,6 @@
-from typing import List, Union, Generator, Iterator
+from typing import AsyncIterator, List, Union, Generator, Iterator
 from schemas import OpenAIChatMessage
-import requests
+from pydantic import BaseModel
 import json
 
 # Import the selector function
@@ -8,12 +8,172 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'files'))
 from selector import get_filtered_products
-from duckduckgo_search import DDGS
 import random
 import time
-import re
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from dataclasses import dataclass, field
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from pipeline_utils.async_ollama_client import STREAM_ERRORS, AsyncOllamaClient
+from pipeline_utils.backends import BackendPool, Failover, health_loop
+from pipeline_utils.cache import SQLiteCache, content_hash
+from pipeline_utils.catalog import ProductCatalog
+from pipeline_utils.completion import TailStats
+from pipeline_utils.dram_decoder import decode_candidates, iter_candidates
+from pipeline_utils.function_call import (
+    RESPONSE_FORMAT, find_call_block, parse_call_arguments, parse_json_arguments, validate_params,
+)
+from pipeline_utils.matcher import UNKNOWN, needs_llm, render_best_match, render_table, score_candidates, target_from
+from pipeline_utils.metrics import MetricsRegistry, MetricsServer, Trace
+from pipeline_utils.output_stream import Coalescer
+from pipeline_utils.param_extractor import ParamExtractor, SpeculativePrefetch
+from pipeline_utils.part_index import PartIndex
+from pipeline_utils.part_number import normalize_part_number, parse_part_numbers
+from pipeline_utils.prompt_templates import DECODE, MATCH, PARAMS_JSON, PARAMS_TAGS, SUMMARY
+from pipeline_utils.prompting import (
+    chunk_candidates, compact_candidates, compact_search_results, estimate_tokens, fit_text,
+)
+from pipeline_utils.scheduler import BATCH, LOOKUP, shared_scheduler
+from pipeline_utils.search import ConcurrentSearcher
+from pipeline_utils.single_flight import SingleFlight
+from pipeline_utils.snippet_specs import extract_specs
+from pipeline_utils.sse import SSEDecoder
+from pipeline_utils.streaming import NULL_WRITER, BackgroundLoop, stream_task
+from pipeline_utils.units import find_frequencies_mhz, find_temperature_ranges
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# 每個料號搜尋的面向 (查詢字串為 "<料號> <面向>")
+SEARCH_ASPECTS = ("ddr type", "operation voltage", "density", "operating temperature", "max frequency")
+
+
+@dataclass
+class RequestContext:
+    """單一請求內各階段共用的設定"""
+    model: str
+    bypass_cache: bool = False
+    trace: Trace = field(default_factory=Trace)
+    # 階段名稱 -> 模型; 未列出的階段使用 model
+    stage_models: dict = field(default_factory=dict)
+    # 共用排程器中的優先等級 (scheduler.PRIORITIES) 與使用者 (body["user"]["id"])
+    priority: str = LOOKUP
+    user: str = None
+
+    def model_for(self, stage):
+        return (self.stage_models.get(stage) or self.model).strip()
+
 
 class Pipeline:
+    class Valves(BaseModel):
+        # 同時進行的 DuckDuckGo 查詢數量上限
+        SEARCH_CONCURRENCY: int = 5
+        SEARCH_MAX_RESULTS: int = 5
+        SEARCH_REGION: str = "tw"
+        SEARCH_MAX_RETRIES: int = 3
+        # 重試等待時間 = SEARCH_BACKOFF * 重試次數 (秒)
+        SEARCH_BACKOFF: float = 2.0
+        # 所有請求共用的搜尋執行緒數 (DDGS 只有同步 API), 即同時進行的搜尋總數上限
+        SEARCH_THREADS: int = 32
+        # 搜尋結果快取 (SQLite), TTL 單位為秒
+        SEARCH_CACHE_ENABLED: bool = True
+        SEARCH_CACHE_PATH: str = os.path.join(CACHE_DIR, "pn_cache.sqlite")
+        SEARCH_CACHE_TTL: int = 7 * 24 * 3600
+        SEARCH_CACHE_MAX_ENTRIES: int = 5000
+        # 啟動時載入並建立索引的產品目錄; CATALOG_PATH 留空則由 selector 取得全部產品
+        CATALOG_ENABLED: bool = True
+        CATALOG_PATH: str = ""
+        # 候選料號解碼方式: "rule" 以命名規則解碼 (無法解碼時退回 LLM), "llm" 一律交給 LLM
+        DECODE_MODE: str = "rule"
+        # 比對方式: "rule" 以規則比對 (有無法判斷的欄位時才呼叫 LLM), "llm" 一律交給 LLM
+        MATCH_MODE: str = "rule"
+        MATCH_TABLE_MAX_ROWS: int = 30
+        # summary: "snippets" 先以規則從搜尋摘要擷取規格, 各來源一致 (信心 >= SNIPPET_MIN_CONFIDENCE) 時
+        # 不呼叫 summary 與參數萃取的 LLM, 直接以擷取結果篩選; "llm" 一律交給 LLM
+        SUMMARY_MODE: str = "snippets"
+        SNIPPET_MIN_CONFIDENCE: float = 0.8
+        # 篩選參數: "speculative" 在 summary 串流時即擷取參數並預先查詢候選 (不確定時才呼叫 LLM), "llm" 一律交給 LLM
+        PARAMS_MODE: str = "speculative"
+        # LLM 萃取參數的輸出格式: "tags" 思考過程 + <get_filtered_products> 標籤 (結束標籤一出現即停止生成),
+        # "json" 以 JSON schema 限制輸出 (需 Ollama >= 0.5)
+        PARAMS_OUTPUT: str = "tags"
+        # 各階段提示詞的 token 上限 (估計值); 模型 context 為 20k, 需保留輸出空間
+        SEARCH_SNIPPET_MAX_CHARS: int = 400
+        SUMMARY_TOKEN_BUDGET: int = 12000
+        PARAMS_TOKEN_BUDGET: int = 8000
+        DECODE_TOKEN_BUDGET: int = 6000
+        MATCH_TOKEN_BUDGET: int = 12000
+        # Ollama 後端; 多台以逗號分隔, 依進行中的請求數分配 (least outstanding requests)
+        OLLAMA_BASE_URL: str = "http://ollama:11434"
+        MODEL: str = "qwen2.5-32b-20k:latest"
+        # 各階段使用的模型, 留空則用 MODEL (例如參數萃取用小模型, 比對用 32B)
+        SUMMARY_MODEL: str = ""
+        PARAMS_MODEL: str = ""
+        DECODE_MODEL: str = ""
+        MATCH_MODEL: str = ""
+        # 後端健康檢查間隔 (秒, 0 = 不檢查); 出錯的後端移出輪替, 直到健康檢查通過
+        OLLAMA_HEALTH_INTERVAL: float = 15.0
+        # 串流中途出錯時改由其他後端接續的次數
+        OLLAMA_FAILOVER_ATTEMPTS: int = 2
+        # "native": 經 Ollama /api/chat (可帶 keep_alive 與 options, 並回報 prefill 時間); "openai": /v1/chat/completions
+        OLLAMA_API: str = "native"
+        # 模型與 KV cache 在 Ollama 中保留的時間; 卸載後下一個請求要重新載入並重算所有前綴
+        OLLAMA_KEEP_ALIVE: str = "30m"
+        # context 長度 (0 = 模型預設); 同一模型的所有請求必須相同, 否則 Ollama 會重新載入模型
+        OLLAMA_NUM_CTX: int = 0
+        # 各階段生成的 token 上限 (num_predict, 0 = 不限)
+        SUMMARY_MAX_TOKENS: int = 1024
+        PARAMS_MAX_TOKENS: int = 1024
+        DECODE_MAX_TOKENS: int = 4096
+        MATCH_MAX_TOKENS: int = 4096
+        # 回答的結構完整 (結束標籤/完整 JSON/表格加結論行) 即關閉串流, 不等模型自行結束
+        EARLY_STOP: bool = True
+        # 抽樣比例: 這些呼叫仍跑到結束, 用來量測提前關閉省下的 token
+        EARLY_STOP_HOLDOUT: float = 0.02
+        # Ollama 連線池大小與逾時 (秒); read timeout 為兩個串流片段間的最長間隔
+        OLLAMA_POOL_SIZE: int = 10
+        OLLAMA_CONNECT_TIMEOUT: float = 5.0
+        OLLAMA_READ_TIMEOUT: float = 300.0
+        # 每台 Ollama 後端同時處理的請求上限; 由使用同一組後端的所有 pipeline (包括對話) 共用,
+        # 依優先順序分配: 對話 > 單一料號 > 批次
+        OLLAMA_MAX_INFLIGHT: int = 4
+        # 每位使用者 (body["user"]["id"]) 同時佔用的名額上限 (0 = 不限)
+        SCHEDULER_PER_USER: int = 2
+        # 等待中的 LLM 呼叫達此數量 (同等級或更優先者) 時, 新請求直接回覆忙碌 (0 = 不限)
+        SCHEDULER_MAX_QUEUE: int = 64
+        # 每等待這麼多秒提升一個優先等級, 批次不會一直等不到 (0 = 不提升)
+        SCHEDULER_AGING: float = 10.0
+        # 各 LLM 階段 (summary/params/decode/match) 的結果快取
+        STAGE_CACHE_ENABLED: bool = True
+        STAGE_CACHE_TTL: int = 24 * 3600
+        STAGE_CACHE_MAX_ENTRIES: int = 2000
+        # 快取命中時重播的每段字元數, 讓 UI 仍然以串流方式顯示
+        STAGE_CACHE_REPLAY_CHUNK: int = 64
+        # 料號索引: 只差速度/溫度/包裝後綴的料號重用已解析料號的搜尋結果, summary 與篩選參數
+        # (STAGE_CACHE_ENABLED 時存於快取檔, 重啟後仍可用)
+        PART_INDEX_ENABLED: bool = True
+        # 批次模式: 同時處理的料號數, 每個料號列出的候選數, 單次請求的料號上限
+        BATCH_CONCURRENCY: int = 4
+        BATCH_TABLE_ROWS: int = 5
+        BATCH_MAX_PARTS: int = 500
+        # 相同料號 (正規化後) 的並行請求共用進行中的查詢, 不重複搜尋與生成
+        SINGLE_FLIGHT: bool = True
+        # 尚未送出給使用者的串流片段上限; 用戶端讀取較慢時 pipeline 會暫停 (back-pressure)
+        STREAM_BUFFER_CHUNKS: int = 64
+        # 輸出格式: "content" 只送出文字並合併成較大的片段 (由 pipelines server 包成 chunk);
+        # "sse" 逐一轉送 Ollama 的原始 SSE 行 (每個 token 一個事件)
+        STREAM_FORMAT: str = "content"
+        # 合併的時間與大小窗口 (ms / bytes; 0 ms = 每個 token 立即送出, 0 bytes = 不限大小);
+        # 片段只在不會打斷 markdown 區塊的位置切開
+        STREAM_COALESCE_MS: float = 30.0
+        STREAM_COALESCE_BYTES: int = 256
+        # 量測: 每個步驟輸出一行 JSON log; Prometheus 格式的 /metrics 埠 (0 = 不啟用) 與 textfile 路徑 (空白 = 不寫)
+        METRICS_JSON_LOG: bool = True
+        METRICS_PORT: int = 0
+        METRICS_PATH: str = ""
+        # 在回應最後附上各步驟耗時表 (也可在 body 中帶 "trace": true)
+        TRACE_SUMMARY: bool = False
+
     def __init__(self):
         # Optionally, you can set the id and name of the pipeline.
         # Best practice is to not specify the id so that it can be automatically inferred from the filename, so that users can install multiple versions of the same pipeline.
@@ -21,78 +181,927 @@ class Pipeline:
         # The identifier must be an alphanumeric string that can include underscores or hyphens. It cannot contain spaces, special characters, slashes, or backslashes.
         # self.id = "ollama_pipeline"
         self.name = "Ollama Pipeline"
+        self.valves = self.Valves()
+        self.search_cache = None
+        self.stage_caches = {}
+        self.part_index = None
+        self.ollama = None
+        self.catalog = None
+        self.scheduler = None
+        self.backends = None
+        self.health_task = None
+        # 所有請求共用的 event loop (在背景執行緒中執行)
+        self.loop = BackgroundLoop("pn-pipeline")
+        self.search_executor = None
+        self.metrics = MetricsRegistry("pn")
+        self.metrics_server = None
+        # 各階段結構完整後模型還會生成的 token 數 (由 holdout 呼叫量測)
+        self.early_stop_tails = TailStats()
+        # 進行中的單一料號查詢 (single-flight)
+        self.flights = SingleFlight()
         pass
 
     async def on_startup(self):
         # This function is called when the server is started.
         print(f"on_startup:{__name__}")
+        self.open_caches()
+        self.loop.start()
+        self.start_health_checks()
+        self.get_search_executor()
+        self.load_catalog()
+        if self.valves.METRICS_PORT and self.metrics_server is None:
+            self.metrics_server = MetricsServer(self.metrics, self.valves.METRICS_PORT, extra=[self.get_scheduler().metrics])
+            self.metrics_server.start()
         pass
 
     async def on_shutdown(self):
         # This function is called when the server is stopped.
         print(f"on_shutdown:{__name__}")
+        if self.health_task is not None:
+            self.health_task.cancel()
+            self.health_task = None
+        if self.ollama is not None:
+            # aiohttp session 屬於背景 loop, 需在該 loop 上關閉
+            self.loop.run(self.ollama.close())
+            self.ollama = None
+        self.loop.stop()
+        self.scheduler = None
+        self.backends = None
+        if self.search_executor is not None:
+            self.search_executor.shutdown(wait=False, cancel_futures=True)
+            self.search_executor = None
+        self.close_caches()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
         pass
 
+    async def on_valves_updated(self):
+        # 後端 URL, 金鑰或並行上限改變時重新建立後端池, 連線與排程器;
+        # 不重啟整個 pipeline, 以免停掉背景 loop 上其他進行中的請求
+        if self.health_task is not None:
+            self.health_task.cancel()
+            self.health_task = None
+        if self.ollama is not None:
+            self.loop.run(self.ollama.close())
+            self.ollama = None
+        self.backends = None
+        self.scheduler = None
+        self.start_health_checks()
+        if self.metrics_server is not None:
+            self.metrics_server.extra = (self.get_scheduler().metrics,)
+
+    def load_catalog(self):
+        """載入產品目錄並建立索引 (只在啟動時做一次)"""
+        if not self.valves.CATALOG_ENABLED:
+            return
+        try:
+            if self.valves.CATALOG_PATH:
+                with open(self.valves.CATALOG_PATH, encoding="utf-8") as f:
+                    products = json.load(f)
+            else:
+                # 不帶任何篩選條件即為全部產品
+                products = get_filtered_products()
+            self.catalog = ProductCatalog.from_selector_result(products)
+            print(f"catalog: indexed {len(self.catalog)} products "
+                  f"({self.catalog.unknown_rows()} with attributes left to the selector)")
+        except Exception as e:
+            print(f"catalog: falling back to selector.get_filtered_products ({e})")
+            self.catalog = None
+
+    async def filter_products(self, filtered_params, result_summary, trace=None):
+        """以索引目錄篩選候選產品, 並依 summary 中的頻率/溫度預先排序"""
+        start = time.perf_counter()
+        products = None
+        if self.catalog is not None:
+            # 目錄中屬性未知的產品可能符合時回傳 None, 改由 selector 判斷
+            products = self.filter_catalog(filtered_params, result_summary)
+            source = "catalog"
+        if products is None:
+            products = await asyncio.to_thread(get_filtered_products, **filtered_params)
+            source = "selector"
+        if trace is not None:
+            trace.record("filter", "get_filtered_products", time.perf_counter() - start,
+                         source=source, matches=products.get("total_matches"))
+        return products
+
+    def filter_catalog(self, filtered_params, result_summary):
+        frequencies = find_frequencies_mhz(result_summary)
+        temperatures = find_temperature_ranges(result_summary)
+        return self.catalog.get_filtered_products(
+            target_frequency_mhz=max(frequencies) if frequencies else None,
+            target_temperature=temperatures[0] if temperatures else None,
+            **filtered_params,
+        )
+
+    def get_ollama_client(self):
+        """取得共用的 Ollama 連線池 (若尚未建立則依 valves 建立)"""
+        if self.ollama is None:
+            self.ollama = AsyncOllamaClient(
+                pool_size=self.valves.OLLAMA_POOL_SIZE,
+                connect_timeout=self.valves.OLLAMA_CONNECT_TIMEOUT,
+                read_timeout=self.valves.OLLAMA_READ_TIMEOUT,
+            )
+        return self.ollama
+
+    def get_backends(self):
+        """取得 Ollama 後端池 (若尚未建立則依 valves 建立)"""
+        if self.backends is None:
+            self.backends = BackendPool.from_urls(self.valves.OLLAMA_BASE_URL)
+            print(f"backends: {[b.name for b in self.backends.backends]}")
+        return self.backends
+
+    def start_health_checks(self):
+        if self.valves.OLLAMA_HEALTH_INTERVAL > 0 and self.health_task is None:
+            client = self.get_ollama_client()
+            self.health_task = self.loop.spawn(health_loop(
+                self.get_backends(), lambda b: client.list_models(b.url, b.headers()),
+                self.valves.OLLAMA_HEALTH_INTERVAL,
+            ))
+
+    def get_scheduler(self):
+        """使用同一組 Ollama 後端的所有 pipeline 共用的排程器, 名額與上限依 valves 設定"""
+        if self.scheduler is None:
+            self.scheduler = shared_scheduler(
+                self.valves.OLLAMA_BASE_URL,
+                slots=max(1, self.valves.OLLAMA_MAX_INFLIGHT) * len(self.get_backends()),
+                per_user=self.valves.SCHEDULER_PER_USER,
+                max_queue=self.valves.SCHEDULER_MAX_QUEUE,
+                aging=self.valves.SCHEDULER_AGING,
+            )
+        return self.scheduler
+
+    def open_caches(self):
+        """開啟搜尋結果與各階段結果快取 (依 valves 設定)"""
+        if self.valves.SEARCH_CACHE_ENABLED and self.search_cache is None:
+            self.search_cache = SQLiteCache(
+                self.valves.SEARCH_CACHE_PATH,
+                namespace="ddg_search",
+                ttl=self.valves.SEARCH_CACHE_TTL,
+                max_entries=self.valves.SEARCH_CACHE_MAX_ENTRIES,
+            )
+        if self.valves.STAGE_CACHE_ENABLED and not self.stage_caches:
+            for stage in ("summary", "params", "decode", "match"):
+                self.stage_caches[stage] = SQLiteCache(
+                    self.valves.SEARCH_CACHE_PATH,
+                    namespace=f"stage_{stage}",
+                    ttl=self.valves.STAGE_CACHE_TTL,
+                    max_entries=self.valves.STAGE_CACHE_MAX_ENTRIES,
+                )
+        if self.valves.PART_INDEX_ENABLED and self.part_index is None:
+            store = None
+            if self.valves.STAGE_CACHE_ENABLED:
+                store = SQLiteCache(
+                    self.valves.SEARCH_CACHE_PATH,
+                    namespace="part_index",
+                    ttl=self.valves.STAGE_CACHE_TTL,
+                    max_entries=self.valves.STAGE_CACHE_MAX_ENTRIES,
+                )
+            self.part_index = PartIndex(
+                store, ttl=self.valves.STAGE_CACHE_TTL, max_entries=self.valves.STAGE_CACHE_MAX_ENTRIES
+            )
+            print(f"part index: {len(self.part_index)} part numbers")
+
+    def close_caches(self):
+        if self.search_cache is not None:
+            print(f"search cache: {self.search_cache.stats()}")
+            self.search_cache.close()
+            self.search_cache = None
+        for cache in self.stage_caches.values():
+            print(f"stage cache: {cache.stats()}")
+            cache.close()
+        self.stage_caches = {}
+        if self.part_index is not None and self.part_index.store is not None:
+            self.part_index.store.close()
+        self.part_index = None
+
+    def stage_key(self, *parts):
+        """階段快取的 key; 字串參數視為料號並正規化, 其他內容取 hash"""
+        if parts and isinstance(parts[0], str):
+            return f"{normalize_part_number(parts[0])}:{content_hash(*parts[1:])}"
+        return content_hash(*parts)
+
+    def replay_text(self, text):
+        """把快取的文字切成小段 yield, 讓 UI 維持串流顯示"""
+        size = max(1, self.valves.STAGE_CACHE_REPLAY_CHUNK)
+        for i in range(0, len(text), size):
+            yield text[i:i + size]
+
+    async def cached_stage(self, out, stage, key, ctx, run):
+        """執行一個 LLM 階段: 命中快取時重播結果, 否則 await run() 串流並寫入快取
+
+        Returns the complete stage text.
+        """
+        cache = self.stage_caches.get(stage)
+        if cache is not None and not ctx.bypass_cache:
+            cached = await asyncio.to_thread(cache.get, key)
+            ctx.trace.record("cache", stage, hit=cached is not None)
+            if cached is not None:
+                for chunk in self.replay_text(cached):
+                    await out.write(chunk)
+                return cached
+
+        text = await run()
+        if cache is not None and text:
+            await asyncio.to_thread(cache.set, key, text)
+        return text
+
+    def stage_budget(self, stage):
+        return getattr(self.valves, f"{stage.upper()}_TOKEN_BUDGET", None)
+
+    def fit_prompt(self, stage, messages, content):
+        """提示詞超出該階段 token 預算時, 截短 user 訊息中的 content 部分"""
+        budget = self.stage_budget(stage)
+        tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        excess = tokens - budget if budget else 0
+        user = messages[-1]
+        if excess > 0 and content and content in user["content"]:
+            fitted = fit_text(content, max(0, estimate_tokens(content) - excess))
+            messages = messages[:-1] + [{**user, "content": user["content"].replace(content, fitted, 1)}]
+            tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        print(f"prompt: stage={stage} static_tokens={estimate_tokens(messages[0]['content'])} est_tokens={tokens} budget={budget}")
+        return messages
+
+    def generation_options(self, stage):
+        """keep_alive / options / max_tokens of a stage's request"""
+        extra = {"keep_alive": self.valves.OLLAMA_KEEP_ALIVE or None}
+        if self.valves.OLLAMA_NUM_CTX:
+            extra["options"] = {"num_ctx": self.valves.OLLAMA_NUM_CTX}
+        max_tokens = getattr(self.valves, f"{stage.upper()}_MAX_TOKENS", 0)
+        if max_tokens:
+            extra["max_tokens"] = max_tokens
+        return extra
+
+    async def stream_completion(self, out, ctx, messages, stage="llm", on_content=None, extra=None, template=None):
+        """串流呼叫 chat completions, 逐行寫入 out, 回傳完整內容
+
+        on_content receives every content delta; when it returns True the
+        stream is closed right there, which stops the generation. ``extra`` is
+        merged into the request payload (e.g. response_format).
+
+        ``template`` (the PromptTemplate the messages came from) adds its stop
+        sequences to the request and its ``until`` detector to the stream:
+        with EARLY_STOP the stream is closed once the answer's structure is
+        complete. EARLY_STOP_HOLDOUT of the calls run to the end instead; the
+        tokens they generate after that point give the saving reported for
+        the stopped calls (tokens and GPU seconds, in the trace).
+
+        The request goes to the least busy backend of the pool. If that
+        backend fails (also mid-stream), the next one continues the answer
+        (backends.Failover).
+        """
+        model = ctx.model_for(stage)
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+        payload.update(self.generation_options(stage))
+        if template is not None and template.stop:
+            payload["stop"] = template.stop
+        if extra:
+            payload.update(extra)
+        until = template.until() if template is not None and template.until else None
+        cut = until is not None and self.valves.EARLY_STOP and random.random() >= self.valves.EARLY_STOP_HOLDOUT
+        complete_at = None
+        native = self.valves.OLLAMA_API == "native"
+        raw_output = self.valves.STREAM_FORMAT == "sse"
+        decoder = SSEDecoder()
+        stopped = False
+        client = self.get_ollama_client()
+        failover = Failover(
+            self.get_backends(),
+            lambda backend, request: client.stream_chat(backend.url, request, backend.headers(), native),
+            STREAM_ERRORS, self.valves.OLLAMA_FAILOVER_ATTEMPTS, model=model, label=stage,
+        )
+        # 在共用排程器排隊取得名額; 等待較久時在串流中顯示前面還有幾個請求
+        ticket = self.get_scheduler().enqueue(ctx.priority, ctx.user)
+        try:
+            async for ahead in ticket.wait_async():
+                await out.write(f"\n\n⏳ Waiting for the model: {ahead} request(s) ahead...\n\n")
+            start = time.perf_counter()
+            first_token = None
+            # 使用者中斷時 task 被取消, stream_chat 會一併關閉連線 (Ollama 隨即停止生成);
+            # 提前結束時 aclosing 立即關閉串流並歸還後端
+            async with aclosing(failover.aevents(payload, decoder)) as events:
+                async for event in events:
+                    if first_token is None and event.content:
+                        # 第一個 token 之前的時間約等於 prefill 時間
+                        first_token = time.perf_counter() - start
+                    # [DONE] 由 pipelines server 在整個回應結束時送出, 階段之間不轉送
+                    if raw_output and not event.done:
+                        await out.write(event.raw)
+                    elif event.content:
+                        await out.write(event.content)
+                    if on_content is not None and event.content and on_content(event.content):
+                        stopped = True
+                        break
+                    if complete_at is None and until is not None and event.content and until.feed(event.content):
+                        complete_at = len(decoder.parts)
+                        if cut:
+                            stopped = True
+                            break
+        finally:
+            ticket.release()
+        # 伺服器送來的片段數 (Ollama 每個片段一個 token), 不含下面補回的 stop sequence
+        received = len(decoder.parts)
+        sequence = self.stopped_on(payload, decoder, until) if complete_at is None else None
+        if sequence is not None:
+            # 伺服器在 stop sequence 處停止且不輸出它; 它正好補完結構 (例如結束標籤), 補回輸出中
+            decoder.parts.append(sequence)
+            await out.write(sequence)
+            complete_at = received
+        total = time.perf_counter() - start
+        usage = decoder.usage or {}
+        completion_tokens = usage.get("completion_tokens")
+        # 串流提前關閉時沒有 usage, 以收到的片段數估計
+        generated = completion_tokens or received
+        decode_time = total - (first_token or 0)
+        tokens_per_s = generated / decode_time if generated and decode_time > 0 else None
+        tail_tokens = saved_tokens = saved_gpu_s = None
+        if complete_at is not None and not stopped:
+            # 跑到結束的呼叫: 結構完整之後多生成的 token 數; complete_at 是片段數,
+            # 先以片段計算, 有 usage 時再依 token/片段 的比例換算成 token
+            tail_tokens = max(0, received - complete_at)
+            if completion_tokens and received:
+                tail_tokens = round(tail_tokens * completion_tokens / received)
+            self.early_stop_tails.add(stage, tail_tokens)
+        elif complete_at is not None:
+            saved_tokens = self.early_stop_tails.mean(stage)
+            if saved_tokens is not None:
+                saved_tokens = round(saved_tokens)
+                saved_gpu_s = round(saved_tokens / tokens_per_s, 3) if tokens_per_s else None
+        ctx.trace.record(
+            "llm", stage, total,
+            ttft=round(first_token, 4) if first_token is not None else None,
+            prompt_tokens=usage.get("prompt_tokens"),
+            # native API: 實際 prefill 的時間; 前綴命中 KV cache 時 prompt_tokens 只計算未命中的部分
+            prefill_s=usage.get("prompt_eval_seconds"),
+            prompt_est=sum(estimate_tokens(m["content"]) for m in messages),
+            # 提前關閉的串流沒有 usage; 以收到的片段數計 (Ollama 每個片段一個 token)
+            completion_tokens=completion_tokens or (generated if stopped else None),
+            tokens_per_s=round(tokens_per_s, 2) if tokens_per_s else None,
+            stopped_early=stopped or None,
+            capped=decoder.finish_reason == "length" or None,
+            tail_tokens=tail_tokens,
+            saved_tokens=saved_tokens,
+            saved_gpu_s=saved_gpu_s,
+            model=model,
+            backend=failover.backend.name,
+            failovers=len(failover.failed) or None,
+            # 在共用排程器等待名額的時間 (不含在 total 內)
+            queued_s=round(ticket.wait_seconds, 3) if ticket.wait_seconds >= 0.001 else None,
+        )
+        return decoder.text()
+
+    @staticmethod
+    def stopped_on(payload, decoder, until):
+        """The stop sequence the stream ended on and that completes ``until``'s structure, else None.
+
+        The server leaves the stop sequence out of the answer, so a function
+        call cut at its closing tag looks unfinished. It is only taken as such when the
+        opening tag is in the answer and the server stopped on the sequence:
+        either it says so (``stop_reason``), or, when it does not tell a stop
+        sequence from the end of the answer (Ollama), the answer stopped with
+        the block still open.
+        """
+        if until is None or decoder.finish_reason != "stop" or not payload.get("stop"):
+            return None
+        open_tag = getattr(until, "open_tag", None)
+        if open_tag is None or open_tag not in decoder.text():
+            return None
+        for sequence in payload["stop"]:
+            if decoder.stop_reason is not None and decoder.stop_reason != sequence:
+                continue
+            if until.feed(sequence):
+                return sequence
+        return None
+
+    def get_search_executor(self):
+        if self.search_executor is None:
+            self.search_executor = ThreadPoolExecutor(max_workers=max(1, self.valves.SEARCH_THREADS), thread_name_prefix="pn-search")
+        return self.search_executor
+
+    def make_searcher(self, max_results=None, region=None, max_retries=None):
+        """依照 valves 建立並行搜尋器"""
+        return ConcurrentSearcher(
+            max_workers=self.valves.SEARCH_CONCURRENCY,
+            max_results=self.valves.SEARCH_MAX_RESULTS if max_results is None else max_results,
+            region=self.valves.SEARCH_REGION if region is None else region,
+            max_retries=self.valves.SEARCH_MAX_RETRIES if max_retries is None else max_retries,
+            backoff=self.valves.SEARCH_BACKOFF,
+            cache=self.search_cache,
+            executor=self.get_search_executor(),
+        )
+
     def bulk_duckduckgo_search(self, queries, max_results=5, region='tw', max_retries=3):
-        """批量執行 DuckDuckGo 搜尋，添加簡單重試機制"""
+        """批量執行 DuckDuckGo 搜尋 (並行), 每個查詢各自重試"""
+        searcher = self.make_searcher(max_results=max_results, region=region, max_retries=max_retries)
         all_results = {}
-        
-        for query in queries:
-            for retry in range(max_retries):
-                try:
-                    # 如果是重試，添加等待時間
-                    if retry > 0:
-                        wait_time = 2 * retry
-                        print(f"Retry #{retry} for '{query}' after {wait_time}s")
-                        time.sleep(wait_time)
-                    
-                    # 每次查詢創建新的 DDGS 會話
-                    with DDGS() as ddgs:
-                        results = [r for r in ddgs.text(query, max_results=max_results, region=region)]
-                        print(f"Success: found {len(results)} results for '{query}'")
-                        all_results[query] = results
-                        # Add random wait time between 0 and 0.5 seconds
-                        random_time = random.uniform(0, 0.5)
-                        time.sleep(random_time)
-                        # 成功後跳出重試循環
-                        break
-                except Exception as e:
-                    print(f"Error (attempt {retry+1}/{max_retries}) searching for '{query}': {e}")
-                    # 如果已重試到最大次數仍失敗
-                    if retry == max_retries - 1:
-                        print(f"All {max_retries} attempts failed for '{query}'")
-                        all_results[query] = []
-        
+
+        for event in searcher.iter_search(queries):
+            if event.kind == "retry":
+                print(f"Retry #{event.attempt} for '{event.query}' after {event.wait}s")
+            elif event.kind == "error":
+                print(f"Error (attempt {event.attempt}/{searcher.max_retries}) searching for '{event.query}': {event.error}")
+            elif event.kind == "done":
+                source = " (cached)" if event.cached else ""
+                print(f"Success: found {len(event.results)} results for '{event.query}'{source}")
+                all_results[event.query] = event.results
+            elif event.kind == "failed":
+                print(f"All {searcher.max_retries} attempts failed for '{event.query}'")
+                all_results[event.query] = []
+
         return all_results
     
-    def extract_function_call(self, response_text):
-        """從 LLM 回應中提取函數呼叫參數"""
-        pattern = r'<get_filtered_products>(.*?)</get_filtered_products>'
-        matches = re.findall(pattern, response_text, re.DOTALL)
+    def extract_function_call(self, response_text, output="tags"):
+        """從 LLM 回應中提取函數呼叫參數, 只保留允許的值"""
+        if output == "json":
+            raw = parse_json_arguments(response_text)
+        else:
+            function_text = find_call_block(response_text)
+            if function_text is None:
+                return {}
+            raw = parse_call_arguments(function_text)
+
+        params, rejected = validate_params(raw)
+        if rejected:
+            print(f"params: dropped invalid arguments {rejected}")
+        return params
+    
+    async def resolve_part(self, out, other_company_pn, ctx):
+        """單一料號的完整流程: search -> summary -> params -> candidates -> decode -> match"""
+        # Step 1: Stream initial message
+        await out.write(f"## Processing part number: {other_company_pn}\n\nPerforming web search to gather information...")
+
+        # 只差後綴的已解析料號: 重用與後綴無關的搜尋結果, 篩選參數, 以及 (只差包裝時) summary
+        variant = self.find_variant(other_company_pn, ctx)
+        result_duckduckgo, search_results = await self.search_stage(out, other_company_pn, ctx, variant)
+        reused_summary = self.reused_summary(variant)
+        specs = self.snippet_specs(other_company_pn, result_duckduckgo, ctx) if reused_summary is None else None
+        prefetch = self.make_prefetch(ctx) if not (variant and variant.params) and specs is None else None
+        try:
+            if reused_summary is not None:
+                if not variant.exact:
+                    await out.write(f"Summary reused from {variant.part_number} (same part, different packaging)")
+                result_summary = reused_summary
+            elif specs is not None:
+                await out.write(f"Specifications taken from the search results (confidence {specs.confidence:.2f})")
+                result_summary = specs.summary(self.valves.SNIPPET_MIN_CONFIDENCE)
+            else:
+                result_summary = await self.summary_stage(
+                    out, other_company_pn, result_duckduckgo, ctx, prefetch and prefetch.on_content
+                )
+
+            # Print the complete first response content
+            await out.write(f"\n\n### Summary of Google search results:\n\n{result_summary}\n\n")
+            #------------------------------------------
+
+            if variant is not None and variant.params:
+                filtered_params = variant.params
+                arguments = ", ".join(f'{k}="{v}"' for k, v in filtered_params.items())
+                await out.write(f"Selector arguments reused from {variant.part_number}: `get_filtered_products({arguments})`\n\n")
+            elif specs is not None:
+                filtered_params = specs.params
+                arguments = ", ".join(f'{k}="{v}"' for k, v in filtered_params.items())
+                await out.write(f"Selector arguments taken from the search results: `get_filtered_products({arguments})`\n\n")
+            else:
+                filtered_params = await self.params_stage(out, other_company_pn, result_summary, ctx, prefetch and prefetch.extractor)
+            filtered_products = await self.query_candidates(filtered_params, result_summary, ctx, prefetch)
+        finally:
+            if prefetch is not None:
+                prefetch.cancel()
+        await self.remember_part(other_company_pn, search_results, result_summary, filtered_params)
+        print(f"filtered_products: {filtered_products}")
+        await out.write(f"\n\n### Found {filtered_products['total_matches']} potential matching products\n\nDecoding product information...\n\n")
+        #------------------------------------------
+
+        decode_records, decode_result = await self.decode_stage(out, filtered_products, result_summary, ctx)
+        #------------------------------------------
+
+        final_match_result, match_scores = await self.match_stage(
+            out, other_company_pn, filtered_params, result_summary, decode_records, decode_result, ctx
+        )
+        return final_match_result
+
+    def find_variant(self, other_company_pn, ctx):
+        """料號索引中最接近的已解析料號 (part_index.Variant), 沒有時為 None"""
+        if self.part_index is None or ctx.bypass_cache:
+            return None
+        start = time.perf_counter()
+        variant = self.part_index.lookup(other_company_pn)
+        result = "miss" if variant is None else "exact" if variant.exact else "variant"
+        ctx.trace.record(
+            "index", "part", time.perf_counter() - start, result=result,
+            base=variant.part_number if result == "variant" else None,
+            differs=",".join(sorted(variant.differs)) if result == "variant" else None,
+        )
+        if result == "variant":
+            print(f"part index: {other_company_pn} is a variant of {variant.part_number} (differs: {sorted(variant.differs)})")
+        return variant
+
+    def snippet_specs(self, other_company_pn, result_duckduckgo, ctx):
+        """SUMMARY_MODE="snippets": 搜尋摘要中各來源一致的規格 (snippet_specs.SnippetSpecs), 信心不足時為 None"""
+        if self.valves.SUMMARY_MODE != "snippets" or not result_duckduckgo:
+            return None
+        start = time.perf_counter()
+        specs = extract_specs(result_duckduckgo, other_company_pn)
+        confident = specs.confidence >= self.valves.SNIPPET_MIN_CONFIDENCE
+        ctx.trace.record(
+            "extract", "snippets", time.perf_counter() - start, result="hit" if confident else "miss",
+            confidence=round(specs.confidence, 3), sources=specs.sources, relevant=specs.relevant,
+        )
+        print(f"snippet specs: {other_company_pn} {specs.params} confidence {specs.confidence:.2f} "
+              f"from {specs.sources} source(s){'' if confident else ', asking the LLM'}")
+        return specs if confident else None
+
+    def reused_summary(self, variant):
+        """variant 的 summary, 只在所有搜尋結果都能重用 (只差包裝) 時"""
+        if variant is None or len(variant.results(SEARCH_ASPECTS)) < len(SEARCH_ASPECTS):
+            return None
+        return variant.summary
+
+    async def remember_part(self, other_company_pn, search_results, result_summary, filtered_params):
+        """把解析結果加入料號索引; 搜尋全部失敗或沒有篩選參數時不加入"""
+        if self.part_index is None or not filtered_params or not any(search_results.values()):
+            return
+        await asyncio.to_thread(
+            self.part_index.add, other_company_pn,
+            {aspect: results for aspect, results in search_results.items() if results},
+            result_summary, filtered_params,
+        )
+
+    async def shared_lookup(self, out, other_company_pn, ctx):
+        """相同料號的並行請求共用一次 resolve_part: 後到的請求先收到已輸出的片段, 再跟著即時串流
+
+        The run belongs to the request that started it (its trace gets the
+        spans) and keeps going while any request still reads it.
+        """
+        if not self.valves.SINGLE_FLIGHT:
+            return await self.resolve_part(out, other_company_pn, ctx)
+        key = (normalize_part_number(other_company_pn), ctx.bypass_cache)
+        flight, joined = self.flights.join(
+            key, lambda writer: self.resolve_part(writer, other_company_pn, ctx), owner=ctx.trace.request_id
+        )
+        if joined:
+            print(f"single-flight: {other_company_pn} joins request {flight.owner} ({len(flight.buffer.chunks)} chunks already streamed)")
+        ctx.trace.record(
+            "coalesce", "single", joined=joined,
+            owner=flight.owner if joined else None,
+            replayed=len(flight.buffer.chunks) if joined else None,
+        )
+        async for chunk in flight.follow():
+            await out.write(chunk)
+
+    def make_prefetch(self, ctx):
+        if self.valves.PARAMS_MODE != "speculative":
+            return None
+        return SpeculativePrefetch(
+            ParamExtractor(), lambda params, text: self.filter_products(params, text, ctx.trace)
+        )
+
+    async def query_candidates(self, filtered_params, result_summary, ctx, prefetch=None):
+        """篩選候選產品; summary 串流時已用相同參數預先查詢的話直接取用結果"""
+        task = prefetch.take(filtered_params) if prefetch is not None else None
+        if task is not None:
+            print("candidates: using the query started while the summary was streaming")
+            return await task
+        return await self.filter_products(filtered_params, result_summary, ctx.trace)
+
+    async def search_stage(self, out, other_company_pn, ctx, variant=None):
+        """搜尋各面向; 回傳 (合併的結果, {面向: 結果})
+
+        Aspects that a known ``variant`` (see find_variant) already has valid
+        results for are not searched again.
+        """
+        # Step 2: Perform DuckDuckGo searches
+        search_queries = [f"{other_company_pn} {aspect}" for aspect in SEARCH_ASPECTS]
         
-        if not matches:
-            return {}
+        # Modify the method to track and yield search progress
+        await out.write("\n\n### Starting web searches...\n")
         
-        function_text = matches[-1].strip()
-        params = {}
-        param_pattern = r'(\w+)=["\'](.*?)["\']'
-        param_matches = re.findall(param_pattern, function_text)
+        # Searches run concurrently; progress lines are yielded as each query finishes
+        searcher = self.make_searcher()
+        search_results = {}
+        max_retries = searcher.max_retries
+
+        reused = variant.results(SEARCH_ASPECTS) if variant is not None else {}
+        for aspect, results in reused.items():
+            await out.write(f"\n- ♻️ Reusing {len(results)} results of '{variant.part_number} {aspect}'")
+            search_results[f"{other_company_pn} {aspect}"] = results
+
+        async for event in searcher.aiter_search([q for q in search_queries if q not in search_results]):
+            if event.kind == "start":
+                await out.write(f"\n- Searching for: '{event.query}'")
+            elif event.kind == "retry":
+                await out.write(f"\n  - Retry #{event.attempt} for '{event.query}' after {event.wait}s")
+            elif event.kind == "error":
+                await out.write(f"\n  - ❌ Error (attempt {event.attempt}/{max_retries}) searching for '{event.query}': {str(event.error)}")
+            elif event.kind == "done":
+                source = " (cached)" if event.cached else ""
+                await out.write(f"\n  - ✅ Found {len(event.results)} results for '{event.query}'{source}")
+                search_results[event.query] = event.results
+            elif event.kind == "failed":
+                await out.write(f"\n  - ⚠️ All {max_retries} attempts failed for '{event.query}'")
+                search_results[event.query] = []
+            if event.kind in ("done", "failed"):
+                ctx.trace.record(
+                    "search", event.query, event.elapsed,
+                    outcome="cached" if event.cached else event.kind,
+                    retries=max(0, event.attempt - 1), results=len(event.results),
+                )
+                if self.search_cache is not None:
+                    ctx.trace.record("cache", "search", hit=event.cached)
         
-        for param_name, param_value in param_matches:
-            params[param_name] = param_value
+        await out.write("\n\n### Search completed. Analyzing information...\n\n")
+
+
+        result_ddr_type = search_results[search_queries[0]]
+        result_operation_voltage = search_results[search_queries[1]]
+        result_density = search_results[search_queries[2]]
+        result_operating_temperature = search_results[search_queries[3]]
+        result_max_frequency = search_results[search_queries[4]]
+        # Combine all search results
+        result_duckduckgo = result_ddr_type + result_operation_voltage + result_density + result_operating_temperature + result_max_frequency
+        return result_duckduckgo, {aspect: search_results[query] for aspect, query in zip(SEARCH_ASPECTS, search_queries)}
+
+    async def summary_stage(self, out, other_company_pn, result_duckduckgo, ctx, on_content=None):
+        # Step 3: Use OpenRouter API to summarize search results
+        # 依 URL 去除重複結果並只保留標題與摘要, 避免把整個 dict repr 塞進提示詞
+        search_context = compact_search_results(result_duckduckgo, self.valves.SEARCH_SNIPPET_MAX_CHARS)
+        summarize_messages = self.fit_prompt(
+            "summary", SUMMARY.render(part_number=other_company_pn, search_results=search_context), search_context
+        )
+        result_summary = await self.cached_stage(
+            out, "summary", self.stage_key(other_company_pn, result_duckduckgo), ctx,
+            lambda: self.stream_completion(out, ctx, summarize_messages, "summary", on_content, template=SUMMARY),
+        )
+        return result_summary
+
+    async def params_stage(self, out, other_company_pn, result_summary, ctx, extractor=None):
+        # PARAMS_MODE="speculative": summary 已明確寫出型別/電壓/容量時直接採用, 省下一次 LLM 呼叫
+        if extractor is not None:
+            filtered_params = extractor.finish(result_summary)
+            if filtered_params:
+                print(f"params: from summary {filtered_params} (confident after {extractor.confident_at}/{len(result_summary)} chars)")
+                arguments = ", ".join(f'{k}="{v}"' for k, v in filtered_params.items())
+                await out.write(f"Selector arguments taken from the summary: `get_filtered_products({arguments})`\n\n")
+                return filtered_params
+            print("params: summary not conclusive, asking the LLM")
+
+        # Step 4: Extract function parameters for get_filtered_products
+        # 固定的說明 (命名規則, 參數選項, 輸出格式) 在前, 料號與 summary 在後, 讓 Ollama 重用前綴的 KV cache
+        template = PARAMS_JSON if self.valves.PARAMS_OUTPUT == "json" else PARAMS_TAGS
+        extract_params_messages = self.fit_prompt(
+            "params", template.render(part_number=other_company_pn, summary=result_summary), result_summary
+        )
+
+        output = self.valves.PARAMS_OUTPUT
+        if output == "json":
+            key = self.stage_key(other_company_pn, result_summary, output)
+            run = lambda: self.stream_completion(
+                out, ctx, extract_params_messages, "params",
+                extra={"response_format": RESPONSE_FORMAT}, template=template,
+            )
+        else:
+            # 收到 </get_filtered_products> 即關閉串流, 不再生成後面的說明文字
+            key = self.stage_key(other_company_pn, result_summary)
+            run = lambda: self.stream_completion(out, ctx, extract_params_messages, "params", template=template)
+        llm_params_response = await self.cached_stage(out, "params", key, ctx, run)
         
-        return params
-    
-    def pipe(
-        self, user_message: str, model_id: str, messages: List[dict], body: dict
-    ) -> Union[str, Generator, Iterator]:
-        # This is where you can add your custom pipelines like RAG.
-        print(f"pipe:{__name__}")
+        # Print the complete first response content
+        #yield f"\n\n### Summary of Google search results:\n\n{llm_params_response}\n\n"
+        
+        # Extract parameters from the LLM response
+        print(f"llm_params_response: {llm_params_response}")
+        filtered_params = self.extract_function_call(llm_params_response, output)
+        return filtered_params
+
+    async def decode_stage(self, out, filtered_products, result_summary, ctx):
+        # DECODE_MODE="rule": 依 DRAM 命名規則在 Python 中直接解碼, 不需要 LLM decode
+        decode_records, decode_failures = [], []
+        if self.valves.DECODE_MODE == "rule":
+            decode_records, decode_failures = decode_candidates(filtered_products)
 
-        OLLAMA_BASE_URL = "http://ollama:11434"
-        # MODEL = "qwen2.5:latest"
-        MODEL = "qwen2.5-32b-20k:latest"
+        if any(record["decoded"] for record in decode_records):
+            decode_result = compact_candidates(decode_records)
+            await out.write(f"Decoded {len(decode_records) - len(decode_failures)} candidate(s) with the DRAM naming rule")
+            if decode_failures:
+                await out.write(f" (not decodable: {', '.join(f'{f.part_number}: {f.reason}' for f in decode_failures)})")
+            await out.write(f"\n\n{decode_result}\n\n")
+        else:
+            # 候選產品以精簡表格表示; 超出預算時分成多次呼叫
+            candidates = list(iter_candidates(filtered_products))
+            room = max(256, self.valves.DECODE_TOKEN_BUDGET - DECODE.overhead() - estimate_tokens(result_summary))
+            if candidates:
+                candidate_chunks = [table for table, _ in chunk_candidates(candidates, room)]
+            else:
+                candidate_chunks = [fit_text(str(filtered_products), room)]
 
+            decode_parts = []
+            for i, candidate_chunk in enumerate(candidate_chunks):
+                if len(candidate_chunks) > 1:
+                    await out.write(f"\n\n#### Candidates part {i + 1}/{len(candidate_chunks)}\n\n")
+                decode_messages = self.fit_prompt(
+                    "decode", DECODE.render(summary=result_summary, candidates=candidate_chunk), candidate_chunk
+                )
+                decode_part = await self.cached_stage(
+                    out, "decode", self.stage_key(candidate_chunk), ctx,
+                    lambda: self.stream_completion(out, ctx, decode_messages, "decode", template=DECODE),
+                )
+                decode_parts.append(decode_part)
+            decode_result = "\n\n".join(decode_parts)
+        return decode_records, decode_result
+
+    async def match_stage(self, out, other_company_pn, filtered_params, result_summary, decode_records, decode_result, ctx):
+        # Step 6: Find best match
+        # MATCH_MODE="rule": 以規則逐欄比對並直接產生 ✅/❌ 表格, 只有無法判斷的欄位才交給 LLM
+        match_scores = None
+        match_precheck = ""
+        if self.valves.MATCH_MODE == "rule" and any(record["decoded"] for record in decode_records):
+            target = target_from(filtered_params, result_summary)
+            match_scores = score_candidates(decode_records, target)
+            match_table = render_table(match_scores, self.valves.MATCH_TABLE_MAX_ROWS)
+            if needs_llm(match_scores, target):
+                unresolved = sorted(set(target.ambiguous) | {
+                    field for score in match_scores[:1] for field, (status, _) in score.cells.items() if status == UNKNOWN
+                })
+                match_precheck = f"""
+
+A rule-based pre-check already scored every candidate; cells marked ❔ could not be decided by the rules.
+Only the following features still need your judgement: {', '.join(unresolved)}. Keep the ✅/❌ of the other cells.
+<precheck>
+{match_table}
+</precheck>"""
+
+        if match_scores is not None and not match_precheck:
+            final_match_result = f"{match_table}\n\n{render_best_match(match_scores, target)}\n\n"
+            await out.write(f"\n\n{final_match_result}")
+        else:
+            # 規則解碼時依評分順序放入候選, 超出預算的部分捨去 (排在後面的較不符合)
+            if decode_records:
+                ranked = [score.product for score in match_scores] if match_scores else decode_records
+                room = max(256, self.valves.MATCH_TOKEN_BUDGET - MATCH.overhead() - estimate_tokens(result_summary) - estimate_tokens(match_precheck))
+                match_candidates, shown = next(chunk_candidates(ranked, room))
+                if shown < len(ranked):
+                    match_candidates += f"\n({len(ranked) - shown} lower-ranked candidate(s) omitted)"
+            else:
+                match_candidates = decode_result
+            match_messages = self.fit_prompt("match", MATCH.render(
+                part_number=other_company_pn, summary=result_summary, candidates=match_candidates, precheck=match_precheck,
+            ), match_candidates)
+
+            final_match_result = await self.cached_stage(
+                out, "match", self.stage_key(other_company_pn, result_summary, decode_result), ctx,
+                lambda: self.stream_completion(out, ctx, match_messages, "match", template=MATCH),
+            )
+        return final_match_result, match_scores
+
+    async def batch_response(self, out, part_numbers, ctx, duplicates=0, skipped=()):
+        """批次模式: 並行處理多個料號, 每完成一個就輸出一段結果, 最後附上總表
+
+        ``skipped`` are the part numbers beyond BATCH_MAX_PARTS; they are only
+        listed in a notice.
+
+        search/summary/params 依料號各自執行 (搜尋與 LLM 結果都有快取);
+        篩選參數相同的料號共用一次 filter_products 與 decode, 只有 match 依料號執行.
+        """
+        shared = {}
+        slots = asyncio.Semaphore(max(1, self.valves.BATCH_CONCURRENCY))
+
+        async def shared_candidates(filtered_params, result_summary):
+            key = content_hash(filtered_params)
+            future = shared.get(key)
+            if future is None:
+                future = shared[key] = asyncio.get_running_loop().create_future()
+                try:
+                    # 不依單一料號的 summary 預先排序, 排序由各料號的 match 負責
+                    filtered_products = await self.filter_products(filtered_params, "", ctx.trace)
+                    decode_records, decode_result = await self.decode_stage(NULL_WRITER, filtered_products, result_summary, ctx)
+                    future.set_result((filtered_products, decode_records, decode_result))
+                except Exception as e:
+                    future.set_exception(e)
+            return await asyncio.shield(future)
+
+        async def resolve(other_company_pn):
+            async with slots:
+                variant = self.find_variant(other_company_pn, ctx)
+                result_duckduckgo, search_results = await self.search_stage(NULL_WRITER, other_company_pn, ctx, variant)
+                result_summary = self.reused_summary(variant)
+                specs = self.snippet_specs(other_company_pn, result_duckduckgo, ctx) if result_summary is None else None
+                if specs is not None:
+                    result_summary = specs.summary(self.valves.SNIPPET_MIN_CONFIDENCE)
+                elif result_summary is None:
+                    result_summary = await self.summary_stage(NULL_WRITER, other_company_pn, result_duckduckgo, ctx)
+                if variant is not None and variant.params:
+                    filtered_params = variant.params
+                elif specs is not None:
+                    filtered_params = specs.params
+                else:
+                    extractor = ParamExtractor() if self.valves.PARAMS_MODE == "speculative" else None
+                    filtered_params = await self.params_stage(NULL_WRITER, other_company_pn, result_summary, ctx, extractor)
+                await self.remember_part(other_company_pn, search_results, result_summary, filtered_params)
+                filtered_products, decode_records, decode_result = await shared_candidates(filtered_params, result_summary)
+                final_match_result, match_scores = await self.match_stage(
+                    NULL_WRITER, other_company_pn, filtered_params, result_summary, decode_records, decode_result, ctx
+                )
+            return {
+                "filtered_params": filtered_params,
+                "total_matches": filtered_products.get("total_matches", 0),
+                "match_scores": match_scores,
+                "target": target_from(filtered_params, result_summary),
+                "final_match_result": final_match_result,
+            }
+
+        async def resolve_named(other_company_pn):
+            try:
+                return other_company_pn, await resolve(other_company_pn)
+            except Exception as e:
+                print(f"batch: {other_company_pn} failed: {e}")
+                return other_company_pn, e
+
+        def best_match(result):
+            scores = result["match_scores"]
+            if scores is None:
+                return "see LLM result"
+            if not scores:
+                return "—"
+            best = scores[0]
+            return best.product_id if best.full_match else f"closest: {best.product_id} ({best.passed}/{len(best.cells)})"
+
+        await out.write(f"## Batch mode: processing {len(part_numbers)} part numbers")
+        if duplicates:
+            await out.write(f" ({duplicates} duplicate(s) skipped)")
+        await out.write("\n\n")
+        if skipped:
+            await out.write(
+                f"⚠️ {len(skipped)} part number(s) beyond BATCH_MAX_PARTS ({self.valves.BATCH_MAX_PARTS}) were skipped, "
+                f"starting from {skipped[0]}; send them in another request.\n\n"
+            )
+
+        start = time.perf_counter()
+        results = {}
+        tasks = [asyncio.ensure_future(resolve_named(pn)) for pn in part_numbers]
+        try:
+            for done, next_result in enumerate(asyncio.as_completed(tasks), 1):
+                pn, result = await next_result
+                results[pn] = result
+                if isinstance(result, Exception):
+                    await out.write(f"\n\n### [{done}/{len(part_numbers)}] {pn}\n\n❌ Error: {result}\n")
+                    continue
+
+                await out.write(f"\n\n### [{done}/{len(part_numbers)}] {pn}\n\n")
+                await out.write(f"Found {result['total_matches']} potential matching products.\n\n")
+                scores = result["match_scores"]
+                if scores is not None:
+                    await out.write(f"{render_table(scores, self.valves.BATCH_TABLE_ROWS)}\n\n{render_best_match(scores, result['target'])}\n")
+                else:
+                    await out.write(f"{result['final_match_result']}\n")
+        finally:
+            # 使用者中斷時取消尚未完成的料號 (包括進行中的 LLM 串流)
+            for task in tasks:
+                task.cancel()
+
+        print(f"batch: {len(part_numbers)} part numbers in {time.perf_counter() - start:.2f}s, "
+              f"{len(shared)} shared candidate group(s)")
+
+        await out.write("\n\n## Summary\n\n| # | Part number | DDR type | Voltage | Density | Candidates | Best match |\n|---|---|---|---|---|---|---|\n")
+        for i, pn in enumerate(part_numbers, 1):
+            result = results.get(pn)
+            if not isinstance(result, dict):
+                await out.write(f"| {i} | {pn} | | | | | ❌ {result or 'not processed'} |\n")
+                continue
+            params = result["filtered_params"]
+            await out.write(
+                f"| {i} | {pn} | {params.get('type_of_ddr', '')} | {params.get('Operation_Voltage', '')} | "
+                f"{params.get('Density', '')} | {result['total_matches']} | {best_match(result)} |\n"
+            )
+
+    async def traced(self, out, ctx, mode, show_trace, work):
+        """執行整個請求並結算 trace: 更新 metrics, 需要時附上各步驟耗時表"""
+        outcome = "error"
+        try:
+            result = await work
+            outcome = "ok"
+            return result
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            ctx.trace.finish(self.metrics, mode=mode, outcome=outcome)
+            if self.valves.METRICS_PATH:
+                try:
+                    await asyncio.to_thread(
+                        self.metrics.write_textfile, self.valves.METRICS_PATH, [self.get_scheduler().metrics]
+                    )
+                except OSError as e:
+                    print(f"metrics: cannot write {self.valves.METRICS_PATH}: {e}")
+            if show_trace and outcome == "ok":
+                await out.write(f"\n\n### Trace\n\n{ctx.trace.summary()}\n")
+
+    def plan(self, user_message, body):
+        """決定如何回應: 回傳字串 (直接回覆) 或 run(out) coroutine function"""
         if "user" in body:
             print("######################################")
             print(f'# User: {body["user"]["name"]} ({body["user"]["id"]})')
@@ -105,373 +1114,72 @@ class Pipeline:
         
         if "You are an autocompletion system" in user_message:
             return ""
-        
-
-        
-        
 
         try:
-  
-
-            def combined_response():
-
-                # Step 1: Stream initial message
-                other_company_pn = user_message.strip()
-                yield f"## Processing part number: {other_company_pn}\n\nPerforming web search to gather information..."
-                
-                # Step 2: Perform DuckDuckGo searches
-                search_queries = [
-                    f"{other_company_pn} ddr type",
-                    f"{other_company_pn} operation voltage",
-                    f"{other_company_pn} density",
-                    f"{other_company_pn} operating temperature",
-                    f"{other_company_pn} max frequency"
-                ]
-                
-                # Modify the method to track and yield search progress
-                yield "\n\n### Starting web searches...\n"
-                
-                # Instead of directly calling bulk_duckduckgo_search, we'll implement the search logic here
-                # to be able to yield status updates
-                search_results = {}
-                max_results = 5
-                region = 'tw'
-                max_retries = 3
-                
-                for query in search_queries:
-                    yield f"\n- Searching for: '{query}'"
-                    
-                    for retry in range(max_retries):
-                        try:
-                            # If retry, add waiting time
-                            if retry > 0:
-                                wait_time = 2 * retry
-                                yield f"\n  - Retry #{retry} for '{query}' after {wait_time}s"
-                                time.sleep(wait_time)
-                            
-                            # Create new DDGS session for each query
-                            with DDGS() as ddgs:
-                                results = [r for r in ddgs.text(query, max_results=max_results, region=region)]
-                                
-                                yield f"\n  - ✅ Found {len(results)} results for '{query}'"
-                                search_results[query] = results
-                                
-                                # Add random wait time between 0 and 0.5 seconds
-                                random_time = random.uniform(0, 0.5)
-                                time.sleep(random_time)
-                                break
-                        except Exception as e:
-                            yield f"\n  - ❌ Error (attempt {retry+1}/{max_retries}) searching for '{query}': {str(e)}"
-                            # If already retried to maximum times and still failed
-                            if retry == max_retries - 1:
-                                yield f"\n  - ⚠️ All {max_retries} attempts failed for '{query}'"
-                                search_results[query] = []
-                
-                yield "\n\n### Search completed. Analyzing information...\n\n"
-
-
-                result_ddr_type = search_results[search_queries[0]]
-                result_operation_voltage = search_results[search_queries[1]]
-                result_density = search_results[search_queries[2]]
-                result_operating_temperature = search_results[search_queries[3]]
-                result_max_frequency = search_results[search_queries[4]]
-                # Combine all search results
-                result_duckduckgo = result_ddr_type + result_operation_voltage + result_density + result_operating_temperature + result_max_frequency
-            
-
-                # Step 3: Use OpenRouter API to summarize search results
-                summarize_prompt = f"User query: {other_company_pn}\n\n\nGoogle search result: {result_duckduckgo}\n\nSummarize the google search result to satisfy the user query in a detailed way. Do not include any other knowledge, just the google search result. Speed/Frequency should show in Hz, not bps."
-                summary_messages = [{"role": "user", "content": summarize_prompt}]
-                payload = {
-                    "model": MODEL.strip(),
-                    "messages": summary_messages, 
-                    "stream": True
-                }
-                r = requests.post(
-                    url=f"{OLLAMA_BASE_URL}/v1/chat/completions",
-                    json=payload,
-                    stream=payload["stream"]
-                )
-                r.raise_for_status()
-
-                # Collect and process first response
-                result_summary = ""
-
-                # Process first response and collect content
-                for chunk in self.process_llm_response(r):
-                    yield chunk
-                    
-                    # Extract content from chunk
-                    content = self.extract_content_from_chunk(chunk)
-                    if content:
-                        result_summary += content
-                
-                # Print the complete first response content
-                yield f"\n\n### Summary of Google search results:\n\n{result_summary}\n\n"
-                #------------------------------------------
-                
-                # Step 4: Extract function parameters for get_filtered_products
-                extract_params_prompt = f"""
-You are an AI assistant specialized in parsing memory component specifications and translating them into function parameters. Your task is to:
-1. Read and understand the Google search results containing memory specifications
-2. Extract key parameters like DDR type, voltage, density, I/O configuration, and addressing
-3. Map these specifications to the appropriate arguments for the get_filtered_products function
-
-user query for google search: {other_company_pn}
-
-google search result: {result_summary}
-
-the argument for the selector function get_filtered_products is:
-get_filtered_products(
-    type_of_ddr="SDRAM", # can be one of the following: "SDRAM", "DDR SDRAM", "DDR II SDRAM", "DDR3 SDRAM or DDR3(L) SDRAM", "DDR4 SDRAM", "PSRAM", "Mobile SDRAM", "Mobile DDR SDRAM", "LPDDR SDRAM", "LPDDR2 SDRAM", "LPDDR3 SDRAM", "LPDDR4X SDRAM or LPDDR4/LPDDR4X SDRAM"
-    Operation_Voltage="D", # can be one of the following: "L", "S", "F", "T", "U", "D", "Y", "Z"
-    Density="64Mb" # can be one of the following: "8Mb", "16Mb", "32Mb", "64Mb", "128Mb", "256Mb", "512Mb", "1Gb", "2Gb", "4Gb", "8Gb", "16Gb"
-)
+            # body 中帶 "bypass_cache": true 時略過快取讀取 (結果仍會寫回)
+            ctx = RequestContext(
+                self.valves.MODEL, bool(body.get("bypass_cache", False)),
+                Trace(json_log=self.valves.METRICS_JSON_LOG),
+                {
+                    "summary": self.valves.SUMMARY_MODEL,
+                    "params": self.valves.PARAMS_MODEL,
+                    "decode": self.valves.DECODE_MODEL,
+                    "match": self.valves.MATCH_MODEL,
+                },
+            )
+            show_trace = self.valves.TRACE_SUMMARY or bool(body.get("trace", False))
+            ctx.user = (body.get("user") or {}).get("id")
 
-Operation Voltage argument explanation:
-L: 3.3V 
-S: 2.5V
-F: 1.5V
-T: 1.35V
-U: 1.2V
-D: 1.8V (VDD1=1.8V, VDD2=VDDQ=1.2V)
-Y: 1.8V (VDD1=1.8V, VDD2=VDDQ=1.1V)
-Z: 1.8V (VDD1=1.8V, VDD2=1.1V, VDDQ=0.6V)
-
-If the google search result does not contain the information of some arguments, please just don't fill in the argument.
-
-Example get_filtered_products:
-<get_filtered_products>
-get_filtered_products(
-    type_of_ddr="DDR SDRAM",
-    Operation_Voltage="D",
-)
-</get_filtered_products>
-
-You first print chain of thought, then print the get_filtered_products function.
-the printed get_filtered_products function should be between the tag <get_filtered_products> and </get_filtered_products>"""
-                params_messages = [{"role": "user", "content": extract_params_prompt}]
-                payload = {
-                    "model": MODEL.strip(),
-                    "messages": params_messages, 
-                    "stream": True
-                }
-                r = requests.post(
-                    url=f"{OLLAMA_BASE_URL}/v1/chat/completions",
-                    json=payload,
-                    stream=payload["stream"]
-                )
-                r.raise_for_status()
-
-                # Collect and process first response
-                llm_params_response = ""
-
-                # Process first response and collect content
-                for chunk in self.process_llm_response(r):
-                    yield chunk
-                    
-                    # Extract content from chunk
-                    content = self.extract_content_from_chunk(chunk)
-                    if content:
-                        llm_params_response += content
-                
-                # Print the complete first response content
-                #yield f"\n\n### Summary of Google search results:\n\n{llm_params_response}\n\n"
-                
-                # Extract parameters from the LLM response
-                print(f"llm_params_response: {llm_params_response}")
-                filtered_params = self.extract_function_call(llm_params_response)
-
-                filtered_products = get_filtered_products(**filtered_params)
-                print(f"filtered_products: {filtered_products}")
-                yield f"\n\n### Found {filtered_products['total_matches']} potential matching products\n\nDecoding product information...\n\n"
- 
-                #------------------------------------------
-
-                decode_prompt = f"""This is the golden target to be matched:
-{result_summary}
-
-This is the candidate products:
-{filtered_products}
-
-#### DRAM Naming Pattern
-`<Category> <Product Family> <Operation Voltage> <Density> <I/O Pin Number> <Address>`
-
-DRAM_Naming_Rule:
-  Category:
-    - Description: "Category identifier for memory"
-    - Values:
-        - M: "Fixed category for DRAM products"
-
-  Product_Family:
-    - Description: "Defines the DRAM type and generation"
-    - Values:
-      - 12: "SDRAM"
-      - 52: "LP SDRAM"
-      - 13: "DDR SDRAM"
-      - 53: "LPDDR SDRAM"
-      - 14: "DDR2 SDRAM"
-      - 54: "LPDDR2 SDRAM"
-      - 15: "DDR3 SDRAM"
-      - 55: "LPDDR3 SDRAM"
-      - 16: "DDR4 SDRAM"
-      - 56 "LPDDR4/4X SDRAM"
-
-  Operation_Voltage:
-    - Description: "Defines the operating voltage of the DRAM"
-    - Values:
-      - L: "3.3V"
-      - S: "2.5V"
-      - F: "1.5V"
-      - T: "1.35V"
-      - U: "1.2V"
-      - D: "1.8V (VDD=1.8V, VDD2=VDDQ=1.2V)"
-      - Y: "1.8V (VDD=1.8V, VDD2=VDDQ=1.1V)"
-      - Z: "1.8V (VDD=1.8V, VDD2=1.1V, VDDQ=0.6V)"
-
-  Density:
-    - Description: "Defines the storage density of the DRAM"
-    - Values:
-      - "8": "8Mb"
-      - "16": "16Mb"
-      - "32": "32Mb"
-      - "64": "64Mb"
-      - "128": "128Mb"
-      - "256": "256Mb"
-      - "512": "512Mb"
-      - "1G": "1Gb"
-      - "2G": "2Gb"
-      - "4G": "4Gb"
-      - "8G": "8Gb"
-      - "16G": "16Gb"
-
-  I/O_Pin_Number:
-    - Description: "Defines the number of I/O pins for the DRAM"
-    - Values:
-      - "8": "x8"
-      - "16": "x16"
-      - "32": "x32"
-
-  Address: 
-    - Description: "Defines the addressable memory of the DRAM"
-    - Values:
-      - "512": "512Kb"
-      - "1": "1Mb"
-      - "2": "2Mb"
-      - "4": "4Mb"
-      - "8": "8Mb"
-      - "16": "16Mb"
-      - "32": "32Mb"
-      - "64": "64Mb"
-      - "128": "128Mb"
-      - "256": "256Mb"
-      - "512": "512Mb"
-
-Please decode the candidate products by the DRAM Naming Pattern, and also include all the features of the candidate products.
-
-Show the decoded result and all the features of the candidate product ids in json format.
-"""
-                decode_messages = [{"role": "user", "content": decode_prompt}]
-                payload = {
-                    "model": MODEL.strip(),
-                    "messages": decode_messages, 
-                    "stream": True
-                }
-                r = requests.post(
-                    url=f"{OLLAMA_BASE_URL}/v1/chat/completions",
-                    json=payload,
-                    stream=payload["stream"]
+            # 訊息中有多個料號 (每行一個或 CSV) 時進入批次模式
+            part_numbers, duplicates = parse_part_numbers(user_message)
+            ctx.priority = BATCH if len(part_numbers) > 1 else LOOKUP
+            # 佇列已滿時直接回覆, 不讓新請求無限排隊
+            if not self.get_scheduler().admit(ctx.priority):
+                print(f"scheduler: rejected a {ctx.priority} request, queue full {self.get_scheduler().stats()}")
+                return "⚠️ The model server is busy right now, please try again in a moment."
+            if len(part_numbers) > 1:
+                # 超過上限的料號不處理, 但在輸出中註明, 不默默丟棄
+                skipped = part_numbers[self.valves.BATCH_MAX_PARTS:]
+                part_numbers = part_numbers[:self.valves.BATCH_MAX_PARTS]
+                if skipped:
+                    print(f"batch: {len(skipped)} part numbers beyond BATCH_MAX_PARTS ({self.valves.BATCH_MAX_PARTS}) skipped")
+                return lambda out: self.traced(
+                    out, ctx, "batch", show_trace, self.batch_response(out, part_numbers, ctx, duplicates, skipped)
                 )
-                r.raise_for_status()
-
-                # Collect and process first response
-                decode_result = ""
-
-                # Process first response and collect content
-                for chunk in self.process_llm_response(r):
-                    yield chunk
-                    
-                    # Extract content from chunk
-                    content = self.extract_content_from_chunk(chunk)
-                    if content:
-                        decode_result += content
-
-                #------------------------------------------
-
-                # Step 6: Find best match
-                match_prompt = f"""You are an AI assistant specialized in matching memory component specifications to golden target. Your task is to:
-1. Read and understand the golden target to be matched
-2. Read and understand the decoded result and all the features of the candidate products
-3. Match the golden target with the candidate products based on the features
-
-Original user query for golden target: <query>{other_company_pn}</query>
-
-This is the golden target's description. The golden target is the product that the user wants to match:
-<golden_target_description>{result_summary}</golden_target_description>
-
-And this is the decoded result and all the features of the candidate products:
-<candidate>{decode_result}</candidate>
-
-Some rules you should know:
-- If the golden target's description says that '533 MHz clock speed,' it means that the golden target's clock max frequency is 533 MHz.
-- If the golden target's description says that it is 0°C to 85°C, you can select candidate products's operation temperature range: 0°C to 85°C, or can be wider: 0°C to 95°C, but you cannot select: -40°C to 95°C as the Best Match.
-- Only select the product ID(s) that fully meet the golden target's required max frequency.
-- 1600 MHz is equal to 1.6 GHz.
-
-Show me a markdown table with ✅ or ❌ compared with golden target for every single feature for each candidate product.
-In each table cell, please first tell reason and then tell the result ✅ or ❌
-
-And then for the best match part_number in the table, analyze the reason and tell me the best match product_id under the part_number"""
-            
-                match_messages = [{"role": "user", "content": match_prompt}]
-                payload = {
-                    "model": MODEL.strip(),
-                    "messages": match_messages, 
-                    "stream": True
-                }
-                r = requests.post(
-                    url=f"{OLLAMA_BASE_URL}/v1/chat/completions",
-                    json=payload,
-                    stream=payload["stream"]
-                )
-                r.raise_for_status()
-
-                # Collect and process first response
-                final_match_result = ""
 
-                # Process first response and collect content
-                for chunk in self.process_llm_response(r):
-                    yield chunk
-                    
-                    # Extract content from chunk
-                    content = self.extract_content_from_chunk(chunk)
-                    if content:
-                        final_match_result += content
-
-
-                
-
-
-            
-            return combined_response()
+            # 單一料號也取解析結果 (例如 "PN,100" 只查 PN); 解析不出料號時照原文查詢
+            other_company_pn = part_numbers[0] if part_numbers else user_message.strip()
+            return lambda out: self.traced(
+                out, ctx, "single", show_trace, self.shared_lookup(out, other_company_pn, ctx)
+            )
         
         except Exception as e:
             return f"Error: {e}"
-    
-    def process_llm_response(self, response):
-        """Process a streaming LLM response and yield each chunk."""
-        for line in response.iter_lines():
-            if line:
-                yield line
-    
-    def extract_content_from_chunk(self, chunk):
-        """Extract text content from a response chunk."""
-        try:
-            data = json.loads(chunk.decode('utf-8').replace('data: ', ''))
-            if 'choices' in data and len(data['choices']) > 0:
-                if 'delta' in data['choices'][0] and 'content' in data['choices'][0]['delta']:
-                    return data['choices'][0]['delta']['content']
-        except:
-            pass
-        return ""
-    
+
+    def make_coalescer(self):
+        """每個回應各自的 output_stream.Coalescer; "sse" 格式或窗口為 0 時不合併"""
+        if self.valves.STREAM_FORMAT == "sse" or self.valves.STREAM_COALESCE_MS <= 0:
+            return None
+        return Coalescer(self.valves.STREAM_COALESCE_MS / 1000, self.valves.STREAM_COALESCE_BYTES)
+
+    def pipe(
+        self, user_message: str, model_id: str, messages: List[dict], body: dict
+    ) -> Union[str, Generator, Iterator]:
+        # This is where you can add your custom pipelines like RAG.
+        print(f"pipe:{__name__}")
+        run = self.plan(user_message, body)
+        if isinstance(run, str):
+            return run
+        # pipelines server 以同步方式迭代回應; 所有請求的 I/O 都在共用的 event loop 上進行,
+        # 呼叫端的執行緒只在等待下一個片段
+        return self.loop.iterate(stream_task(run, self.valves.STREAM_BUFFER_CHUNKS, self.make_coalescer()))
+
+    def apipe(
+        self, user_message: str, model_id: str, messages: List[dict], body: dict
+    ) -> Union[str, AsyncIterator]:
+        """pipe 的 async 版本: 回傳 async generator, 供可直接消費 async generator 的呼叫端使用"""
+        print(f"apipe:{__name__}")
+        run = self.plan(user_message, body)
+        if isinstance(run, str):
+            return run
+        return self.loop.aiterate(stream_task(run, self.valves.STREAM_BUFFER_CHUNKS, self.make_coalescer()))
@@ -0,0 +1,26 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.cache import SQLiteCache
+from pipeline_utils.part_index import PartIndex
+
+
+def test_lookup_drops_records_older_than_ttl():
+    index = PartIndex(ttl=60)
+    index.add("MT41K256M16TW-107", {"density": [{"title": "4Gb"}]}, "summary", {"Density": "4Gb"})
+    assert index.lookup("MT41K256M16TW-107 IT") is not None
+    for record in index.entries.values():
+        record["at"] -= 120
+    assert index.lookup("MT41K256M16TW-107 IT") is None
+    assert len(index) == 0 and index.root == {}
+
+
+def test_trie_is_bounded_like_its_store():
+    store = SQLiteCache(":memory:", namespace="part_index", max_entries=2)
+    index = PartIndex(store)
+    for part_number in ("MT41K256M16TW-107", "H5TQ4G63EFR-RDC", "K4B4G1646E-BYMA"):
+        index.add(part_number, params={"Density": "4Gb"})
+    assert len(index) == 2 == len(store.items())
+    assert index.lookup("MT41K256M16TW-107") is None
+    assert index.lookup("K4B4G1646E-BYMA").exact
@@ -0,0 +1,32 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_utils.prompting import chunk_candidates
+
+PRODUCTS = [
+    {"product_id": "M15T4G16256A-DEBG2S", "max_frequency": "800MHz", "operating_temperature": "0°C to 95°C"},
+    {"product_id": "M15T4G16256A-DEBG2", "max_frequency": "933MHz", "operating_temperature": "-40°C to 95°C"},
+    {"product_id": "M15T4G16256A-GEBG2", "max_frequency": "1066MHz", "operating_temperature": "-40°C to 105°C"},
+]
+
+
+def test_single_candidate_counts_its_row():
+    # 只有一個候選時沒有 "Common to all candidates" 行, 表頭就是第一行
+    [(table, rows)] = chunk_candidates(PRODUCTS[:1], 1000)
+    assert not table.startswith("Common")
+    assert rows == 1
+
+
+def test_candidates_without_common_fields():
+    [(table, rows)] = chunk_candidates(PRODUCTS, 1000)
+    assert not table.startswith("Common")
+    assert rows == len(PRODUCTS)
+
+
+def test_chunks_cover_every_row():
+    chunks = list(chunk_candidates(PRODUCTS * 10, 60))
+    assert len(chunks) > 1
+    assert sum(rows for _, rows in chunks) == len(PRODUCTS) * 10
+    # 表頭也以 "| " 開頭
+    assert all(sum(line.startswith("| ") for line in table.split("\n")) - 1 == rows for table, rows in chunks)
@@ -1,10 +1,43 @@
-from typing import List, Union, Generator, Iterator
+from typing import AsyncIterator, List, Union, Generator, Iterator
 from schemas import OpenAIChatMessage
-import requests
-import json
-
+from pydantic import BaseModel
+
+import sys
+import os
+from contextlib import aclosing
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from pipeline_utils.async_ollama_client import STREAM_ERRORS, AsyncOllamaClient
+from pipeline_utils.backends import BackendPool, Failover, health_loop
+from pipeline_utils.output_stream import Coalescer
+from pipeline_utils.scheduler import INTERACTIVE, shared_scheduler
+from pipeline_utils.sse import SSEDecoder
+from pipeline_utils.streaming import BackgroundLoop, stream_task
 
 class Pipeline:
+    class Valves(BaseModel):
+        # Ollama 後端; 多台以逗號分隔, 依進行中的請求數分配 (least outstanding requests)
+        OLLAMA_BASE_URL: str = "http://ollama:11434"
+        MODEL: str = "qwen2.5:latest"
+        # 後端健康檢查間隔 (秒, 0 = 不檢查); 串流中途出錯時改由其他後端接續的次數
+        OLLAMA_HEALTH_INTERVAL: float = 15.0
+        OLLAMA_FAILOVER_ATTEMPTS: int = 2
+        # Ollama 連線池大小與逾時 (秒); read timeout 為兩個串流片段間的最長間隔
+        OLLAMA_POOL_SIZE: int = 10
+        OLLAMA_CONNECT_TIMEOUT: float = 5.0
+        OLLAMA_READ_TIMEOUT: float = 300.0
+        # 每台後端同時處理的請求上限與排程限制; 與使用同一組後端的其他 pipeline (pn.py) 共用, 對話優先
+        OLLAMA_MAX_INFLIGHT: int = 4
+        SCHEDULER_PER_USER: int = 2
+        SCHEDULER_MAX_QUEUE: int = 64
+        SCHEDULER_AGING: float = 10.0
+        # 輸出格式: "content" 只送出文字並合併成較大的片段; "sse" 逐一轉送 Ollama 的原始 SSE 行
+        # 合併的時間與大小窗口 (ms / bytes; 0 ms = 不合併), 只在不會打斷 markdown 區塊的位置切開
+        STREAM_FORMAT: str = "content"
+        STREAM_COALESCE_MS: float = 30.0
+        STREAM_COALESCE_BYTES: int = 256
+        # 等待用戶端讀取的片段上限; 超過時暫停讀取 Ollama 的串流 (back-pressure)
+        STREAM_BUFFER_CHUNKS: int = 64
+
     def __init__(self):
         # Optionally, you can set the id and name of the pipeline.
         # Best practice is to not specify the id so that it can be automatically inferred from the filename, so that users can install multiple versions of the same pipeline.
@@ -12,27 +45,129 @@ class Pipeline:
         # The identifier must be an alphanumeric string that can include underscores or hyphens. It cannot contain spaces, special characters, slashes, or backslashes.
         # self.id = "ollama_pipeline"
         self.name = "Ollama Pipeline"
+        self.valves = self.Valves()
+        self.ollama = None
+        self.backends = None
+        self.scheduler = None
+        self.health_task = None
+        # 所有請求共用的 event loop (在背景執行緒中執行)
+        self.loop = BackgroundLoop("ollama-pipeline")
         pass
 
     async def on_startup(self):
         # This function is called when the server is started.
         print(f"on_startup:{__name__}")
+        self.loop.start()
+        self.start_health_checks()
         pass
 
     async def on_shutdown(self):
         # This function is called when the server is stopped.
         print(f"on_shutdown:{__name__}")
+        if self.health_task is not None:
+            self.health_task.cancel()
+            self.health_task = None
+        if self.ollama is not None:
+            # aiohttp session 屬於背景 loop, 需在該 loop 上關閉
+            self.loop.run(self.ollama.close())
+            self.ollama = None
+        self.loop.stop()
+        self.backends = None
+        self.scheduler = None
         pass
 
-    def pipe(
-        self, user_message: str, model_id: str, messages: List[dict], body: dict
-    ) -> Union[str, Generator, Iterator]:
-        # This is where you can add your custom pipelines like RAG.
-        print(f"pipe:{__name__}")
-
-        OLLAMA_BASE_URL = "http://ollama:11434"
-        MODEL = "qwen2.5:latest "
-
+    async def on_valves_updated(self):
+        # 後端 URL, 金鑰或並行上限改變時重新建立後端池, 連線與排程器;
+        # 不重啟背景 loop, 以免中斷其他進行中的請求
+        if self.health_task is not None:
+            self.health_task.cancel()
+            self.health_task = None
+        if self.ollama is not None:
+            self.loop.run(self.ollama.close())
+            self.ollama = None
+        self.backends = None
+        self.scheduler = None
+        self.start_health_checks()
+
+    def get_ollama_client(self):
+        """取得共用的 Ollama 連線池 (若尚未建立則依 valves 建立)"""
+        if self.ollama is None:
+            self.ollama = AsyncOllamaClient(
+                pool_size=self.valves.OLLAMA_POOL_SIZE,
+                connect_timeout=self.valves.OLLAMA_CONNECT_TIMEOUT,
+                read_timeout=self.valves.OLLAMA_READ_TIMEOUT,
+            )
+        return self.ollama
+
+    def get_backends(self):
+        """取得 Ollama 後端池 (若尚未建立則依 valves 建立)"""
+        if self.backends is None:
+            self.backends = BackendPool.from_urls(self.valves.OLLAMA_BASE_URL)
+        return self.backends
+
+    def start_health_checks(self):
+        if self.valves.OLLAMA_HEALTH_INTERVAL > 0 and self.health_task is None:
+            client = self.get_ollama_client()
+            self.health_task = self.loop.spawn(health_loop(
+                self.get_backends(), lambda b: client.list_models(b.url, b.headers()),
+                self.valves.OLLAMA_HEALTH_INTERVAL,
+            ))
+
+    def get_scheduler(self):
+        """使用同一組 Ollama 後端的所有 pipeline 共用的排程器, 名額與上限依 valves 設定"""
+        if self.scheduler is None:
+            self.scheduler = shared_scheduler(
+                self.valves.OLLAMA_BASE_URL,
+                slots=max(1, self.valves.OLLAMA_MAX_INFLIGHT) * len(self.get_backends()),
+                per_user=self.valves.SCHEDULER_PER_USER,
+                max_queue=self.valves.SCHEDULER_MAX_QUEUE,
+                aging=self.valves.SCHEDULER_AGING,
+            )
+        return self.scheduler
+
+    async def scheduled_completion(self, out, payload, user=None):
+        """stream_completion 在共用排程器取得名額後執行; 排隊訊息與回覆寫入 out, 回傳完整回覆"""
+        ticket = self.get_scheduler().enqueue(INTERACTIVE, user)
+        try:
+            async for ahead in ticket.wait_async():
+                await out.write(f"\n\n⏳ 排隊中, 前面還有 {ahead} 個請求...\n\n")
+            return await self.stream_completion(out, payload)
+        finally:
+            ticket.release()
+
+    def make_coalescer(self):
+        """每個回應各自的 output_stream.Coalescer; "sse" 格式或窗口為 0 時不合併"""
+        if self.valves.STREAM_FORMAT == "sse" or self.valves.STREAM_COALESCE_MS <= 0:
+            return None
+        return Coalescer(self.valves.STREAM_COALESCE_MS / 1000, self.valves.STREAM_COALESCE_BYTES)
+
+    async def stream_completion(self, out, payload):
+        """串流呼叫 chat completions 並寫入 out ("sse" 格式時為原始 SSE 行); 回傳完整回覆
+
+        The request goes to the least busy backend; if it fails, also
+        mid-stream, the next backend continues from what was already streamed
+        (backends.Failover).
+        """
+        client = self.get_ollama_client()
+        failover = Failover(
+            self.get_backends(), lambda backend, request: client.stream_chat(backend.url, request, backend.headers()),
+            STREAM_ERRORS, self.valves.OLLAMA_FAILOVER_ATTEMPTS, model=payload["model"],
+        )
+        raw_output = self.valves.STREAM_FORMAT == "sse"
+        decoder = SSEDecoder()
+        # 使用者中斷時 task 被取消, 串流連同連線一併關閉 (Ollama 隨即停止生成)
+        async with aclosing(failover.aevents(payload, decoder)) as events:
+            async for event in events:
+                # [DONE] 由 pipelines server 在整個回應結束時送出
+                if raw_output and not event.done:
+                    await out.write(event.raw)
+                elif event.content:
+                    await out.write(event.content)
+        return decoder.text()
+
+    def plan(self, user_message, messages, body):
+        """依請求決定回應: 直接回覆的字串, 或在背景 loop 上執行的 run(out) (寫入 streaming.StreamWriter)"""
+        MODEL = self.valves.MODEL
         if "user" in body:
             print("######################################")
             print(f'# User: {body["user"]["name"]} ({body["user"]["id"]})')
@@ -43,99 +178,75 @@ class Pipeline:
         if user_message.startswith("Create a concise"):
             return "我是標題"
 
-        try:
-  
-
-            def combined_response():
-                #--------------------- first start ---------------------
-                payload = {
-                    "model": MODEL.strip(),
-                    "messages": messages, 
-                    "stream": True
-                }
-
-                r = requests.post(
-                    url=f"{OLLAMA_BASE_URL}/v1/chat/completions",
-                    json=payload,
-                    stream=payload["stream"]
-                )
-
-                r.raise_for_status()
-
-
-                # Collect and process first response
-                first_response_content = ""
-                
-                # Process first response and collect content
-                for chunk in self.process_llm_response(r):
-                    yield chunk
-                    
-                    # Extract content from chunk
-                    content = self.extract_content_from_chunk(chunk)
-                    if content:
-                        first_response_content += content
-                
-                # Print the complete first response content
-                print("First response complete content:", first_response_content)
-
-                #--------------------- first end ---------------------
-                
-                # 顯示字串在UI (注意: 顯示的字串會含在聊天記錄中)
-                yield """\n\n## 注意: 我是一段要被顯示在UI上的字串!!!我會含在聊天記錄中\n\n""" # 記得\n\n 要加在字串後面, 否則 markdown 語法會傳到後面字串
-                yield "\n\n### Second answer:\n\n"
-                yield "\n\n River is 24 years old\n\n"
-                
-                #--------------------- second start ---------------------
-                second_messages = [{"role": "user", "content": f"{first_response_content}\n\n以上说了啥?"}]
-
-                second_payload = {
-                    "model": MODEL.strip(),
-                    "messages": second_messages,
-                    "stream": True
-                }
-                
-                second_r = requests.post(
-                    url=f"{OLLAMA_BASE_URL}/v1/chat/completions",
-                    json=second_payload,
-                    stream=True
-                )
-                
-                second_r.raise_for_status()
-
-                second_response_content = ""
-                
-                # Process first response and collect content
-                for chunk in self.process_llm_response(second_r):
-                    yield chunk
-                    
-                    # Extract content from chunk
-                    content = self.extract_content_from_chunk(chunk)
-                    if content:
-                        second_response_content += content
-                
-                # Print the complete first response content
-                print("Second response complete content:", second_response_content)
-                #--------------------- second end ---------------------
+        user = (body.get("user") or {}).get("id")
+        # 佇列已滿時直接回覆, 不讓新請求無限排隊
+        if not self.get_scheduler().admit(INTERACTIVE):
+            print(f"scheduler: rejected a chat request, queue full {self.get_scheduler().stats()}")
+            return "⚠️ 伺服器忙碌中, 請稍後再試"
+
+        async def combined_response(out):
+            #--------------------- first start ---------------------
+            payload = {
+                "model": MODEL.strip(),
+                "messages": messages, 
+                "stream": True
+            }
+
+            # Process first response and collect content
+            first_response_content = await self.scheduled_completion(out, payload, user)
             
-            return combined_response()
-        
+            # Print the complete first response content
+            print("First response complete content:", first_response_content)
+
+            #--------------------- first end ---------------------
+            
+            # 顯示字串在UI (注意: 顯示的字串會含在聊天記錄中)
+            await out.write("""\n\n## 注意: 我是一段要被顯示在UI上的字串!!!我會含在聊天記錄中\n\n""") # 記得\n\n 要加在字串後面, 否則 markdown 語法會傳到後面字串
+            await out.write("\n\n### Second answer:\n\n")
+            await out.write("\n\n River is 24 years old\n\n")
+            
+            #--------------------- second start ---------------------
+            second_messages = [{"role": "user", "content": f"{first_response_content}\n\n以上说了啥?"}]
+
+            second_payload = {
+                "model": MODEL.strip(),
+                "messages": second_messages,
+                "stream": True
+            }
+
+            # Process second response and collect content
+            second_response_content = await self.scheduled_completion(out, second_payload, user)
+            
+            # Print the complete first response content
+            print("Second response complete content:", second_response_content)
+            #--------------------- second end ---------------------
+
+        return combined_response
+
+    def pipe(
+        self, user_message: str, model_id: str, messages: List[dict], body: dict
+    ) -> Union[str, Generator, Iterator]:
+        # This is where you can add your custom pipelines like RAG.
+        print(f"pipe:{__name__}")
+        try:
+            run = self.plan(user_message, messages, body)
         except Exception as e:
             return f"Error: {e}"
-    
-    def process_llm_response(self, response):
-        """Process a streaming LLM response and yield each chunk."""
-        for line in response.iter_lines():
-            if line:
-                yield line
-    
-    def extract_content_from_chunk(self, chunk):
-        """Extract text content from a response chunk."""
+        if isinstance(run, str):
+            return run
+        # pipelines server 以同步方式迭代回應; 所有請求的 I/O 都在共用的 event loop 上進行,
+        # 呼叫端的執行緒只在等待下一個片段
+        return self.loop.iterate(stream_task(run, self.valves.STREAM_BUFFER_CHUNKS, self.make_coalescer()))
+
+    def apipe(
+        self, user_message: str, model_id: str, messages: List[dict], body: dict
+    ) -> Union[str, AsyncIterator]:
+        """pipe 的 async 版本: 回傳 async generator, 供可直接消費 async generator 的呼叫端使用"""
+        print(f"apipe:{__name__}")
         try:
-            data = json.loads(chunk.decode('utf-8').replace('data: ', ''))
-            if 'choices' in data and len(data['choices']) > 0:
-                if 'delta' in data['choices'][0] and 'content' in data['choices'][0]['delta']:
-                    return data['choices'][0]['delta']['content']
-        except:
-            pass
-        return ""
-    
+            run = self.plan(user_message, messages, body)
+        except Exception as e:
+            return f"Error: {e}"
+        if isinstance(run, str):
+            return run
+        return self.loop.aiterate(stream_task(run, self.valves.STREAM_BUFFER_CHUNKS, self.make_coalescer()))